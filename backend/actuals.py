@@ -0,0 +1,172 @@
+import hashlib, os, re, shutil, threading
+import numpy as np
+import pandas as pd
+
+import forecasting
+
+
+# -------------------------------
+# Indexed actuals
+# -------------------------------
+class Actuals:
+    """
+    A test set held as a dense (products x months) sales matrix with the
+    product and month indexes, so scoring a forecast is two get_indexer
+    calls and a gather instead of a file parse and a merge. Sales are
+    normalized as run_forecast always did (month-start dates, missing sales
+    as 0); duplicate (product, month) rows are summed.
+    """
+
+    def __init__(self, df, version=None):
+        missing = [c for c in ('date', 'product_code', 'sales') if c not in df.columns]
+        if missing:
+            raise ValueError(f"actuals need columns {', '.join(missing)}")
+        dates = pd.to_datetime(df['date']).dt.to_period('M').dt.to_timestamp()
+        codes = df['product_code'].astype(str).to_numpy(dtype=object)
+        self.products = pd.Index(np.unique(codes))
+        self.months = pd.DatetimeIndex(np.unique(dates.to_numpy()))
+        p = self.products.get_indexer(codes)
+        m = self.months.get_indexer(dates)
+        self.values = np.zeros((len(self.products), len(self.months)))
+        np.add.at(self.values, (p, m), df['sales'].fillna(0).to_numpy(dtype=float))
+        present = np.zeros(self.values.shape, dtype=bool)
+        present[p, m] = True
+        self.values[~present] = np.nan
+        self.rows = len(df)
+        self.version = version
+
+    def lookup(self, product_codes, dates):
+        """Actual sales for each (product, month) pair; NaN where there is none."""
+        p = self.products.get_indexer(pd.Index(product_codes).astype(str))
+        m = self.months.get_indexer(pd.DatetimeIndex(dates))
+        out = np.full(len(p), np.nan)
+        ok = (p >= 0) & (m >= 0)
+        out[ok] = self.values[p[ok], m[ok]]
+        return out
+
+    def frame(self, months=None):
+        """Long (date, product_code, sales) rows, only for months when given."""
+        cols = np.arange(len(self.months)) if months is None else self.months.get_indexer(months)
+        cols = cols[cols >= 0]
+        p, j = np.nonzero(~np.isnan(self.values[:, cols]))
+        return pd.DataFrame({
+            'date': self.months[cols[j]],
+            'product_code': self.products.to_numpy()[p],
+            'sales': self.values[p, cols[j]],
+        })
+
+    def describe(self):
+        return {
+            'rows': self.rows,
+            'products': len(self.products),
+            'first_month': self.months.min().strftime('%Y-%m-%d') if len(self.months) else None,
+            'last_month': self.months.max().strftime('%Y-%m-%d') if len(self.months) else None,
+            'version': self.version,
+        }
+
+
+_loaded = {}
+_lock = threading.Lock()
+
+def _digest(path, block_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def load(path):
+    """
+    Actuals for a test file, parsed once per process. A changed mtime or
+    size re-hashes the file, and only changed bytes are parsed again.
+    """
+    key = os.path.abspath(path)
+    st = os.stat(key)
+    stamp = (st.st_mtime_ns, st.st_size)
+    with _lock:
+        entry = _loaded.get(key)
+    if entry is not None and entry[0] == stamp:
+        return entry[1]
+    digest = _digest(key)
+    if entry is not None and entry[1].version == digest:
+        actuals = entry[1]
+    else:
+        df = forecasting.read_sales_file(key, columns=['date', 'product_code', 'sales'])
+        actuals = Actuals(df, version=digest)
+    with _lock:
+        _loaded[key] = (stamp, actuals)
+    return actuals
+
+
+# -------------------------------
+# Named actuals
+# -------------------------------
+NAME_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+class ActualsRegistry:
+    """
+    Named test sets that requests pick by name. Uploaded ones are kept as
+    <root>/<name><ext> and found again on restart; register_path() adds an
+    existing file (e.g. test.csv as 'default') without copying it.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._paths = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        for fname in sorted(os.listdir(root)):
+            name = os.path.splitext(fname)[0]
+            if NAME_PATTERN.match(name):
+                self._paths[name] = os.path.join(root, fname)
+
+    def register_path(self, name, path):
+        with self._lock:
+            self._paths[name] = path
+
+    def save(self, name, source, filename):
+        """Store an uploaded test set under name (replacing it); returns its description."""
+        if not NAME_PATTERN.match(name or ''):
+            raise ValueError("actuals name must be 1-64 letters, digits, '_' or '-'")
+        ext = os.path.splitext(filename)[1].lower() or '.csv'
+        path = os.path.join(self.root, name + ext)
+        tmp = f"{path}.{threading.get_ident()}.tmp{ext}"
+        if isinstance(source, str):
+            shutil.copyfile(source, tmp)
+        else:
+            with open(tmp, 'wb') as f:
+                f.write(source.getbuffer())
+        try:
+            # parse before it replaces anything, so a bad file is a 400 and not a broken name
+            Actuals(forecasting.read_sales_file(tmp, columns=['date', 'product_code', 'sales']))
+        except Exception:
+            os.remove(tmp)
+            raise
+        with self._lock:
+            old = self._paths.get(name)
+            os.replace(tmp, path)
+            if old and old != path and os.path.dirname(old) == self.root:
+                os.remove(old)
+            self._paths[name] = path
+        return self.describe(name)
+
+    def path(self, name):
+        """File behind name; KeyError when unknown."""
+        with self._lock:
+            return self._paths[name]
+
+    def get(self, name):
+        return load(self.path(name))
+
+    def names(self):
+        with self._lock:
+            return sorted(self._paths)
+
+    def describe(self, name):
+        return {'name': name, **self.get(name).describe()}
+
+    def delete(self, name):
+        with self._lock:
+            path = self._paths.pop(name)
+        if os.path.dirname(path) == self.root:
+            os.remove(path)
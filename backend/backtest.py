@@ -0,0 +1,177 @@
+import math
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
+import pandas as pd
+
+from forecasting import (
+    SALES_COLUMNS, PANEL_METHODS, load_data, preprocess_panel, forecast_panel, resolve_method,
+    resolve_workers, compute_metrics_grouped, aggregate_metrics, _forecast_product,
+    PARALLEL_MIN_PRODUCTS,
+)
+from sharedpanel import SharedPanel
+
+
+# -------------------------------
+# Folds
+# -------------------------------
+def make_folds(months, horizon=6, step=3, folds=3, min_train=24):
+    """
+    Rolling-origin folds over a monthly history, oldest first: the last fold
+    forecasts the final `horizon` months and each earlier one moves the cutoff
+    back `step` months. Folds leaving under min_train months of training are
+    dropped. Returns [(cutoff, forecast_months)].
+    """
+    months = pd.DatetimeIndex(months).sort_values()
+    out = []
+    for k in range(folds):
+        end = len(months) - 1 - k * step
+        cut = end - horizon
+        if cut + 1 < min_train:
+            break
+        out.append((months[cut], months[cut + 1:end + 1]))
+    if not out:
+        raise ValueError(f"{len(months)} months of history is too short for a {horizon}-month "
+                         f"backtest with {min_train} training months")
+    return out[::-1]
+
+
+# -------------------------------
+# Fold forecasts
+# -------------------------------
+def _backtest_chunk(chunk, folds, regressors, method):
+    # all folds of a product run in one task, oldest first, so each Prophet
+    # fit starts from the parameters of the fold before it
+    rows = []
+    for prod, g in chunk:
+        warm_start = {}
+        for i, (cutoff, forecast_months) in enumerate(folds):
+            out = _forecast_product(prod, g[g['date'] <= cutoff], forecast_months, regressors,
+                                    method=method, warm_start=warm_start)
+            rows.extend({**r, 'fold': i} for r in out)
+    return rows
+
+def backtest_panel(processed_df, folds, method=None, regressors=['mrp','discount','rating'],
+                   n_jobs=None, chunk_size=None, progress=None, pool=None):
+    """
+    Forecasts for every fold from preprocess_panel output. Vectorized methods
+    (and Router) forecast each fold's panel in one call. Per-product methods
+    are split into product chunks that carry all folds, so folds x products
+    run in parallel on the pool (at most n_jobs of its workers; None for all)
+    or on n_jobs processes, and Prophet warm-starts across folds. Returns
+    fold, date, product_code, forecast rows.
+    """
+    method = resolve_method(method)
+    if method in PANEL_METHODS or method == 'Router':
+        parts = []
+        for i, (cutoff, forecast_months) in enumerate(folds):
+            fc = forecast_panel(processed_df[processed_df['date'] <= cutoff], forecast_months,
+                                regressors, n_jobs=n_jobs, chunk_size=chunk_size, method=method, pool=pool)
+            parts.append(fc.assign(fold=i))
+            if progress:
+                progress(i + 1, len(folds))
+        return pd.concat(parts, ignore_index=True)
+
+    n_products = processed_df['product_code'].nunique()
+    if pool is not None:
+        workers = pool.max_workers if n_jobs is None else min(resolve_workers(n_jobs), pool.max_workers)
+    else:
+        workers = min(resolve_workers(n_jobs), n_products)
+    rows = []
+    if pool is None and (workers <= 1 or n_products < PARALLEL_MIN_PRODUCTS):
+        groups = list(processed_df.groupby('product_code'))
+        for i, (prod, g) in enumerate(groups, 1):
+            rows.extend(_backtest_chunk([(prod, g)], folds, regressors, method))
+            if progress:
+                progress(i, len(groups))
+    elif n_products:
+        if not chunk_size:
+            chunk_size = max(1, math.ceil(n_products / (workers * 4)))
+        shared = SharedPanel(processed_df, ['sales'] + [r for r in regressors if r in processed_df.columns])
+        chunks = shared.chunks(chunk_size)
+        executor = pool if pool is not None else ProcessPoolExecutor(max_workers=workers)
+        map_args = (_backtest_chunk, chunks, repeat(folds), repeat(regressors), repeat(method))
+        try:
+            done = 0
+            results = pool.map(*map_args, max_in_flight=workers) if pool is not None else executor.map(*map_args)
+            for chunk, out in zip(chunks, results):
+                rows.extend(out)
+                done += len(chunk)
+                if progress:
+                    progress(done, n_products)
+        finally:
+            if pool is None:
+                executor.shutdown()
+            shared.close()
+    return pd.DataFrame(rows, columns=['date', 'product_code', 'forecast', 'fold'])
+
+
+# -------------------------------
+# Scoring
+# -------------------------------
+def score(forecasts, processed_df, folds):
+    """
+    Per-product metrics over all folds and horizons, their means, and the
+    means for each fold, all from compute_metrics_grouped.
+    """
+    actuals = processed_df[['date', 'product_code', 'sales']]
+    merged = forecasts.merge(actuals, on=['date', 'product_code'], how='left')
+    merged = merged.sort_values(['fold', 'date', 'product_code'], kind='stable')
+    a = np.nan_to_num(merged['sales'].to_numpy(dtype=float))
+    f = np.nan_to_num(merged['forecast'].to_numpy(dtype=float))
+    codes = merged['product_code'].to_numpy(dtype=object)
+    metrics = compute_metrics_grouped(codes, a, f)
+    fold_ids = merged['fold'].to_numpy()
+    per_fold = []
+    for i, (cutoff, forecast_months) in enumerate(folds):
+        sel = fold_ids == i
+        per_fold.append({
+            "cutoff": cutoff.strftime("%Y-%m-%d"),
+            "months": [d.strftime("%Y-%m-%d") for d in forecast_months],
+            "aggregated_metrics": aggregate_metrics(compute_metrics_grouped(codes[sel], a[sel], f[sel])),
+        })
+    return metrics, aggregate_metrics(metrics), per_fold
+
+
+# -------------------------------
+# Pipeline
+# -------------------------------
+def run_backtest(train_file, horizon=6, step=3, folds=3, methods=None, n_jobs=None, chunk_size=None,
+                 progress=None, regressors=['mrp','discount','rating'], pool=None, min_train=24):
+    """
+    Rolling-origin backtest of one or more methods (a list, or a comma
+    separated string; default the auto method) over the whole upload.
+    The upload is preprocessed once and every method and fold reuses it.
+    Returns per-method metrics, fold summaries and the method with the
+    lowest mean sMAPE.
+    """
+    if isinstance(methods, str):
+        methods = [m for m in methods.split(',') if m.strip()]
+    methods = [resolve_method(m) for m in (methods or [None])]
+
+    raw, _ = load_data(train_file, columns=SALES_COLUMNS + list(regressors))
+    processed = preprocess_panel(raw)
+    months = pd.DatetimeIndex(processed['date'].unique()).sort_values()
+    fold_list = make_folds(months, horizon, step, folds, min_train)
+
+    results = {}
+    for k, method in enumerate(methods):
+        # each method reports its own progress; scale it to the whole run
+        tick = (lambda done, total, k=k: progress(k * total + done, len(methods) * total)) if progress else None
+        forecasts = backtest_panel(processed, fold_list, method, regressors, n_jobs=n_jobs,
+                                   chunk_size=chunk_size, progress=tick, pool=pool)
+        metrics, agg, per_fold = score(forecasts, processed, fold_list)
+        results[method] = {"metrics": metrics, "aggregated_metrics": agg, "folds": per_fold}
+
+    scored = [(r["aggregated_metrics"].get("smape_mean"), m) for m, r in results.items()
+              if r["aggregated_metrics"].get("smape_mean") is not None]
+    return {
+        "methods": results,
+        "best_method": min(scored)[1] if scored else None,
+        "meta": {
+            "horizon": horizon,
+            "step": step,
+            "folds": len(fold_list),
+            "products": int(processed['product_code'].nunique()),
+        },
+    }
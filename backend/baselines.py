@@ -0,0 +1,146 @@
+import numpy as np
+
+
+# -------------------------------
+# Vectorized baseline forecasts
+# -------------------------------
+# Every function takes Y, a (products x months) sales matrix with no gaps, and
+# steps, offsets from the last month as in holtwinters.forecast: steps >= 1
+# are forecasts, steps <= 0 give the one-step-ahead prediction for that month
+# of the history. They return an array of shape (products, len(steps)).
+
+SEASON = 12
+MA_WINDOW = 3
+# Croston smoothing constant; SBA scales the forecast by (1 - alpha / 2)
+CROSTON_ALPHA = 0.1
+
+
+def _at_steps(fitted, ahead, steps):
+    """fitted: (P, T) one-step predictions; ahead(h) -> (P,) forecast h months out."""
+    T = fitted.shape[1]
+    out = np.empty((fitted.shape[0], len(steps)))
+    for j, h in enumerate(np.asarray(steps, dtype=int)):
+        out[:, j] = ahead(h) if h >= 1 else fitted[:, min(max(T - 1 + h, 0), T - 1)]
+    return out
+
+
+def seasonal_naive(Y, steps, m=SEASON):
+    """Same month last year; the last value when the history is under a season."""
+    Y = np.asarray(Y, dtype=float)
+    T = Y.shape[1]
+    if T < m:
+        return moving_average(Y, steps, window=1)
+    fitted = np.concatenate([np.repeat(Y[:, :1], m, axis=1), Y[:, :-m]], axis=1)
+    return _at_steps(fitted, lambda h: Y[:, T - m + (h - 1) % m], steps)
+
+
+def moving_average(Y, steps, window=MA_WINDOW):
+    """Mean of the last `window` months, flat over the horizon."""
+    Y = np.asarray(Y, dtype=float)
+    csum = np.cumsum(np.pad(Y, ((0, 0), (1, 0))), axis=1)
+    t = np.arange(Y.shape[1])
+    lo = np.maximum(t - window, 0)
+    # prediction for month t uses months [t - window, t); month 0 uses itself
+    fitted = np.where(t > 0, (csum[:, t] - csum[:, lo]) / np.maximum(t - lo, 1), Y[:, :1])
+    last = Y[:, -window:].mean(axis=1)
+    return _at_steps(fitted, lambda h: last, steps)
+
+
+def croston(Y, steps, alpha=CROSTON_ALPHA):
+    """
+    Croston's method with the Syntetos-Boylan correction for intermittent
+    demand: demand size and inter-demand interval are smoothed separately and
+    the forecast is (1 - alpha/2) * size / interval, flat over the horizon.
+    """
+    Y = np.asarray(Y, dtype=float)
+    P, T = Y.shape
+    demand = Y > 0
+    first = np.where(demand.any(axis=1), demand.argmax(axis=1), T)
+    size = np.where(first < T, Y[np.arange(P), np.minimum(first, T - 1)], 0.0)
+    interval = first + 1.0
+    since = np.ones(P)
+    fitted = np.empty_like(Y)
+    for t in range(T):
+        fitted[:, t] = (1 - alpha / 2) * size / interval
+        update = demand[:, t] & (t > first)
+        size = np.where(update, size + alpha * (Y[:, t] - size), size)
+        interval = np.where(update, interval + alpha * (since - interval), interval)
+        since = np.where(demand[:, t], 1.0, since + 1)
+    last = (1 - alpha / 2) * size / interval
+    return _at_steps(fitted, lambda h: last, steps)
+
+
+FORECASTERS = {
+    'SeasonalNaive': seasonal_naive,
+    'MovingAverage': moving_average,
+    'Croston': croston,
+}
+
+
+# -------------------------------
+# Series features and routing
+# -------------------------------
+# Syntetos-Boylan cut-off: a mean inter-demand interval above this is intermittent
+INTERMITTENT_ADI = 1.32
+# Mean monthly sales below this are too small for a full model to pay off
+LOW_VOLUME = 10.0
+# Trend/seasonal strength (0-1) below which a series is mostly noise
+MIN_STRENGTH = 0.3
+# Seasonal strength at which seasonal naive beats a flat average
+SEASONAL_STRENGTH = 0.5
+
+
+def features(Y, m=SEASON):
+    """
+    Per-series features used by route(): length, zero ratio, mean inter-demand
+    interval (ADI), mean, coefficient of variation, and trend and seasonal
+    strength from a moving-average decomposition (1 - Var(remainder) /
+    Var(component + remainder), NaN under two seasons of history).
+    """
+    Y = np.asarray(Y, dtype=float)
+    P, T = Y.shape
+    nonzero = (Y > 0).sum(axis=1)
+    mean = Y.mean(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = {
+            'length': np.full(P, T),
+            'zero_ratio': 1 - nonzero / T,
+            'adi': np.where(nonzero > 0, T / np.maximum(nonzero, 1), np.inf),
+            'mean': mean,
+            'cv': np.where(mean > 0, Y.std(axis=1) / mean, 0.0),
+            'trend_strength': np.full(P, np.nan),
+            'seasonal_strength': np.full(P, np.nan),
+        }
+        if T >= 2 * m:
+            csum = np.cumsum(np.pad(Y, ((0, 0), (1, 0))), axis=1)
+            ma = (csum[:, m:] - csum[:, :-m]) / m
+            trend = (ma[:, :-1] + ma[:, 1:]) / 2
+            span = slice(m // 2, m // 2 + trend.shape[1])
+            detrended = Y[:, span] - trend
+            pos = np.arange(T)[span] % m
+            season = np.stack([detrended[:, pos == k].mean(axis=1) for k in range(m)], axis=1)
+            season -= season.mean(axis=1, keepdims=True)
+            season = season[:, pos]
+            remainder = detrended - season
+            var_r = remainder.var(axis=1)
+            out['trend_strength'] = np.clip(1 - var_r / (trend + remainder).var(axis=1), 0, 1)
+            out['seasonal_strength'] = np.clip(1 - var_r / (season + remainder).var(axis=1), 0, 1)
+    return out
+
+
+def route(Y, model='Prophet', m=SEASON):
+    """
+    Pick a method for every series: Croston for intermittent demand,
+    a moving average for short, flat or low-volume series (seasonal naive
+    when those are strongly seasonal), and `model` for the rest.
+    Returns (methods, features).
+    """
+    f = features(Y, m)
+    strength = np.fmax(f['trend_strength'], f['seasonal_strength'])
+    seasonal = f['seasonal_strength'] >= SEASONAL_STRENGTH
+    methods = np.full(len(f['mean']), model, dtype=object)
+    cheap = (f['length'] < 2 * m) | (f['mean'] < LOW_VOLUME) | ~(strength >= MIN_STRENGTH)
+    methods[cheap] = np.where(seasonal[cheap], 'SeasonalNaive', 'MovingAverage')
+    methods[f['length'] < 2 * m] = 'MovingAverage'
+    methods[f['adi'] >= INTERMITTENT_ADI] = 'Croston'
+    return methods, f
@@ -0,0 +1,590 @@
+"""
+Micro-benchmarks for the forecasting pipeline.
+
+    python bench.py preprocess --sizes 1000 10000 50000
+    python bench.py preprocess --check --sizes 10 200 2000
+    python bench.py format --sizes 1000 10000 --horizon 24
+    python bench.py startup --sizes 8 --method Prophet
+    python bench.py predict --sizes 20 --horizon 6
+    python bench.py transfer --sizes 10000 50000
+    python bench.py intervals --sizes 1000 10000 50000 --horizon 6
+    python bench.py append --check --sizes 100 5000 --horizon 3
+    python bench.py suite --sizes 100 1000 --out bench.json
+    python bench.py compare before.json after.json
+"""
+import argparse, contextlib, json, os, platform, subprocess, sys, tempfile, time
+import numpy as np
+import pandas as pd
+
+from forecasting import (
+    preprocess_panel, format_forecasts, convert_nan_to_none, forecast_panel, load_data,
+    compute_metrics_grouped, aggregate_metrics,
+)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# -------------------------------
+# Synthetic data
+# -------------------------------
+def make_panel(n_products, n_months=60, missing=0.05, seed=0):
+    """Monthly sales panel in the upload layout with some rows dropped."""
+    rng = np.random.default_rng(seed)
+    months = pd.date_range("2020-01-01", periods=n_months, freq="MS")
+    products = np.array([f"P{i:06d}" for i in range(n_products)])
+    n = n_products * n_months
+    df = pd.DataFrame({
+        "date": np.repeat(months.values, n_products),
+        "product_code": np.tile(products, n_months),
+        "sales": rng.poisson(100, n).astype(float),
+        "category": np.tile(rng.choice(["Electronics", "Home", "Fashion"], n_products), n_months),
+        "mrp": np.tile(rng.integers(100, 20000, n_products), n_months).astype(float),
+        "discount": rng.choice([0.0, 0.05, 0.1, 0.2], n),
+        "rating": np.tile(rng.uniform(3, 5, n_products).round(1), n_months),
+    })
+    if missing:
+        df = df.sample(frac=1 - missing, random_state=seed)
+    return df.sort_values(["product_code", "date"]).reset_index(drop=True)
+
+
+CATALOG = {
+    "Electronics": (["Mobiles", "Laptops", "Audio"], ["Samsung", "Apple", "Sony"]),
+    "Home": (["Kitchen", "Furniture", "Decor"], ["Ikea", "Prestige", "Nilkamal"]),
+    "Fashion": (["Shoes", "Apparel", "Watches"], ["Nike", "Puma", "Titan"]),
+}
+REGIONS = ["North", "South", "East", "West"]
+
+
+def make_realistic_panel(n_products, n_months=60, seed=0, missing=0.02, intermittent=0.2,
+                         gaps=0.05, late_start=0.1, start="2020-01-01"):
+    """
+    Monthly sales in the upload layout (the data.csv columns) with the
+    structure real uploads have: per-product level, trend and yearly
+    seasonality, discount-driven lifts, an `intermittent` share of sparse
+    products, a `late_start` share launched mid-history, a `gaps` share with
+    a 3-6 month hole, and `missing` of the remaining rows dropped at random.
+    The same arguments always give the same frame.
+    """
+    rng = np.random.default_rng(seed)
+    months = pd.date_range(start, periods=n_months, freq="MS")
+    P, T = n_products, n_months
+    t = np.arange(T)
+
+    level = rng.lognormal(4.0, 1.0, P)
+    trend = rng.normal(0.0, 0.01, P)
+    amplitude = rng.uniform(0.0, 0.5, P)
+    phase = rng.integers(0, 12, P)
+    mrp = rng.choice([199, 499, 999, 2499, 4999, 15000, 45000], P).astype(float)
+    rating = rng.uniform(3.0, 5.0, P).round(1)
+    discount = rng.choice([0.0, 0.05, 0.1, 0.2, 0.3], (P, T), p=[0.4, 0.2, 0.2, 0.15, 0.05])
+
+    mean = (level[:, None] * np.clip(1 + trend[:, None] * t, 0.1, None)
+            * (1 + amplitude[:, None] * np.sin(2 * np.pi * (t + phase[:, None]) / 12))
+            * (1 + 1.5 * discount))
+    sales = rng.poisson(mean).astype(float)
+    sparse = rng.random(P) < intermittent
+    hit = rng.random((P, T)) < rng.uniform(0.15, 0.5, P)[:, None]
+    sales[sparse] = np.where(hit[sparse], sales[sparse] * 3, 0.0)
+
+    keep = np.ones((P, T), dtype=bool)
+    launched = rng.random(P) < late_start
+    first = np.where(launched, rng.integers(1, max(T // 2, 2), P), 0)
+    keep &= t >= first[:, None]
+    holed = rng.random(P) < gaps
+    hole_start = rng.integers(0, max(T - 6, 1), P)
+    hole_len = rng.integers(3, 7, P)
+    keep &= ~(holed[:, None] & (t >= hole_start[:, None]) & (t < (hole_start + hole_len)[:, None]))
+    keep &= rng.random((P, T)) >= missing
+    keep[np.arange(P), np.maximum(first, 0)] = True
+
+    categories = rng.choice(list(CATALOG), P)
+    sub_category = np.array([rng.choice(CATALOG[c][0]) for c in categories])
+    brand = np.array([rng.choice(CATALOG[c][1]) for c in categories])
+    p_idx, t_idx = np.nonzero(keep)
+    df = pd.DataFrame({
+        "date": months.values[t_idx],
+        "product_code": np.array([f"P{i:06d}" for i in range(P)])[p_idx],
+        "sales": sales[p_idx, t_idx],
+        "category": categories[p_idx],
+        "sub_category": sub_category[p_idx],
+        "brand": brand[p_idx],
+        "region": rng.choice(REGIONS, P)[p_idx],
+        "mrp": mrp[p_idx],
+        "discount": discount[p_idx, t_idx],
+        "rating": rating[p_idx],
+    })
+    return df
+
+
+def split_history(df, horizon):
+    """(train, test): the last `horizon` months of the panel are the test set."""
+    cut = pd.Timestamp(df["date"].max()) - pd.DateOffset(months=horizon)
+    return df[df["date"] <= cut].reset_index(drop=True), df[df["date"] > cut].reset_index(drop=True)
+
+
+def make_forecasts(n_products, horizon=24, seed=0):
+    """forecast_panel-shaped output: one row per (month, product)."""
+    rng = np.random.default_rng(seed)
+    months = pd.date_range("2025-01-01", periods=horizon, freq="MS")
+    products = np.array([f"P{i:06d}" for i in range(n_products)], dtype=object)
+    df = pd.DataFrame({
+        "date": np.repeat(months.values, n_products),
+        "product_code": np.tile(products, horizon),
+        "forecast": rng.gamma(2.0, 50.0, n_products * horizon),
+    })
+    return df, months
+
+
+def timed(fn, *args, repeat=3, **kwargs):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+# -------------------------------
+# Benchmarks
+# -------------------------------
+def _preprocess_loop(df):
+    # the per-product groupby/reindex/fill loop preprocess_panel used before
+    df = df.copy()
+    df['date'] = pd.to_datetime(df['date']).dt.to_period('M').dt.to_timestamp()
+    all_months = pd.date_range(df['date'].min(), df['date'].max(), freq='MS')
+    processed = []
+    for prod, g in df.groupby('product_code', sort=False):
+        g = g.set_index('date').sort_index()
+        g = g.reindex(all_months)
+        g['product_code'] = prod
+        if 'sales' in g.columns:
+            g['sales'] = g['sales'].fillna(g['sales'].rolling(3, min_periods=1).mean())
+            month_avg = g.groupby(g.index.month)['sales'].transform('mean')
+            g['sales'] = g['sales'].fillna(month_avg)
+            g['sales'] = g['sales'].interpolate().ffill().bfill()
+        for col in g.columns:
+            if col not in ('sales', 'product_code'):
+                g[col] = g[col].interpolate().ffill().bfill()
+        g = g.reset_index().rename(columns={'index': 'date'})
+        processed.append(g)
+    merged = pd.concat(processed, ignore_index=True)
+    cols = ['date', 'product_code'] + [c for c in merged.columns if c not in ('date', 'product_code')]
+    return merged[cols].sort_values(['date', 'product_code']).reset_index(drop=True)
+
+
+def check_preprocess(sizes, n_months, seeds=5):
+    # preprocess_panel must give exactly what the loop gave: random panels
+    # with dropped rows, blank sales cells and products that start late
+    for n in sizes:
+        for seed in range(seeds):
+            rng = np.random.default_rng(seed)
+            df = make_panel(n, n_months, missing=rng.uniform(0.05, 0.4), seed=seed)
+            df.loc[rng.random(len(df)) < 0.1, "sales"] = np.nan
+            late = df["product_code"].isin(df["product_code"].unique()[::7])
+            df = df[~late | (df["date"] >= df["date"].min() + pd.DateOffset(months=n_months // 3))]
+            pd.testing.assert_frame_equal(preprocess_panel(df), _preprocess_loop(df), check_exact=True)
+        print(f"preprocess_panel  products={n:>6}  {seeds} random panels match the loop")
+
+
+def bench_preprocess(sizes, n_months, check=False):
+    if check:
+        return check_preprocess(sizes, n_months)
+    for n in sizes:
+        df = make_panel(n, n_months)
+        sec = timed(preprocess_panel, df)
+        loop = timed(_preprocess_loop, df, repeat=1) if n <= 10000 else float("nan")
+        print(f"preprocess_panel  products={n:>6}  rows={len(df):>8}  {sec:8.3f}s  loop {loop:8.3f}s")
+
+
+def _format_loop(forecasts, forecast_months):
+    # the per-month filter + iterrows formatter run_forecast used before
+    out = []
+    for d in forecast_months:
+        row = forecasts[forecasts["date"] == d]
+        out.append({d.strftime("%Y-%m-%d"): {r["product_code"]: round(r["forecast"], 2) for _, r in row.iterrows()}})
+    return convert_nan_to_none(out)
+
+
+def bench_format(sizes, horizon):
+    for n in sizes:
+        forecasts, months = make_forecasts(n, horizon)
+        sec = timed(format_forecasts, forecasts, months)
+        result = format_forecasts(forecasts, months)
+        enc = timed(json.dumps, result)
+        line = f"format_forecasts  products={n:>6}  cells={len(forecasts):>8}  {sec:8.3f}s  json {enc:6.3f}s"
+        if orjson is not None:
+            line += f"  orjson {timed(orjson.dumps, result):6.3f}s"
+        if n <= 10000:
+            line += f"  (old loop {timed(_format_loop, forecasts, months, repeat=1):8.3f}s)"
+        print(line)
+
+
+def _in_fresh_process(code):
+    """Run code in a new interpreter from this directory; it prints one float."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    out = subprocess.run([sys.executable, "-c", code], cwd=here, check=True,
+                         capture_output=True, text=True).stdout
+    return float(out.strip().splitlines()[-1])
+
+
+def bench_startup(sizes, n_months, method):
+    from workers import WorkerPool
+
+    app = _in_fresh_process(
+        "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)")
+    print(f"import main (cold app start)  {app:8.3f}s")
+    for n in sizes:
+        panel_code = (f"from bench import make_panel; from forecasting import preprocess_panel, forecast_panel; "
+                      f"import pandas as pd, time; panel = preprocess_panel(make_panel({n}, {n_months})); "
+                      f"months = pd.date_range(panel['date'].max(), periods=3, freq='MS'); ")
+        serial = _in_fresh_process(panel_code + (
+            f"t = time.perf_counter(); forecast_panel(panel, months, method={method!r}); "
+            f"print(time.perf_counter() - t)"))
+        fresh_pool = _in_fresh_process(panel_code + (
+            f"import forecasting; forecasting.PARALLEL_MIN_PRODUCTS = 1; t = time.perf_counter(); "
+            f"forecast_panel(panel, months, n_jobs=2, method={method!r}); print(time.perf_counter() - t)"))
+
+        panel = preprocess_panel(make_panel(n, n_months))
+        months = pd.date_range(panel["date"].max(), periods=3, freq="MS")
+        pool = WorkerPool(max_workers=2, method=method)
+        start = time.perf_counter()
+        pool.start(wait=True)
+        warmup = time.perf_counter() - start
+        first = timed(forecast_panel, panel, months, method=method, pool=pool, repeat=1)
+        again = timed(forecast_panel, panel, months, method=method, pool=pool)
+        pool.shutdown(wait=True)
+        print(f"first forecast  products={n:>4}  cold serial {serial:7.3f}s  cold pool {fresh_pool:7.3f}s  "
+              f"warm pool {first:7.3f}s (warm-up {warmup:.3f}s, repeat {again:.3f}s)")
+
+
+def _old_future(train, forecast_months, regs):
+    # the full-history frame with one merge + ffill/bfill per regressor that
+    # _forecast_product built before _future_regressors
+    future = pd.DataFrame({"ds": pd.date_range(train["date"].min(), forecast_months.max(), freq="MS")})
+    for r in regs:
+        future = future.merge(train[["date", r]].rename(columns={"date": "ds"}), on="ds", how="left")
+        future[r] = future[r].ffill().bfill()
+    return future
+
+
+def bench_predict(sizes, n_months, horizon, repeat):
+    from prophet import Prophet
+    from forecasting import _future_regressors
+
+    regs = ["mrp", "discount", "rating"]
+    for n in sizes:
+        panel = preprocess_panel(make_realistic_panel(n, n_months))
+        months = pd.date_range(panel["date"].max() + pd.DateOffset(months=1), periods=horizon, freq="MS")
+        models = []
+        for prod, g in panel.groupby("product_code", observed=True):
+            m = Prophet(yearly_seasonality=True, weekly_seasonality=False, daily_seasonality=False)
+            for r in regs:
+                m.add_regressor(r)
+            m.fit(g.rename(columns={"date": "ds", "sales": "y"})[["ds", "y"] + regs])
+            models.append((prod, g, m))
+
+        def old():
+            for _, g, m in models:
+                m.predict(_old_future(g, months, regs)[["ds"] + regs])
+
+        def new():
+            futures = _future_regressors(panel, months, regs)
+            for prod, _, m in models:
+                m.predict(pd.DataFrame(futures[prod])[["ds"] + regs])
+
+        before, after = timed(old, repeat=repeat), timed(new, repeat=repeat)
+        # what forecast_panel runs: Prophet's own interval sampling off
+        for _, _, m in models:
+            m.uncertainty_samples = 0
+        unsampled = timed(new, repeat=repeat)
+        print(f"prophet predict  products={n:>4}  months={n_months}+{horizon}  full history {before:7.3f}s  "
+              f"horizon only {after:7.3f}s  ({before / after:.1f}x)  "
+              f"no sampling {unsampled:7.3f}s  ({before / unsampled:.1f}x)")
+
+
+def bench_intervals(sizes, n_months, horizon, repeat):
+    from forecasting import forecast_intervals
+
+    quantiles = (0.1, 0.5, 0.9)
+    for n in sizes:
+        train, test = split_history(make_realistic_panel(n, n_months + horizon), horizon)
+        panel = preprocess_panel(train)
+        months = pd.date_range(panel["date"].max() + pd.DateOffset(months=1), periods=horizon, freq="MS")
+        forecasts = forecast_panel(panel, months, method="BatchedHoltWinters")
+        sec = timed(forecast_intervals, panel, forecasts, months, quantiles, repeat=repeat)
+        bands = forecast_intervals(panel, forecasts, months, quantiles)
+        actual = bands.merge(test.groupby(["date", "product_code"], observed=True)["sales"].sum().reset_index()
+                             .astype({"product_code": str}), on=["date", "product_code"], how="inner")
+        below = {name: float((actual["sales"] < actual[name]).mean()) for name in ("p10", "p50", "p90")}
+        print(f"forecast_intervals  products={n:>6}  horizon={horizon}  {sec:7.3f}s  "
+              f"actuals below p10 {below['p10']:.2f}  p50 {below['p50']:.2f}  p90 {below['p90']:.2f}")
+
+
+def _append_case(root, n, n_months, horizon, **panel_args):
+    # register all but the last `horizon` months, append those, then rebuild
+    from datasets import DatasetStore
+
+    df = make_realistic_panel(n, n_months + horizon, **panel_args)
+    cut = df["date"].max() - pd.DateOffset(months=horizon)
+    old, new = os.path.join(root, "old.csv"), os.path.join(root, "new.csv")
+    df[df["date"] <= cut].to_csv(old, index=False)
+    df[df["date"] > cut].to_csv(new, index=False)
+    store = DatasetStore(os.path.join(root, "datasets"))
+    dataset_id = store.register(old)["dataset_id"]
+    start = time.perf_counter()
+    meta = store.append(dataset_id, new)
+    append_sec = time.perf_counter() - start
+    appended = store.panel(dataset_id)
+    start = time.perf_counter()
+    store.rebuild(dataset_id)
+    rebuild_sec = time.perf_counter() - start
+    return appended, store.panel(dataset_id), meta, append_sec, rebuild_sec
+
+
+def bench_append(sizes, n_months, horizon, check=False):
+    # DatasetStore.append must leave the panel rebuild() gives; --check also
+    # tries complete panels (nothing re-filled) and sparser ones
+    cases = [{"seed": 0}]
+    if check:
+        cases += [{"seed": 1, "missing": 0.0, "gaps": 0.0, "late_start": 0.0},
+                  {"seed": 2, "missing": 0.2, "gaps": 0.3, "late_start": 0.3}]
+    for n in sizes:
+        for args in cases:
+            with tempfile.TemporaryDirectory() as root:
+                appended, rebuilt, meta, append_sec, rebuild_sec = _append_case(root, n, n_months, horizon, **args)
+            pd.testing.assert_frame_equal(appended, rebuilt, check_exact=True)
+            print(f"dataset append  products={n:>6}  months={n_months}+{horizon}  unsettled {len(meta['unsettled']):>6}  "
+                  f"append {append_sec:7.3f}s  rebuild {rebuild_sec:7.3f}s  panels match")
+
+
+def _touch(chunk):
+    # what a pool task does with its products before fitting: build every frame
+    n = sum(len(g) for _, g in chunk)
+    # VmHWM, not ru_maxrss: Linux carries ru_maxrss over from the forking parent
+    with open("/proc/self/status") as f:
+        hwm = next(int(l.split()[1]) for l in f if l.startswith("VmHWM"))
+    return n, hwm / 1024
+
+
+def bench_transfer(sizes, n_months, workers=2):
+    import multiprocessing, pickle
+    from concurrent.futures import ProcessPoolExecutor
+    from sharedpanel import SharedPanel
+
+    for n in sizes:
+        panel = preprocess_panel(make_realistic_panel(n, n_months))
+        chunk_size = max(1, -(-n // (workers * 4)))
+        columns = ["sales", "mrp", "discount", "rating"]
+
+        def pickled():
+            groups = list(panel.groupby("product_code"))
+            return [groups[i:i + chunk_size] for i in range(0, len(groups), chunk_size)], None
+
+        def shared():
+            sp = SharedPanel(panel, columns)
+            return sp.chunks(chunk_size), sp
+
+        line = f"panel to workers  products={n:>6}  workers={workers}"
+        for name, make in (("pickled frames", pickled), ("shared panel", shared)):
+            # spawned, so a worker's peak RSS is its own and not the parent's pages
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                list(executor.map(int, range(workers)))
+                start = time.perf_counter()
+                chunks, sp = make()
+                sent = sum(len(pickle.dumps(c, protocol=pickle.HIGHEST_PROTOCOL)) for c in chunks)
+                out = list(executor.map(_touch, chunks))
+                sec = time.perf_counter() - start
+                if sp is not None:
+                    sp.close()
+            line += (f"  | {name} {sec:7.3f}s, {sent / 2**20:8.1f} MB pickled, "
+                     f"worker peak {max(r for _, r in out):6.0f} MB")
+        print(line)
+
+
+# -------------------------------
+# Suite (JSON results)
+# -------------------------------
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _api_forecast(client, path, start_month, end_month, method):
+    """POST /forecast and poll the job to completion; returns the job."""
+    with open(path, "rb") as f:
+        r = client.post("/forecast", files={"train_file": (os.path.basename(path), f, "text/csv")},
+                        data={"start_month": start_month, "end_month": end_month, "method": method})
+    r.raise_for_status()
+    job_id = r.json()["job_id"]
+    while True:
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("done", "failed"):
+            if job["status"] == "failed":
+                raise RuntimeError(f"/forecast job failed: {job['error']}")
+            return job
+        time.sleep(0.05)
+
+
+def bench_suite(sizes, n_months, horizon, model_products, repeat, methods, api=True, seed=0):
+    """
+    Times every pipeline stage on make_realistic_panel data and returns the
+    results as a dict: load_data (CSV), preprocess_panel, forecast_panel for
+    each method, metrics, and the /forecast endpoint end to end. Per-product
+    methods (Prophet, ExponentialSmoothing) run on the first model_products
+    products only; the vectorized ones on the whole panel.
+    """
+    import forecasting
+
+    results = []
+
+    def record(stage, n, sec, **extra):
+        results.append({"stage": stage, "products": n, "sec": round(sec, 4), **extra})
+        print(f"{stage:<32} products={n:>6}  {sec:8.3f}s", file=sys.stderr)
+
+    with contextlib.ExitStack() as stack:
+        tmp = stack.enter_context(tempfile.TemporaryDirectory())
+        client = stack.enter_context(_api_client()) if api else None
+        for n in sizes:
+            train, test = split_history(make_realistic_panel(n, n_months + horizon, seed=seed), horizon)
+            train_path = os.path.join(tmp, f"train_{n}.csv")
+            train.to_csv(train_path, index=False)
+            forecast_months = pd.date_range(test["date"].min(), periods=horizon, freq="MS")
+
+            record("load_data", n, timed(load_data, train_path, repeat=repeat), rows=len(train))
+            raw, _ = load_data(train_path)
+            record("preprocess_panel", n, timed(preprocess_panel, raw, repeat=repeat))
+            panel = preprocess_panel(raw)
+
+            for method in methods:
+                method = forecasting.resolve_method(method)
+                sub = panel
+                if method in ("Prophet", "ExponentialSmoothing", "Router"):
+                    keep = panel["product_code"].drop_duplicates().iloc[:model_products]
+                    sub = panel[panel["product_code"].isin(keep)]
+                forecasting.load_backend(method)
+                k = sub["product_code"].nunique()
+                sec = timed(forecast_panel, sub, forecast_months, method=method,
+                            repeat=1 if method in ("Prophet", "Router") else repeat)
+                record(f"forecast_panel[{method}]", k, sec, per_product_ms=round(1000 * sec / max(k, 1), 3))
+
+            forecasts = forecast_panel(panel, forecast_months, method="SeasonalNaive")
+            merged = forecasts.merge(test[["date", "product_code", "sales"]], on=["date", "product_code"], how="left")
+            a = np.nan_to_num(merged["sales"].to_numpy(dtype=float))
+            f = np.nan_to_num(merged["forecast"].to_numpy(dtype=float))
+            codes = merged["product_code"].to_numpy(dtype=object)
+            record("metrics", n, timed(lambda: aggregate_metrics(compute_metrics_grouped(codes, a, f)),
+                                       repeat=repeat))
+            record("format_forecasts", n, timed(format_forecasts, forecasts, forecast_months, repeat=repeat))
+
+            if client is not None:
+                # the app prints request details; keep stdout for the JSON
+                with contextlib.redirect_stdout(sys.stderr):
+                    start = time.perf_counter()
+                    _api_forecast(client, train_path, forecast_months[0].strftime("%Y-%m-%d"),
+                                  forecast_months[-1].strftime("%Y-%m-%d"), "SeasonalNaive")
+                record("api_forecast[SeasonalNaive]", n, time.perf_counter() - start)
+
+    return {
+        "commit": _git_commit(),
+        "created_on": pd.Timestamp.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "versions": {"numpy": np.__version__, "pandas": pd.__version__},
+        "params": {"sizes": sizes, "months": n_months, "horizon": horizon, "model_products": model_products,
+                   "repeat": repeat, "methods": list(methods), "seed": seed},
+        "results": results,
+    }
+
+
+@contextlib.contextmanager
+def _api_client():
+    # the app's own job queue and upload path, in process, without model
+    # workers; the suite posts a vectorized method so this times request
+    # handling and the pipeline rather than fits. The result cache is
+    # bypassed so every call does the work.
+    os.environ.setdefault("FORECAST_POOL_WORKERS", "0")
+    from fastapi.testclient import TestClient
+    with contextlib.redirect_stdout(sys.stderr):
+        import main
+
+    cache, main.result_cache = main.result_cache, None
+    try:
+        with TestClient(main.app) as client:
+            yield client
+    finally:
+        main.result_cache = cache
+
+
+def compare(before_path, after_path, threshold=0.1):
+    """Print after/before time per (stage, products); flags changes beyond threshold."""
+    with open(before_path) as f:
+        before = {(r["stage"], r["products"]): r["sec"] for r in json.load(f)["results"]}
+    with open(after_path) as f:
+        after = json.load(f)
+    print(f"{'stage':<32} {'products':>8} {'before':>9} {'after':>9} {'ratio':>7}")
+    for r in after["results"]:
+        old = before.get((r["stage"], r["products"]))
+        if old is None:
+            continue
+        ratio = r["sec"] / old if old else float("inf")
+        flag = "  slower" if ratio > 1 + threshold else "  faster" if ratio < 1 - threshold else ""
+        print(f"{r['stage']:<32} {r['products']:>8} {old:9.3f} {r['sec']:9.3f} {ratio:7.2f}{flag}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("bench", choices=["preprocess", "format", "startup", "predict", "transfer", "intervals",
+                                          "append", "suite", "compare"])
+    parser.add_argument("files", nargs="*", help="compare: before.json after.json")
+    parser.add_argument("--sizes", type=int, nargs="+", default=None)
+    parser.add_argument("--months", type=int, default=60)
+    parser.add_argument("--horizon", type=int, default=None)
+    parser.add_argument("--method", default=None)
+    parser.add_argument("--methods", nargs="+", default=["BatchedHoltWinters", "GlobalBoosting", "ExponentialSmoothing", "Prophet"])
+    parser.add_argument("--model-products", type=int, default=20,
+                        help="suite: products fitted by per-product methods")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--check", action="store_true", help="preprocess: compare against the old loop instead of timing; append: more panel shapes")
+    parser.add_argument("--no-api", action="store_true", help="suite: skip the /forecast timing")
+    parser.add_argument("--out", default=None, help="suite: write the JSON here instead of stdout")
+    args = parser.parse_args()
+    if args.sizes is None:
+        args.sizes = {"suite": [100, 1000], "predict": [20]}.get(args.bench, [1000, 10000, 50000])
+    if args.horizon is None:
+        args.horizon = 6 if args.bench in ("suite", "predict", "intervals", "append") else 24
+
+    if args.bench == "preprocess":
+        bench_preprocess(args.sizes, args.months, args.check)
+    elif args.bench == "format":
+        bench_format(args.sizes, args.horizon)
+    elif args.bench == "startup":
+        bench_startup(args.sizes, args.months, args.method)
+    elif args.bench == "transfer":
+        bench_transfer(args.sizes, args.months)
+    elif args.bench == "predict":
+        bench_predict(args.sizes, args.months, args.horizon, args.repeat)
+    elif args.bench == "intervals":
+        bench_intervals(args.sizes, args.months, args.horizon, args.repeat)
+    elif args.bench == "append":
+        bench_append(args.sizes, args.months, args.horizon, args.check)
+    elif args.bench == "suite":
+        report = bench_suite(args.sizes, args.months, args.horizon, args.model_products,
+                             args.repeat, args.methods, api=not args.no_api, seed=args.seed)
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump(report, f, indent=2)
+        else:
+            print(json.dumps(report, indent=2))
+    elif args.bench == "compare":
+        if len(args.files) != 2:
+            parser.error("compare needs two result files")
+        compare(*args.files)
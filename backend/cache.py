@@ -0,0 +1,121 @@
+import os, json, hashlib, threading
+from collections import OrderedDict
+
+
+# -------------------------------
+# Cache keys
+# -------------------------------
+def file_digest(path, block_size=1 << 20):
+    """sha256 of a file, or of an in-memory upload buffer."""
+    h = hashlib.sha256()
+    if hasattr(path, "getbuffer"):
+        h.update(path.getbuffer())
+        return h.hexdigest()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def cache_key(data_path, forecast_months, method, regressors, test_path=None, **params):
+    """
+    Key a forecast on the uploaded bytes plus everything that changes its output:
+    the forecast window, model method, regressor list and the test file version.
+    """
+    parts = {
+        "data": file_digest(data_path),
+        "months": [d.strftime("%Y-%m-%d") for d in forecast_months],
+        "method": method,
+        "regressors": list(regressors),
+        "params": {k: params[k] for k in sorted(params)},
+    }
+    if test_path and os.path.exists(test_path):
+        st = os.stat(test_path)
+        parts["test"] = [os.path.abspath(test_path), st.st_size, st.st_mtime_ns]
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+# -------------------------------
+# Two-tier result cache
+# -------------------------------
+class ResultCache:
+    """
+    In-memory LRU of forecast results with an optional on-disk JSON tier.
+
+    The disk tier keeps at most max_disk_bytes; the least recently used
+    entries (by file mtime, refreshed on every hit) are evicted first.
+    """
+
+    def __init__(self, max_items=32, disk_dir=None, max_disk_bytes=512 * 1024 * 1024):
+        self.max_items = max_items
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                return self._mem[key]
+        result = self._disk_get(key)
+        if result is not None:
+            self._mem_put(key, result)
+        return result
+
+    def put(self, key, result):
+        self._mem_put(key, result)
+        self._disk_put(key, result)
+
+    def _mem_put(self, key, result):
+        with self._lock:
+            self._mem[key] = result
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_items:
+                self._mem.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                result = json.load(f)
+            os.utime(path)
+            return result
+        except (OSError, ValueError):
+            return None
+
+    def _disk_put(self, key, result):
+        if not self.disk_dir:
+            return
+        path = self._path(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(result, f)
+        os.replace(tmp, path)
+        self._evict_disk()
+
+    def _evict_disk(self):
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.disk_dir, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        total = sum(e[1] for e in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.disk_dir, name))
+                total -= size
+            except OSError:
+                pass
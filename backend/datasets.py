@@ -0,0 +1,320 @@
+import os, json, shutil, threading, uuid
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from forecasting import read_sales_file, preprocess_panel
+
+
+# -------------------------------
+# Registered datasets
+# -------------------------------
+def _filled(rows, first, last):
+    """Product codes (str) that miss a month or a value between first and last: those preprocess_panel fills."""
+    months = len(pd.date_range(first, last, freq="MS"))
+    counts = rows.drop(columns=["date", "product_code"]).groupby(rows["product_code"].astype(str)).count()
+    return set(counts.index[(counts < months).any(axis=1)])
+
+
+def _unsettled(rows, first, last):
+    """
+    Product codes (str) with filled cells between first and last that later
+    months can change. A sales cell with none of the two months before it
+    either gets the calendar-month mean, which new months shift (leading
+    gaps and runs of 3+ months); a value missing in the last month is
+    carried forward until a new one arrives. Shorter sales gaps take the
+    trailing mean of months already stored and interior gaps of other
+    columns are interpolated between them, so those stay put.
+    """
+    n_months = len(pd.date_range(first, last, freq="MS"))
+    codes, products = pd.factorize(rows["product_code"].astype(str))
+    t = ((rows["date"].dt.year - first.year) * 12 + rows["date"].dt.month - first.month).to_numpy()
+
+    def present(col):
+        known = rows[col].notna().to_numpy()
+        grid = np.zeros((len(products), n_months), dtype=bool)
+        grid[codes[known], t[known]] = True
+        return grid
+
+    gone = ~present("sales")
+    run = gone.copy()
+    run[:, 1:] &= gone[:, :-1]
+    run[:, 2:] &= gone[:, :-2]
+    unsettled = run.any(axis=1)
+    for col in rows.columns:
+        if col not in ("date", "product_code", "sales"):
+            unsettled |= ~present(col)[:, -1]
+    return set(np.asarray(products)[unsettled])
+
+
+def _same_rows(a, b):
+    """Same cells, row for row, whatever the category sets."""
+    if len(a) != len(b) or list(a.columns) != list(b.columns):
+        return False
+    for col in a.columns:
+        x, y = a[col].reset_index(drop=True), b[col].reset_index(drop=True)
+        if isinstance(x.dtype, pd.CategoricalDtype) or isinstance(y.dtype, pd.CategoricalDtype):
+            x, y = x.astype(object), y.astype(object)
+        if not x.equals(y):
+            return False
+    return True
+
+
+def _concat(frames):
+    """pd.concat that keeps categoricals categorical across different category sets."""
+    # shallow copies: columns are swapped below without touching the callers' frames
+    frames = [f.copy(deep=False) for f in frames if len(f)]
+    if not frames:
+        return pd.DataFrame()
+    for col in frames[0].columns:
+        if all(isinstance(f[col].dtype, pd.CategoricalDtype) for f in frames if col in f):
+            categories = union_categoricals([f[col] for f in frames if col in f], sort_categories=True).categories
+            for f in frames:
+                if col in f:
+                    f[col] = f[col].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+
+class Dataset:
+    """Handle on one registered dataset; what run_forecast(dataset=...) reads."""
+
+    def __init__(self, store, dataset_id):
+        self.store = store
+        self.dataset_id = dataset_id
+        self.meta_path = store._path(dataset_id, "meta.json")
+
+    def meta(self):
+        return self.store.meta(self.dataset_id)
+
+    def panel(self):
+        return self.store.panel(self.dataset_id)
+
+
+class DatasetStore:
+    """
+    Uploaded histories kept server side as Parquet, one file per year for the
+    raw rows and for the preprocess_panel output:
+
+        <root>/<dataset_id>/meta.json
+        <root>/<dataset_id>/raw/<year>.parquet
+        <root>/<dataset_id>/panel/<year>.parquet
+
+    append() takes only rows for months after the stored history and leaves
+    the panel rebuild() would. Products whose filled cells new months can
+    change (meta["unsettled"], see _unsettled), products missing from or
+    with gaps in the new rows, and new products are filled again from their
+    raw rows; the others only gain the new months. Only year files that
+    change are rewritten: the new months' years, and earlier ones where a
+    re-filled product's cells came out different.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.RLock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, dataset_id, *parts):
+        if not dataset_id.isalnum():
+            raise KeyError(dataset_id)
+        return os.path.join(self.root, dataset_id, *parts)
+
+    # -- reads --------------------------------------------------------------
+
+    def list(self):
+        out = []
+        for name in sorted(os.listdir(self.root)):
+            try:
+                out.append(self.meta(name))
+            except KeyError:
+                continue
+        return out
+
+    def get(self, dataset_id):
+        self.meta(dataset_id)
+        return Dataset(self, dataset_id)
+
+    def meta(self, dataset_id):
+        try:
+            with open(self._path(dataset_id, "meta.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            raise KeyError(dataset_id)
+
+    def panel(self, dataset_id, since=None):
+        return self._read(dataset_id, "panel", since)
+
+    def raw(self, dataset_id, since=None, products=None):
+        return self._read(dataset_id, "raw", since, products)
+
+    def _read(self, dataset_id, kind, since=None, products=None):
+        # products: only those product codes' rows
+        filters = [("product_code", "in", sorted(products))] if products is not None else None
+        with self._lock:
+            folder = self._path(dataset_id, kind)
+            years = sorted(int(n.split(".")[0]) for n in os.listdir(folder) if n.endswith(".parquet"))
+            if since is not None:
+                years = [y for y in years if y >= since.year]
+            frames = [pd.read_parquet(os.path.join(folder, f"{y}.parquet"), filters=filters) for y in years]
+        df = _concat(frames)
+        if since is not None and len(df):
+            df = df[df["date"] >= since].reset_index(drop=True)
+        return df
+
+    # -- writes -------------------------------------------------------------
+
+    def register(self, path, name=None):
+        """Store a full history (a path or buffer read_sales_file reads); returns its meta."""
+        raw = self._load(path)
+        panel = preprocess_panel(raw)
+        dataset_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            os.makedirs(self._path(dataset_id, "raw"))
+            os.makedirs(self._path(dataset_id, "panel"))
+            self._write_years(dataset_id, "raw", raw)
+            self._write_years(dataset_id, "panel", panel)
+            now = datetime.now().isoformat()
+            meta = {
+                "dataset_id": dataset_id,
+                "name": name or os.path.basename(getattr(path, "name", path)),
+                "created_on": now,
+                "version": 0,
+                "columns": [c for c in raw.columns],
+                "appends": [],
+                "unsettled": sorted(_unsettled(raw, raw["date"].min(), raw["date"].max())),
+            }
+            return self._write_meta(dataset_id, meta, raw)
+
+    def append(self, dataset_id, path):
+        """Add rows for months after the stored history; returns the new meta."""
+        with self._lock:
+            meta = self.meta(dataset_id)
+            delta = self._load(path)
+            delta = delta[[c for c in meta["columns"] if c in delta.columns]]
+            last = pd.Timestamp(meta["last_month"])
+            if delta.empty:
+                raise ValueError("no rows to append")
+            if delta["date"].min() <= last:
+                raise ValueError(f"appended rows must be after {meta['last_month']}; "
+                                 "register the full history again to change stored months")
+
+            first = pd.Timestamp(meta["first_month"])
+            end = delta["date"].max()
+            codes = delta["product_code"].astype(str)
+            known = set(meta["last_dates"])
+            is_new = ~codes.isin(known).to_numpy()
+            unsettled = meta.get("unsettled")
+            if unsettled is None:
+                # datasets registered before the set was kept
+                unsettled = _unsettled(self.raw(dataset_id), first, last)
+                meta.pop("filled", None)
+            # Unsettled products (see _unsettled) and those with gaps in
+            # their new rows are filled again from all their raw rows on the
+            # full grid. The rest keep their stored cells and only gain the
+            # new months.
+            new_months = (last + pd.DateOffset(months=1), end)
+            if set(meta["columns"]) <= set(delta.columns):
+                gaps = _filled(delta[~is_new], *new_months)
+            else:
+                gaps = known
+            kept = set(codes[~is_new]) - gaps - set(unsettled)
+            refill = known - kept
+
+            parts = []
+            if kept:
+                parts.append(preprocess_panel(delta[codes.isin(kept).to_numpy()], months=new_months))
+            rows = delta[codes.isin(refill).to_numpy() | is_new]
+            if refill:
+                rows = _concat([self.raw(dataset_id, products=refill), rows])
+            if len(rows):
+                parts.append(preprocess_panel(rows, months=(first, end)))
+            meta["unsettled"] = sorted(_unsettled(rows, first, end)) if len(rows) else []
+            panel = _concat(parts)
+            panel["product_code"] = panel["product_code"].astype(str)
+            self._write_panel(dataset_id, panel, refill, since=new_months[0])
+            year = pd.Timestamp(delta["date"].min().year, 1, 1)
+            self._write_years(dataset_id, "raw", _concat([self.raw(dataset_id, since=year), delta]))
+
+            meta["appends"].append({"on": datetime.now().isoformat(), "rows": int(len(delta)),
+                                    "months": sorted(delta["date"].dt.strftime("%Y-%m-%d").unique().tolist()),
+                                    "new_products": int(delta["product_code"][is_new].nunique())})
+            return self._write_meta(dataset_id, meta, delta)
+
+    def rebuild(self, dataset_id):
+        """Recompute the whole panel from the stored raw rows."""
+        with self._lock:
+            meta = self.meta(dataset_id)
+            shutil.rmtree(self._path(dataset_id, "panel"))
+            os.makedirs(self._path(dataset_id, "panel"))
+            raw = self.raw(dataset_id)
+            self._write_years(dataset_id, "panel", preprocess_panel(raw))
+            meta["unsettled"] = sorted(_unsettled(raw, raw["date"].min(), raw["date"].max()))
+            return self._write_meta(dataset_id, meta)
+
+    def delete(self, dataset_id):
+        with self._lock:
+            self.meta(dataset_id)
+            shutil.rmtree(self._path(dataset_id))
+
+    # -- helpers ------------------------------------------------------------
+
+    def _load(self, path):
+        df = read_sales_file(path)
+        missing = [c for c in ("date", "product_code", "sales") if c not in df.columns]
+        if missing:
+            raise ValueError(f"rows need columns {', '.join(missing)}")
+        df["date"] = pd.to_datetime(df["date"]).dt.to_period("M").dt.to_timestamp()
+        return df
+
+    def _write_years(self, dataset_id, kind, df):
+        """Replace the year files df covers (only those years are touched)."""
+        folder = self._path(dataset_id, kind)
+        for year, part in df.groupby(df["date"].dt.year, sort=True):
+            path = os.path.join(folder, f"{year}.parquet")
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            part.reset_index(drop=True).to_parquet(tmp, index=False)
+            os.replace(tmp, path)
+
+    def _write_panel(self, dataset_id, rows, replaced, since):
+        """
+        Merge rows (the new months of every product, and all months of
+        products in replaced) into the stored panel. Year files from since on
+        are rewritten; earlier ones only where a replaced product's cells
+        came out different.
+        """
+        rows = rows.sort_values(["date", "product_code"], kind="stable").reset_index(drop=True)
+        for year, part in rows.groupby(rows["date"].dt.year, sort=True):
+            stored = self._read_year(dataset_id, "panel", year)
+            if len(stored):
+                mine = stored["product_code"].astype(str).isin(replaced).to_numpy()
+                if year < since.year and _same_rows(stored[mine], part):
+                    continue
+                part = _concat([stored[~mine], part])
+                part["product_code"] = part["product_code"].astype(str)
+                part = part.sort_values(["date", "product_code"], kind="stable")
+            self._write_years(dataset_id, "panel", part)
+
+    def _read_year(self, dataset_id, kind, year):
+        path = self._path(dataset_id, kind, f"{year}.parquet")
+        return pd.read_parquet(path) if os.path.exists(path) else pd.DataFrame()
+
+    def _write_meta(self, dataset_id, meta, new_rows=None):
+        if new_rows is not None:
+            last_dates = meta.get("last_dates", {})
+            latest = new_rows.groupby("product_code", observed=True)["date"].max()
+            last_dates.update(zip(latest.index.astype(str), latest.dt.strftime("%Y-%m-%d")))
+            meta["last_dates"] = dict(sorted(last_dates.items()))
+            meta["first_month"] = min([meta.get("first_month") or "9999"] +
+                                      [new_rows["date"].min().strftime("%Y-%m-%d")])
+            meta["last_month"] = max([meta.get("last_month") or ""] +
+                                     [new_rows["date"].max().strftime("%Y-%m-%d")])
+            meta["products"] = len(last_dates)
+            meta["rows"] = meta.get("rows", 0) + int(len(new_rows))
+        meta["version"] += 1
+        meta["updated_on"] = datetime.now().isoformat()
+        path = self._path(dataset_id, "meta.json")
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, path)
+        return meta
@@ -1,32 +1,180 @@
-import warnings, os, math, json
+import warnings, os, math, json, time, importlib.util
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from itertools import repeat
 import pandas as pd
 import numpy as np
-from sklearn.metrics import mean_squared_error
+from pandas.api.types import union_categoricals
+
+import holtwinters
+import baselines
+import globalmodel
+import hierarchy
+import intervals
+import profiling
+import actuals
+from cache import cache_key
+from sharedpanel import SharedPanel
+from model_store import series_fingerprint
 
 warnings.filterwarnings("ignore", category=FutureWarning)
 
-# Prophet fallback
-try:
-    from prophet import Prophet
-    use_prophet = True
-except Exception:
-    from statsmodels.tsa.holtwinters import ExponentialSmoothing
-    use_prophet = False
+# Prophet (cmdstanpy) and statsmodels (scipy) take seconds to import, so they
+# are only checked for here and loaded on first use by load_backend(); the API
+# process can then start without either.
+use_prophet = importlib.util.find_spec("prophet") is not None
+Prophet = model_to_json = model_from_json = None
+ExponentialSmoothing = None
+_has_statsmodels = importlib.util.find_spec("statsmodels") is not None
+# scikit-learn (GlobalBoosting) is imported by globalmodel.forecast itself
+_has_sklearn = importlib.util.find_spec("sklearn") is not None
+
+METHODS = ('Prophet', 'ExponentialSmoothing', 'BatchedHoltWinters',
+           'SeasonalNaive', 'Croston', 'MovingAverage', 'GlobalBoosting', 'Router')
+# Prophet's own interval sampling in predict(). Only yhat is used, which does
+# not depend on it, and intervals come from intervals.py, so it is off
+PROPHET_UNCERTAINTY_SAMPLES = int(os.environ.get("PROPHET_UNCERTAINTY_SAMPLES", 0))
+# Methods that forecast the whole panel in one vectorized pass
+PANEL_METHODS = ('BatchedHoltWinters', 'GlobalBoosting') + tuple(baselines.FORECASTERS)
+
+def load_backend(method):
+    """Import the model library behind method (a no-op once loaded)."""
+    global use_prophet, Prophet, model_to_json, model_from_json, ExponentialSmoothing, _has_statsmodels
+    if method == 'Prophet' and Prophet is None and use_prophet:
+        try:
+            from prophet import Prophet
+            from prophet.serialize import model_to_json, model_from_json
+        except Exception:
+            use_prophet = False
+    elif method == 'ExponentialSmoothing' and ExponentialSmoothing is None and _has_statsmodels:
+        try:
+            from statsmodels.tsa.holtwinters import ExponentialSmoothing
+        except Exception:
+            _has_statsmodels = False
+
+def resolve_method(method=None):
+    """Canonical method name; None/'auto' picks Prophet when it is installed."""
+    if method is None or str(method).lower() == 'auto':
+        return 'Prophet' if use_prophet else 'ExponentialSmoothing'
+    names = {m.lower(): m for m in METHODS}
+    name = names.get(str(method).lower())
+    if name is None:
+        raise ValueError(f"Unknown method {method!r}, expected one of {', '.join(METHODS)}")
+    if name == 'Prophet' and not use_prophet:
+        raise ValueError("Prophet is not installed")
+    if name == 'ExponentialSmoothing' and not _has_statsmodels:
+        raise ValueError("statsmodels is not installed")
+    if name == 'GlobalBoosting' and not _has_sklearn:
+        raise ValueError("scikit-learn is not installed")
+    return name
 
 # -------------------------------
 # Load data
 # -------------------------------
-def load_data(data_path, test_path=None):
-    if not os.path.exists(data_path):
+# Pinned dtypes for upload columns: text as categoricals, regressors as float32
+CATEGORICAL_COLUMNS = ['product_code', 'category', 'sub_category', 'brand', 'region']
+FLOAT32_COLUMNS = ['mrp', 'discount', 'rating']
+# Columns the pipeline reads besides the regressors; anything else (e.g.
+# sub_category) is projected away at read time
+SALES_COLUMNS = ['date', 'product_code', 'sales', 'category', 'brand', 'region']
+# Rows parsed per chunk; bounds parser memory regardless of file size
+CSV_CHUNK_ROWS = int(os.environ.get("CSV_CHUNK_ROWS", 500_000))
+
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+ARROW_EXTENSIONS = ('.arrow', '.feather', '.ipc')
+EXCEL_EXTENSIONS = ('.xlsx', '.xls')
+
+def _pin_dtypes(df):
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].cat.set_categories(sorted(df[col].cat.categories))
+            else:
+                df[col] = df[col].astype('category')
+    for col in FLOAT32_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('float32')
+    if 'date' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['date']):
+        df['date'] = pd.to_datetime(df['date'])
+    return df
+
+def _rewind(source):
+    # in-memory uploads are read more than once (header, then rows)
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    return source
+
+def read_sales_csv(path, chunksize=None, columns=None):
+    """
+    Parse a sales CSV chunk by chunk with dtypes pinned. Each chunk is split
+    into its columns as it is read and the result is assembled one column at
+    a time, dropping that column's chunks as it goes, so peak memory is the
+    typed frame plus the parser's working set for one chunk (bounded by
+    CSV_CHUNK_ROWS) or one column's copy while assembling, whichever is more;
+    never the whole text file or two copies of the frame.
+    Categories are unified (and sorted) across chunks before concatenating.
+    """
+    header = pd.read_csv(_rewind(path), nrows=0).columns
+    usecols = [c for c in header if c in columns] if columns else None
+    header = usecols or header
+    dtype = {c: 'category' for c in CATEGORICAL_COLUMNS if c in header}
+    dtype.update({c: 'float32' for c in FLOAT32_COLUMNS if c in header})
+    parse_dates = ['date'] if 'date' in header else False
+    reader = pd.read_csv(_rewind(path), usecols=usecols, dtype=dtype, parse_dates=parse_dates,
+                         chunksize=chunksize or CSV_CHUNK_ROWS)
+    # a copy per column so no column keeps its chunk's shared dtype block alive
+    chunks = [{col: chunk[col].copy() for col in chunk.columns} for chunk in reader]
+    if not chunks:
+        return pd.read_csv(_rewind(path), usecols=usecols, dtype=dtype, parse_dates=parse_dates)
+    out = {}
+    for col in list(chunks[0]):
+        parts = [c.pop(col) for c in chunks]
+        if dtype.get(col) == 'category':
+            categories = union_categoricals(parts, sort_categories=True).categories
+            parts = [p.cat.set_categories(categories) for p in parts]
+        out[col] = pd.concat(parts, ignore_index=True)
+        del parts
+    return pd.DataFrame(out, copy=False)
+
+def read_sales_file(path, chunksize=None, columns=None):
+    """
+    Read CSV, Parquet, Arrow IPC/Feather or Excel by extension. Only `columns`
+    are decoded (all when None); Parquet and Arrow need pyarrow. path can
+    also be a binary buffer with a name attribute (uploads.Upload.source).
+    """
+    ext = os.path.splitext(getattr(path, 'name', path))[1].lower()
+    if ext in PARQUET_EXTENSIONS or ext in ARROW_EXTENSIONS:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        import pyarrow.feather as feather
+        if ext in PARQUET_EXTENSIONS:
+            names = pq.read_schema(_rewind(path)).names
+            read = lambda cols: pq.read_table(_rewind(path), columns=cols)
+        elif hasattr(path, 'read'):
+            names = pa.ipc.open_file(_rewind(path)).schema.names
+            read = lambda cols: feather.read_table(_rewind(path), columns=cols)
+        else:
+            with pa.memory_map(path) as source:
+                names = pa.ipc.open_file(source).schema.names
+            read = lambda cols: feather.read_table(path, columns=cols, memory_map=True)
+        cols = [c for c in names if c in columns] if columns else None
+        df = read(cols).to_pandas()
+    elif ext in EXCEL_EXTENSIONS:
+        df = pd.read_excel(_rewind(path), usecols=(lambda c: c in columns) if columns else None)
+    else:
+        return read_sales_csv(path, chunksize, columns)
+    return _pin_dtypes(df)
+
+def load_data(data_path, test_path=None, chunksize=None, columns=None):
+    if not hasattr(data_path, 'read') and not os.path.exists(data_path):
         raise FileNotFoundError(f"{data_path} not found.")
-    df = pd.read_csv(data_path, parse_dates=["date"])
+    df = read_sales_file(data_path, chunksize, columns)
     assert "product_code" in df.columns and "sales" in df.columns, "train.csv must have product_code and sales"
     df = df.sort_values(["product_code","date"]).reset_index(drop=True)
     
     test_df = None
     if test_path and os.path.exists(test_path):
-        test_df = pd.read_csv(test_path, parse_dates=["date"])
+        test_df = read_sales_file(test_path, chunksize, columns)
         test_df = test_df.sort_values(["product_code","date"]).reset_index(drop=True)
     
     return df, test_df
@@ -55,91 +203,664 @@ def convert_nan_to_none(obj):
 # -------------------------------
 # Preprocessing
 # -------------------------------
-def preprocess_panel(df):
+def _month_grid(values, t_idx, p_idx, all_months, products, complete, numeric):
+    """Scatter one column into a (months x products) array; holes are NaN."""
+    if complete:
+        grid = np.empty((len(all_months), len(products)), dtype=values.dtype)
+    elif numeric:
+        # ints gain NaN holes and become float64; float32 stays float32
+        dtype = values.dtype if values.dtype.kind == 'f' else np.float64
+        grid = np.full((len(all_months), len(products)), np.nan, dtype=dtype)
+    else:
+        grid = np.full((len(all_months), len(products)), np.nan, dtype=object)
+    grid[t_idx, p_idx] = values
+    return grid
+
+def _fill_columns(values, interpolate=True):
+    """
+    interpolate().ffill().bfill() down each column of a (months x products)
+    array in one pass; interior gaps use the same formula as np.interp.
+    """
+    values = np.asarray(values)
+    missing = pd.isna(values)
+    if not missing.any():
+        return values
+    n = values.shape[0]
+    pos = np.arange(n)[:, None]
+    cols = np.arange(values.shape[1])[None, :]
+    prev_idx = np.maximum.accumulate(np.where(missing, -1, pos), axis=0)
+    next_idx = np.minimum.accumulate(np.where(missing, n, pos)[::-1], axis=0)[::-1]
+    has_prev, has_next = prev_idx >= 0, next_idx < n
+    y0 = values[np.where(has_prev, prev_idx, 0), cols]
+    y1 = values[np.where(has_next, next_idx, 0), cols]
+
+    out = values.copy()
+    trailing = missing & has_prev & ~has_next
+    leading = missing & ~has_prev & has_next
+    out[trailing] = y0[trailing]
+    out[leading] = y1[leading]
+    interior = missing & has_prev & has_next
+    if interpolate:
+        x0, x1 = prev_idx[interior], next_idx[interior]
+        slope = (y1[interior] - y0[interior]) / (x1 - x0)
+        x = np.broadcast_to(pos, values.shape)[interior]
+        out[interior] = slope * (x - x0) + y0[interior]
+    else:
+        out[interior] = y0[interior]
+    return out
+
+def preprocess_panel(df, months=None):
+    """
+    Put every product on the full monthly grid and fill the gaps. The grid
+    spans df's dates, or months=(first, last) when given, e.g. to fill some
+    products of a larger panel on its grid.
+
+    Each column is laid out as one (months x products) array and filled
+    column-wise for all products at once: sales get a trailing 3-month mean,
+    then the same-calendar-month mean, then linear interpolation; other
+    numeric columns are interpolated and text columns carried forward/back
+    (categoricals stay categorical). product_code comes back as plain strings.
+    Output is long, sorted by date then product_code.
+    """
     df = df.copy()
     df['date'] = pd.to_datetime(df['date']).dt.to_period('M').dt.to_timestamp()
-    global_min = df['date'].min()
-    global_max = df['date'].max()
+    global_min, global_max = months or (df['date'].min(), df['date'].max())
     all_months = pd.date_range(global_min, global_max, freq='MS')
 
-    processed = []
-    for prod, g in df.groupby('product_code', sort=False):
-        g = g.set_index('date').sort_index()
-        g = g.reindex(all_months)
-        g['product_code'] = prod
-        
-        # Sales filling
-        if 'sales' in g.columns:
-            g['sales'] = g['sales'].fillna(g['sales'].rolling(3,min_periods=1).mean())
-            month_avg = g.groupby(g.index.month)['sales'].transform('mean')
-            g['sales'] = g['sales'].fillna(month_avg)
-            g['sales'] = g['sales'].interpolate().ffill().bfill()
-        
-        # Other regressors
-        for col in g.columns:
-            if col not in ('sales','product_code'):
-                g[col] = g[col].interpolate().ffill().bfill()
-        
-        g = g.reset_index().rename(columns={'index':'date'})
-        processed.append(g)
-
-    merged = pd.concat(processed, ignore_index=True)
-    cols = ['date','product_code'] + [c for c in merged.columns if c not in ('date','product_code')]
-    merged = merged[cols].sort_values(['date','product_code']).reset_index(drop=True)
+    codes, products = pd.factorize(df['product_code'], sort=True)
+    products = np.asarray(products, dtype=object)
+    t_idx = ((df['date'].dt.year - global_min.year) * 12 + (df['date'].dt.month - global_min.month)).to_numpy()
+    cell = t_idx * len(products) + codes
+    if len(np.unique(cell)) != len(cell):
+        raise ValueError("cannot reindex on an axis with duplicate labels")
+    complete = len(cell) == len(all_months) * len(products)
+
+    value_cols = [c for c in df.columns if c not in ('date','product_code')]
+    filled = {}
+    for col in value_cols:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            # carry category codes rather than strings; -1 (missing) becomes NaN
+            codes_col = df[col].cat.codes.to_numpy().astype(np.float32)
+            codes_col[codes_col < 0] = np.nan
+            wide = _month_grid(codes_col, t_idx, codes, all_months, products, False, True)
+            wide = _fill_columns(wide, interpolate=False).ravel()
+            filled[col] = pd.Categorical.from_codes(np.nan_to_num(wide, nan=-1).astype(np.int32),
+                                                    dtype=df[col].dtype)
+            continue
+        numeric = pd.api.types.is_numeric_dtype(df[col]) and not pd.api.types.is_bool_dtype(df[col])
+        wide = _month_grid(df[col].to_numpy(), t_idx, codes, all_months, products, complete, numeric)
+        if col == 'sales' and pd.isna(wide).any():
+            # Sales filling, only for products with holes: rolling() runs
+            # column by column, so complete products would only cost time
+            gaps = np.flatnonzero(pd.isna(wide).any(axis=0))
+            part = pd.DataFrame(wide[:, gaps], index=all_months)
+            part = part.fillna(part.rolling(3, min_periods=1).mean())
+            month_avg = part.groupby(part.index.month).transform('mean')
+            part = part.fillna(month_avg)
+            wide[:, gaps] = _fill_columns(part.to_numpy())
+            filled[col] = wide.ravel()
+        else:
+            # interpolate() leaves text untouched, so it is only carried over
+            filled[col] = _fill_columns(wide, interpolate=numeric).ravel()
+
+    merged = pd.DataFrame({
+        'date': np.repeat(all_months.values, len(products)),
+        'product_code': np.tile(products, len(all_months)),
+        **filled,
+    })
     return merged
 
 # -------------------------------
 # Forecasting
 # -------------------------------
-def forecast_panel(processed_df, forecast_months, regressors=['mrp','discount','rating']):
+# Below this many products the process pool costs more to start than it saves
+PARALLEL_MIN_PRODUCTS = 32
+# With a deadline, per-product fits stop while there is still time to
+# forecast the rest with DEADLINE_FALLBACK (vectorized; last value for short
+# series) and to format and score: DEADLINE_RESERVE_SEC plus an estimated
+# DEADLINE_FALLBACK_SEC per product left
+DEADLINE_FALLBACK = 'BatchedHoltWinters'
+DEADLINE_RESERVE_SEC = 0.5
+DEADLINE_FALLBACK_SEC = 0.0005
+# Months of history that rank products for deadline scheduling
+VALUE_MONTHS = 12
+
+def _stan_init(m):
+    """A fitted Prophet's parameters in the form fit(init=...) takes."""
+    return {
+        **{name: float(m.params[name][0][0]) for name in ('k', 'm', 'sigma_obs')},
+        **{name: m.params[name][0] for name in ('delta', 'beta')},
+    }
+
+def _future_regressors(processed_df, forecast_months, regressors):
+    """
+    Prophet future frames for every product in one pass over (months x
+    products) regressor grids: {product: {'ds': months, regressor: values}}
+    with a row for each forecast month from the product's first month on.
+    A regressor takes that month's value, else the last one before it, else
+    the first one after it (up to the last forecast month).
+    """
+    regs = [r for r in regressors if r in processed_df.columns]
+    months = pd.DatetimeIndex(forecast_months)
+    first = processed_df.groupby('product_code', observed=True)['date'].min()
+    grid = pd.DatetimeIndex(processed_df['date'].unique()).union(months)
+    grid = grid[grid <= months.max()]
+    values = {}
+    for r in regs:
+        wide = processed_df.pivot(index='date', columns='product_code', values=r).reindex(grid)
+        values[r] = wide.ffill().bfill().reindex(months).reindex(columns=first.index).to_numpy()
+    keep = months.values[:, None] >= first.to_numpy()[None, :]
+    return {
+        prod: {'ds': months[keep[:, j]], **{r: values[r][keep[:, j], j] for r in regs}}
+        for j, prod in enumerate(first.index)
+    }
+
+def _forecast_product(prod, g, forecast_months, regressors, model_store=None, method='Prophet',
+                      warm_start=None, stats=None, future=None):
+    """
+    Forecast one product. warm_start, a dict kept by the caller between fits
+    of the same product (e.g. backtest folds), lets Prophet start its
+    optimizer from the previous fit's parameters. stats, a list, gets a
+    (product, seconds, outcome, error) tuple (see profiling.OUTCOMES; error
+    is the exception for the 'error' outcome, else None). future is
+    this product's entry from _future_regressors (built here when omitted);
+    Prophet predicts only those rows.
+    """
+    load_backend(method)
+    started = time.perf_counter()
+    outcome, error = 'fit', None
     forecasts = []
-    for prod, g in processed_df.groupby('product_code'):
-        g = g.sort_values('date').reset_index(drop=True)
-        if g['sales'].dropna().shape[0] == 0:
-            continue
-        train = g.copy()
-        try:
-            if use_prophet:
-                m = Prophet(yearly_seasonality=True, weekly_seasonality=False, daily_seasonality=False)
-                available_regs = [r for r in regressors if r in train.columns]
+    g = g.sort_values('date').reset_index(drop=True)
+    if g['sales'].dropna().shape[0] == 0:
+        return forecasts
+    train = g.copy()
+    try:
+        if method == 'Prophet':
+            available_regs = [r for r in regressors if r in train.columns]
+            train_prop = train.rename(columns={'date':'ds','sales':'y'})[['ds','y'] + available_regs]
+            # Reuse the stored model if this product's history is unchanged
+            key = series_fingerprint(prod, train_prop, ['ds','y'] + available_regs, 'Prophet') if model_store else None
+            stored = model_store.get(key) if key else None
+            if stored is not None:
+                m = model_from_json(stored)
+                m.uncertainty_samples = PROPHET_UNCERTAINTY_SAMPLES
+                outcome = 'cached'
+            else:
+                m = Prophet(yearly_seasonality=True, weekly_seasonality=False, daily_seasonality=False,
+                            uncertainty_samples=PROPHET_UNCERTAINTY_SAMPLES)
                 for r in available_regs:
                     m.add_regressor(r)
-                train_prop = train.rename(columns={'date':'ds','sales':'y'})[['ds','y'] + available_regs]
-                m.fit(train_prop)
+                init = warm_start.get('prophet') if warm_start is not None else None
+                m.fit(train_prop, **({'init': init} if init else {}))
+                if key:
+                    model_store.put(key, model_to_json(m))
+            if warm_start is not None:
+                warm_start['prophet'] = _stan_init(m)
 
-                # future frame
-                # future_index = pd.date_range(train['date'].min(), periods=len(train)+len(forecast_months), freq='MS')
-                # extend future until the requested end date
-                future_index = pd.date_range(train['date'].min(), 
-                             forecast_months.max(), 
-                             freq='MS')
-
-                future = pd.DataFrame({'ds': future_index})
-                for r in available_regs:
-                    tmp = train[['date', r]].rename(columns={'date':'ds'})
-                    future = future.merge(tmp, on='ds', how='left')
-                    future[r] = future[r].fillna(method='ffill').fillna(method='bfill')
-                preds = m.predict(future[['ds'] + available_regs]).set_index('ds')['yhat']
+            # future frame: just the requested months, regressors carried over from the history
+            if future is None:
+                future = _future_regressors(train, forecast_months, available_regs)[prod]
+            future = pd.DataFrame(future)[['ds'] + available_regs]
+            # months before the history get NaN, as the baselines give; when
+            # that is the whole window there is nothing to predict (Prophet
+            # raises on an empty frame)
+            preds = m.predict(future).set_index('ds')['yhat'] if len(future) else pd.Series(dtype=float)
 
+            for fm in forecast_months:
+                val = preds.get(fm, np.nan)
+                forecasts.append({'date': fm, 'product_code': prod, 'forecast': float(np.nan if pd.isna(val) else val)})
+        else:
+            if train['sales'].dropna().shape[0] < 12:
+                outcome = 'fallback'
+                last_val = float(train['sales'].dropna().iloc[-1]) if train['sales'].dropna().shape[0]>0 else 0.0
                 for fm in forecast_months:
-                    val = preds.get(fm, np.nan)
-                    forecasts.append({'date': fm, 'product_code': prod, 'forecast': float(np.nan if pd.isna(val) else val)})
+                    forecasts.append({'date': fm, 'product_code': prod, 'forecast': last_val})
             else:
-                if train['sales'].dropna().shape[0] < 12:
-                    last_val = float(train['sales'].dropna().iloc[-1]) if train['sales'].dropna().shape[0]>0 else 0.0
-                    for fm in forecast_months:
-                        forecasts.append({'date': fm, 'product_code': prod, 'forecast': last_val})
+                key = series_fingerprint(prod, train, ['sales'], 'ExponentialSmoothing') if model_store else None
+                fit = model_store.get(key) if key else None
+                if fit is not None:
+                    outcome = 'cached'
                 else:
                     model = ExponentialSmoothing(train['sales'], seasonal='add', seasonal_periods=12)
                     fit = model.fit()
-                    fc = fit.forecast(len(forecast_months))
-                    for i, fm in enumerate(forecast_months):
-                        forecasts.append({'date': fm, 'product_code': prod, 'forecast': float(fc[i])})
-        except Exception:
-            last_val = float(train['sales'].dropna().iloc[-1]) if train['sales'].dropna().shape[0]>0 else 0.0
-            for fm in forecast_months:
-                forecasts.append({'date': fm, 'product_code': prod, 'forecast': last_val})
-    return pd.DataFrame(forecasts).sort_values(['date','product_code']).reset_index(drop=True)
+                    if key:
+                        model_store.put(key, fit)
+                fc = np.asarray(fit.forecast(len(forecast_months)))
+                for i, fm in enumerate(forecast_months):
+                    forecasts.append({'date': fm, 'product_code': prod, 'forecast': float(fc[i])})
+    except Exception as e:
+        outcome, error = 'error', f"{type(e).__name__}: {e}"
+        forecasts = []
+        last_val = float(train['sales'].dropna().iloc[-1]) if train['sales'].dropna().shape[0]>0 else 0.0
+        for fm in forecast_months:
+            forecasts.append({'date': fm, 'product_code': prod, 'forecast': last_val})
+    if stats is not None:
+        stats.append((prod, time.perf_counter() - started, outcome, error))
+    return forecasts
+
+def _forecast_chunk(chunk, forecast_months, regressors, model_store=None, method='Prophet', futures=None):
+    # fit timings travel back from the pool worker with the rows
+    forecasts, fits = [], []
+    for prod, g in chunk:
+        forecasts.extend(_forecast_product(prod, g, forecast_months, regressors, model_store, method,
+                                           stats=fits, future=futures.get(prod) if futures else None))
+    return forecasts, fits
+
+def _wide_sales(processed_df):
+    """(products x months) sales for products with any sales, their codes and the last month."""
+    wide = processed_df.pivot(index='date', columns='product_code', values='sales').sort_index()
+    wide = wide.loc[:, wide.notna().any()]
+    return wide.to_numpy(dtype=float).T, wide.columns.to_numpy(), wide.index.max()
+
+def _steps(forecast_months, last_month):
+    # months past the history are forecasts, months inside it use fitted values
+    return [(fm.year - last_month.year) * 12 + fm.month - last_month.month for fm in forecast_months]
+
+def _long_forecasts(forecast_months, products, values):
+    return pd.DataFrame({
+        'date': np.repeat(forecast_months.values, len(products)),
+        'product_code': np.tile(products, len(forecast_months)),
+        'forecast': values.T.ravel(),
+    })
+
+def _forecast_batched_hw(processed_df, forecast_months, progress=None):
+    Y, products, last_month = _wide_sales(processed_df)
+    if Y.shape[1] < holtwinters.SEASON:
+        values = np.repeat(Y[:, -1:], len(forecast_months), axis=1)
+    else:
+        values = holtwinters.forecast(holtwinters.fit(Y), _steps(forecast_months, last_month))
+        bad = ~np.isfinite(values)
+        values[bad] = np.broadcast_to(Y[:, -1:], values.shape)[bad]
+    if progress:
+        progress(len(products), len(products))
+    return _long_forecasts(forecast_months, products, values)
+
+# Product attributes the global model gets as static codes
+STATIC_COLUMNS = ['category', 'sub_category', 'brand', 'region']
+
+def _forecast_global(processed_df, forecast_months, regressors, progress=None):
+    # one globalmodel fit over every product; regressors and static codes
+    # on the same (products x months) grid as the sales
+    sales = processed_df.pivot(index='date', columns='product_code', values='sales').sort_index()
+    sales = sales.loc[:, sales.notna().any()]
+    products, history = sales.columns, sales.index
+
+    def wide(col):
+        return processed_df.pivot(index='date', columns='product_code', values=col) \
+            .reindex(index=history, columns=products).ffill().bfill()
+
+    regs = [wide(r).to_numpy(dtype=float).T for r in regressors if r in processed_df.columns]
+    static = []
+    for col in STATIC_COLUMNS:
+        if col in processed_df.columns and isinstance(processed_df[col].dtype, pd.CategoricalDtype):
+            codes = processed_df[col].cat.codes.astype(float).where(processed_df[col].cat.codes >= 0)
+            last = codes.groupby(processed_df['product_code']).last()
+            static.append(last.reindex(products).to_numpy())
+    values = globalmodel.forecast(sales.to_numpy(dtype=float).T, _steps(forecast_months, history.max()),
+                                  history.min().month - 1, regs,
+                                  np.column_stack(static) if static else None)
+    if progress:
+        progress(len(products), len(products))
+    return _long_forecasts(forecast_months, products.to_numpy(), values)
+
+def _forecast_baseline(processed_df, forecast_months, method, progress=None):
+    Y, products, last_month = _wide_sales(processed_df)
+    values = baselines.FORECASTERS[method](Y, _steps(forecast_months, last_month))
+    if progress:
+        progress(len(products), len(products))
+    return _long_forecasts(forecast_months, products, values)
+
+def _forecast_routed(processed_df, forecast_months, regressors, progress=None, **kwargs):
+    """
+    Classify every product's history with baselines.route() and forecast each
+    group with its method: the vectorized baselines for intermittent, short,
+    flat or low-volume series, the default per-product model (Prophet if
+    installed) for the rest. The output carries each product's method.
+    """
+    Y, products, last_month = _wide_sales(processed_df)
+    model = resolve_method(None)
+    routes, _ = baselines.route(Y, model)
+    steps = _steps(forecast_months, last_month)
+    parts = []
+    for name, forecaster in baselines.FORECASTERS.items():
+        sel = routes == name
+        if sel.any():
+            parts.append(_long_forecasts(forecast_months, products[sel], forecaster(Y[sel], steps)))
+    cheap = len(products) - int((routes == model).sum())
+    if kwargs.get('stats') is not None:
+        kwargs['stats'].add_panel(cheap)
+    if progress:
+        progress(cheap, len(products))
+    if cheap < len(products):
+        heavy = processed_df[processed_df['product_code'].isin(products[routes == model])]
+        parts.append(forecast_panel(heavy, forecast_months, regressors, method=model,
+                                    progress=(lambda done, total: progress(cheap + done, len(products)))
+                                    if progress else None, **kwargs))
+    if not parts:
+        return pd.DataFrame(columns=['date', 'product_code', 'forecast', 'method'])
+    forecasts = pd.concat(parts, ignore_index=True).sort_values(['date','product_code']).reset_index(drop=True)
+    forecasts['method'] = forecasts['product_code'].map(dict(zip(products, routes)))
+    if kwargs.get('degraded'):
+        forecasts.loc[forecasts['product_code'].isin(kwargs['degraded']), 'method'] = DEADLINE_FALLBACK
+    return forecasts
+
+def warm_up(method=None, regressors=['mrp','discount','rating']):
+    """
+    Import method's backend and fit one small synthetic product, so the first
+    real fit in this process does not pay for imports or Stan model loading.
+    """
+    method = resolve_method(method)
+    if method == 'Router':
+        # the router only fits full models for the series that need them
+        method = resolve_method(None)
+    load_backend(method)
+    if method in PANEL_METHODS:
+        return
+    rng = np.random.default_rng(0)
+    months = pd.date_range('2020-01-01', periods=36, freq='MS')
+    g = pd.DataFrame({'date': months, 'product_code': '__warmup__',
+                      'sales': 100 + 10 * np.sin(np.arange(36) * np.pi / 6) + rng.normal(0, 5, 36),
+                      **{r: rng.uniform(1, 2, 36).astype(np.float32) for r in regressors}})
+    _forecast_product('__warmup__', g, months[-3:], regressors, method=method)
+
+def resolve_workers(n_jobs):
+    """Map n_jobs (None/1 = serial, -1 = all cores) to a worker count."""
+    if n_jobs is None:
+        return 1
+    if n_jobs < 0:
+        return max(1, (os.cpu_count() or 1) + 1 + n_jobs)
+    return max(1, n_jobs)
+
+def _by_value(processed_df, months=VALUE_MONTHS):
+    """Product codes by sales value (sales x mrp when there is mrp) over the last months, largest first."""
+    recent = processed_df[processed_df['date'] > processed_df['date'].max() - pd.DateOffset(months=months)]
+    value = recent['sales'].fillna(0)
+    if 'mrp' in recent.columns:
+        value = value * recent['mrp'].fillna(1).astype(float)
+    totals = value.groupby(recent['product_code'], observed=True).sum()
+    return totals.sort_values(ascending=False, kind='stable').index.to_numpy()
+
+def _time_left(deadline, products_left):
+    # seconds until the deadline, less what the fallback and the rest of the run need
+    return deadline - time.monotonic() - DEADLINE_RESERVE_SEC - products_left * DEADLINE_FALLBACK_SEC
+
+def _deadline_at(seconds, started=None):
+    # a request's time budget as a time.monotonic() deadline; None without one
+    if not seconds:
+        return None
+    return (started if started is not None else time.monotonic()) + seconds
+
+def _product_batches(processed_df, forecast_months, regressors, n_jobs, chunk_size, model_store, method,
+                     pool, fits, deadline=None):
+    """
+    Per-product fits for forecast_panel, yielded as (rows, products,
+    products_total) as they finish: one product at a time serially, one
+    chunk at a time (in submission order) on a pool. fits, a list, gets
+    every product's (product, seconds, outcome, error). Closing the generator early
+    cancels the chunks not yet started.
+
+    deadline (a time.monotonic() value) runs the products largest value
+    first and stops once the next product or chunk would not finish in
+    time (see _time_left); the caller forecasts whatever was not yielded.
+    """
+    n_products = processed_df['product_code'].nunique()
+    if pool is not None:
+        # n_jobs caps the warm workers this run keeps busy; None takes them all
+        workers = pool.max_workers if n_jobs is None else min(resolve_workers(n_jobs), pool.max_workers)
+    else:
+        workers = min(resolve_workers(n_jobs), n_products)
+    order = _by_value(processed_df) if deadline is not None else None
+
+    # every product's Prophet future frame in one pass instead of merges per product
+    futures = _future_regressors(processed_df, forecast_months, regressors) if method == 'Prophet' else {}
+
+    if pool is None and (workers <= 1 or n_products < PARALLEL_MIN_PRODUCTS):
+        groups = list(processed_df.groupby('product_code'))
+        if order is not None:
+            rank = {prod: i for i, prod in enumerate(order)}
+            groups.sort(key=lambda pg: rank.get(pg[0], len(rank)))
+        for i, (prod, g) in enumerate(groups):
+            if deadline is not None:
+                # the mean fit so far stands in for the next one
+                if _time_left(deadline, len(groups) - i) < sum(f[1] for f in fits) / max(len(fits), 1):
+                    return
+            yield (_forecast_product(prod, g, forecast_months, regressors, model_store, method,
+                                     stats=fits, future=futures.get(prod)), [prod], len(groups))
+    elif n_products:
+        if not chunk_size:
+            # ~4 chunks per worker keeps the pool busy without tiny tasks; a
+            # deadline gets smaller ones so less is left over when it stops
+            chunk_size = max(1, math.ceil(n_products / (workers * (16 if deadline is not None else 4))))
+        # workers map the panel from shared memory instead of unpickling product frames
+        columns = ['sales'] + [r for r in regressors if r in processed_df.columns]
+        shared = SharedPanel(processed_df, columns)
+        chunks = shared.chunks(chunk_size, order)
+        executor = pool if pool is not None else ProcessPoolExecutor(max_workers=workers)
+        finished = False
+        try:
+            # map() yields in submission order, so the merge is deterministic
+            done = 0
+            chunk_futures = [{prod: futures[prod] for prod in chunk.products if prod in futures}
+                             for chunk in chunks]
+            timeout = max(_time_left(deadline, n_products), 0) if deadline is not None else None
+            map_args = (_forecast_chunk, chunks, repeat(forecast_months), repeat(regressors),
+                        repeat(model_store), repeat(method), chunk_futures)
+            if pool is not None:
+                results = pool.map(*map_args, timeout=timeout, max_in_flight=workers)
+            else:
+                results = executor.map(*map_args, timeout=timeout)
+            try:
+                for chunk, (rows, chunk_fits) in zip(chunks, results):
+                    fits.extend(chunk_fits)
+                    done += len(chunk)
+                    yield rows, chunk.products, n_products
+                    if deadline is not None and done < n_products and _time_left(deadline, n_products - done) <= 0:
+                        return
+            except TimeoutError:
+                # chunks still queued are cancelled when results is closed
+                return
+            finally:
+                results.close()
+            finished = True
+        finally:
+            if pool is None:
+                # a stopped run does not wait for the chunks in flight
+                executor.shutdown(wait=finished, cancel_futures=not finished)
+            shared.close()
+
+def forecast_panel(processed_df, forecast_months, regressors=['mrp','discount','rating'],
+                   n_jobs=None, chunk_size=None, progress=None, model_store=None, method=None,
+                   pool=None, stats=None, fitted=False, deadline=None, degraded=None):
+    """
+    Fit one model per product and predict forecast_months.
+
+    With n_jobs > 1 (or -1 for all cores; None or 1 is serial) products are
+    split into chunks of chunk_size and fitted in a process pool; results
+    are merged in product order so the output is identical to the serial
+    path. Workers read their products from a sharedpanel.SharedPanel rather
+    than pickled frames.
+    Panels smaller than PARALLEL_MIN_PRODUCTS always run serially.
+
+    pool, a started workers.WorkerPool, replaces the per-call process pool:
+    its workers have the model backend imported and warmed already, so every
+    panel is sent to it whatever its size. There n_jobs caps how many of its
+    workers the run keeps busy (chunks in flight); None uses all of them.
+
+    progress, if given, is called as progress(products_done, products_total).
+    With a model_store (model_store.ModelStore) fitted models are reused for
+    products whose preprocessed history is unchanged since the last run.
+    method is one of METHODS (default: Prophet if installed); BatchedHoltWinters
+    and the baselines.py methods forecast the whole panel in one vectorized
+    pass instead of per product; GlobalBoosting fits one gradient-boosting
+    model across all products (globalmodel.py). Router picks a method per
+    product (see _forecast_routed) and adds a method column to the output.
+
+    stats, a profiling.RunStats, collects every product's fit time and outcome.
+
+    fitted also returns in-sample predictions for every month of the panel,
+    from the same fit and (for Prophet) the same predict call as the
+    forecasts; the output then has an in_sample column.
+
+    deadline, a time.monotonic() value, bounds the per-product methods:
+    products are fitted largest sales value first, and those not reached in
+    time are forecast with DEADLINE_FALLBACK instead. degraded, a list, gets
+    those products' codes.
+    """
+    method = resolve_method(method)
+    if fitted:
+        if (resolve_method(None) if method == 'Router' else method) == 'ExponentialSmoothing':
+            raise ValueError("fitted values need Prophet or a vectorized method")
+        history = pd.DatetimeIndex(processed_df['date'].unique())
+        out = forecast_panel(processed_df, history.union(forecast_months), regressors, n_jobs, chunk_size,
+                             progress, model_store, method, pool, stats, deadline=deadline, degraded=degraded)
+        out['in_sample'] = ~out['date'].isin(forecast_months)
+        return out
+    if method in PANEL_METHODS:
+        if method == 'BatchedHoltWinters':
+            out = _forecast_batched_hw(processed_df, forecast_months, progress)
+        elif method == 'GlobalBoosting':
+            out = _forecast_global(processed_df, forecast_months, regressors, progress)
+        else:
+            out = _forecast_baseline(processed_df, forecast_months, method, progress)
+        if stats is not None:
+            stats.add_panel(len(out) // max(len(forecast_months), 1))
+        return out
+    if method == 'Router':
+        return _forecast_routed(processed_df, forecast_months, regressors, progress, n_jobs=n_jobs,
+                                chunk_size=chunk_size, model_store=model_store, pool=pool, stats=stats,
+                                deadline=deadline, degraded=degraded)
+
+    forecasts, fits, done = [], [], set()
+    batches = _product_batches(processed_df, forecast_months, regressors, n_jobs, chunk_size,
+                               model_store, method, pool, fits, deadline)
+    try:
+        for rows, products, total in batches:
+            forecasts.extend(rows)
+            done.update(products)
+            if progress:
+                progress(len(done), total)
+    finally:
+        # a progress callback that raises (a cancelled job) stops pending chunks now
+        batches.close()
+        if stats is not None:
+            stats.add_fits(fits)
+    if model_store is not None:
+        model_store.prune()
+    out = pd.DataFrame(forecasts)
+    if deadline is not None:
+        rest = processed_df[~processed_df['product_code'].isin(done)]
+        if len(rest):
+            fallback = forecast_panel(rest, forecast_months, method=DEADLINE_FALLBACK, stats=stats)
+            if degraded is not None:
+                degraded.extend(sorted(fallback['product_code'].unique()))
+            out = pd.concat([out, fallback], ignore_index=True)
+            if progress:
+                n = processed_df['product_code'].nunique()
+                progress(n, n)
+    return out.sort_values(['date','product_code']).reset_index(drop=True)
+
+def iter_forecast_panel(processed_df, forecast_months, regressors=['mrp','discount','rating'],
+                        n_jobs=None, chunk_size=None, model_store=None, method=None, pool=None, stats=None,
+                        deadline=None, degraded=None):
+    """
+    forecast_panel in batches of whole products, each a DataFrame with the
+    same columns sorted by date, yielded as soon as it is done: one product
+    at a time serially, one chunk at a time on a pool (a small chunk_size
+    gets results out sooner). The vectorized methods and Router come as a
+    single batch. Batches arrive in product order, or largest value first
+    with a deadline (as in forecast_panel), followed by one batch of the
+    DEADLINE_FALLBACK forecasts for the products not reached.
+    """
+    method = resolve_method(method)
+    if method in PANEL_METHODS or method == 'Router':
+        yield forecast_panel(processed_df, forecast_months, regressors, n_jobs, chunk_size,
+                             model_store=model_store, method=method, pool=pool, stats=stats,
+                             deadline=deadline, degraded=degraded)
+        return
+    fits, done = [], set()
+    batches = _product_batches(processed_df, forecast_months, regressors, n_jobs, chunk_size,
+                               model_store, method, pool, fits, deadline)
+    try:
+        for rows, products, _ in batches:
+            done.update(products)
+            if rows:
+                yield pd.DataFrame(rows).sort_values(['date','product_code']).reset_index(drop=True)
+    finally:
+        batches.close()
+        if stats is not None:
+            stats.add_fits(fits)
+    if model_store is not None:
+        model_store.prune()
+    if deadline is not None:
+        rest = processed_df[~processed_df['product_code'].isin(done)]
+        if len(rest):
+            fallback = forecast_panel(rest, forecast_months, method=DEADLINE_FALLBACK, stats=stats)
+            if degraded is not None:
+                degraded.extend(sorted(fallback['product_code'].unique()))
+            yield fallback
+
+# -------------------------------
+# Hierarchical forecasting
+# -------------------------------
+def forecast_hierarchy(processed_df, forecast_months, levels, reconciliation='bottom_up', **kwargs):
+    """
+    Forecast every node of the hierarchy given by levels (see hierarchy.py)
+    and reconcile the node forecasts so children sum to their parents.
+
+    Only the nodes the reconciliation needs are fitted: the bottom nodes for
+    bottom_up, the total for top_down, every node for ols. Node series are
+    plain sales totals, so no regressors are used. kwargs go to
+    forecast_panel. Returns (forecasts, h): forecasts has one row per
+    (month, node) with the node id in product_code, h is hierarchy.build().
+    """
+    h = hierarchy.build(processed_df, levels)
+    fit = hierarchy.nodes_to_fit(h, reconciliation)
+    ids = np.array([n['id'] for n in h['nodes']], dtype=object)
+    series = pd.DataFrame({
+        'date': np.repeat(h['months'].values, len(fit)),
+        'product_code': np.tile(ids[fit], len(h['months'])),
+        'sales': h['Y'][fit].T.ravel(),
+    })
+    base = forecast_panel(series, forecast_months, regressors=[], **kwargs)
+    h['fits'] = len(fit)
+
+    yhat = np.full((len(ids), len(forecast_months)), np.nan)
+    if not base.empty:
+        wide = base.pivot(index='product_code', columns='date', values='forecast')
+        wide = wide.reindex(index=ids, columns=forecast_months)
+        yhat[fit] = wide.to_numpy(dtype=float)[fit]
+    values = hierarchy.reconcile(h, yhat, reconciliation)
+    forecasts = pd.DataFrame({
+        'date': np.repeat(forecast_months.values, len(ids)),
+        'product_code': np.tile(ids, len(forecast_months)),
+        'forecast': values.T.ravel(),
+    })
+    return forecasts, h
+
+# -------------------------------
+# Prediction intervals
+# -------------------------------
+def forecast_intervals(processed_df, forecasts, forecast_months, quantiles=intervals.QUANTILES,
+                       samples=intervals.SAMPLES):
+    """
+    Prediction quantiles around forecast_panel output for every product in
+    one batch: a (date, product_code) row per forecast month and product
+    with a column per quantile, named by intervals.names(). The error
+    spread always comes from a bootstrap of each product's own Holt-Winters
+    one-step errors (see intervals.py), whichever method made the
+    forecasts, so only the centre of the band follows the method.
+    """
+    Y, products, last_month = _wide_sales(processed_df)
+    point = forecasts.pivot(index='product_code', columns='date', values='forecast') \
+        .reindex(index=products, columns=forecast_months).to_numpy(dtype=float)
+    values = intervals.simulate(Y, point, _steps(forecast_months, last_month), quantiles, samples)
+    out = pd.DataFrame({
+        'date': np.repeat(forecast_months.values, len(products)),
+        'product_code': np.tile(products, len(forecast_months)),
+    })
+    for k, name in enumerate(intervals.names(quantiles)):
+        out[name] = values[:, :, k].T.ravel()
+    return out
 
 # -------------------------------
 # Metrics
@@ -160,77 +881,467 @@ def compute_metrics_series(a,f):
     nonzero = a!=0
     mape_val = float(np.mean(np.abs((a[nonzero]-f[nonzero])/a[nonzero]))*100.0) if nonzero.sum()>0 else None
     smape_val = float(smape(a,f))
-    rmse_val = float(math.sqrt(mean_squared_error(a,f)))
+    rmse_val = float(math.sqrt(np.mean((a - f) ** 2)))
     acc_val = float(100.0 - mape_val) if mape_val is not None else None
     return {'mape': mape_val,'smape': smape_val,'rmse': rmse_val,'accuracy': acc_val}
 
+def compute_metrics_grouped(product_codes, a, f):
+    """
+    compute_metrics_series for every product at once. Rows are laid out as a
+    (products x months) grid, padded, in their original order per product,
+    and each metric is a row-wise reduction. Results match the per-product
+    call to float rounding (within a few ULP): padding and masked-out zeros
+    change how the sums are split. Returns {product_code: metrics}, products
+    sorted.
+    """
+    if len(product_codes) == 0:
+        return {}
+    products, rows = _product_rows(np.asarray(product_codes, dtype=object))
+    A = np.asarray(a, dtype=float)[rows]
+    F = np.asarray(f, dtype=float)[rows]
+    pad = rows < 0
+    if pad.any():
+        A[pad], F[pad] = np.nan, 0.0
+    mask = ~np.isnan(A)
+    A = np.where(mask, A, 0.0)
+    n = mask.sum(axis=1)
+
+    nonzero = mask & (A != 0)
+    n_nonzero = nonzero.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mape = np.where(nonzero, np.abs((A - F) / A), 0.0).sum(axis=1) / n_nonzero * 100.0
+
+        denom = np.abs(A) + np.abs(F)
+        res = np.where(denom == 0, 0.0, 2 * np.abs(F - A) / denom)
+        res_ok = mask & ~np.isnan(res)
+        smape_ = np.where(res_ok, res, 0.0).sum(axis=1) / res_ok.sum(axis=1) * 100.0
+
+        rmse = np.sqrt(np.where(mask, (A - F) ** 2, 0.0).sum(axis=1) / n)
+
+    empty = {'mape':None,'smape':None,'rmse':None,'accuracy':None}
+    mape = np.where(n_nonzero > 0, mape, np.nan).tolist()
+    return {
+        prod: {'mape': None if m != m else m, 'smape': s, 'rmse': r,
+               'accuracy': None if m != m else 100.0 - m} if n_i else dict(empty)
+        for prod, n_i, m, s, r in zip(products.tolist(), n.tolist(), mape, smape_.tolist(), rmse.tolist())
+    }
+
+def _product_rows(product_codes):
+    """
+    Sorted unique products and a (products x max rows) index of each
+    product's row positions in original order, padded with -1.
+    """
+    # forecast_panel output is date-major with the same sorted products every
+    # month; spotting that avoids hashing 50k x 24 strings
+    repeats = np.flatnonzero(product_codes == product_codes[0])
+    width = repeats[1] if len(repeats) > 1 else len(product_codes)
+    first = product_codes[:width]
+    if (len(product_codes) % width == 0
+            and (first[1:] > first[:-1]).all()
+            and (product_codes.reshape(-1, width) == first).all()):
+        return first, np.ascontiguousarray(np.arange(len(product_codes)).reshape(-1, width).T)
+
+    codes, products = pd.factorize(product_codes, sort=True)
+    order = np.argsort(codes, kind='stable')
+    counts = np.bincount(codes, minlength=len(products))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    sorted_codes = codes[order]
+    rows = np.full((len(products), counts.max()), -1)
+    rows[sorted_codes, np.arange(len(order)) - starts[sorted_codes]] = order
+    return products, rows
+
+def aggregate_metrics(metrics):
+    """Means of the per-product metrics ({} when there are none)."""
+    if not metrics:
+        return {}
+    mape_vals = [v['mape'] for v in metrics.values() if v['mape'] is not None]
+    smape_vals = [v['smape'] for v in metrics.values() if v['smape'] is not None]
+    rmse_vals = [v['rmse'] for v in metrics.values() if v['rmse'] is not None]
+    acc_vals = [v['accuracy'] for v in metrics.values() if v['accuracy'] is not None]
+    return {
+        "mape_mean": float(np.mean(mape_vals)) if mape_vals else None,
+        "smape_mean": float(np.mean(smape_vals)) if smape_vals else None,
+        "rmse_mean": float(np.mean(rmse_vals)) if rmse_vals else None,
+        "accuracy_mean": float(np.mean(acc_vals)) if acc_vals else None,
+    }
+
+# -------------------------------
+# Result formatting
+# -------------------------------
+def format_forecasts(forecasts, forecast_months):
+    """
+    [{date: {product_code: forecast}}] for each forecast month in one pass
+    over the date-sorted forecasts; values are rounded to 2 places and NaN
+    becomes None as they are emitted.
+    """
+    forecasts = forecasts.sort_values(['date','product_code'], kind='stable')
+    dates = forecasts['date'].to_numpy(dtype='datetime64[ns]')
+    products = forecasts['product_code'].tolist()
+    values = np.round(forecasts['forecast'].to_numpy(dtype=float), 2)
+    has_nan = np.isnan(values).any()
+    values = values.tolist()
+    if has_nan:
+        values = [None if v != v else v for v in values]
+
+    months = forecast_months.values.astype('datetime64[ns]')
+    starts = np.searchsorted(dates, months, side='left')
+    ends = np.searchsorted(dates, months, side='right')
+    return [
+        {d.strftime("%Y-%m-%d"): dict(zip(products[s:e], values[s:e]))}
+        for d, s, e in zip(forecast_months, starts, ends)
+    ]
+
+# -------------------------------
+# Columnar output
+# -------------------------------
+OUTPUT_FORMATS = ('json', 'parquet', 'arrow')
+
+def forecasts_to_bytes(result, fmt):
+    """
+    Flatten run_forecast's forecasted_products into a (date, product_code,
+    forecast) table, plus a column per prediction quantile when the result
+    has intervals, and encode it as Parquet or Arrow IPC. The remaining
+    result fields go into the schema metadata as JSON.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    dates, products, values = [], [], []
+    for entry in result['forecasted_products']:
+        for d, by_product in entry.items():
+            dates.extend([d] * len(by_product))
+            products.extend(by_product.keys())
+            values.extend(by_product.values())
+    columns = {
+        'date': pa.array(pd.Series(pd.to_datetime(dates), dtype='datetime64[ns]'), pa.timestamp('ms')),
+        'product_code': pa.array(products, pa.string()).dictionary_encode(),
+        'forecast': pa.array(values, pa.float64()),
+    }
+    for name, entries in result.get('intervals', {}).items():
+        bands = {d: by_product for entry in entries for d, by_product in entry.items()}
+        columns[name] = pa.array([bands[d].get(p) for d, p in zip(dates, products)], pa.float64())
+    table = pa.table(columns)
+    extra = {k: v for k, v in result.items() if k not in ('forecasted_products', 'intervals')}
+    table = table.replace_schema_metadata({'forecast_result': json.dumps(extra)})
+    sink = pa.BufferOutputStream()
+    if fmt == 'parquet':
+        pq.write_table(table, sink)
+    elif fmt == 'arrow':
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        raise ValueError(f"Unknown output format {fmt!r}, expected parquet or arrow")
+    return sink.getvalue().to_pybytes()
+
 # -------------------------------
 # Main pipeline function
 # -------------------------------
-def run_forecast(train_file, start_month, end_month, test_file=None):
-    # Load
-    raw, test_actuals = load_data(train_file, test_file)
-    processed = preprocess_panel(raw)
-    
-    if test_actuals is not None:
-        # This line finds any missing values (NaNs) in your test data and fills them with 0.
-        test_actuals.fillna(0, inplace=True)
-        
+def _report_errors(stats, method):
+    # fits that raised are forecast with the last value and would go unnoticed otherwise
+    errors = stats.errors(top=1)
+    if errors:
+        print(f"[forecast] {stats.outcome_counts()['error']} of {len(stats.fits)} {method} fits raised "
+              f"and used the last value, e.g. {errors[0]['example']}: {errors[0]['error']}")
+
+def run_forecast(train_file, start_month, end_month, test_file=None, n_jobs=None, chunk_size=None,
+                 progress=None, regressors=['mrp','discount','rating'], cache=None, model_store=None,
+                 method=None, pool=None, levels=None, reconciliation='bottom_up', dataset=None,
+                 timings=False, profile=False, fitted=False, deadline=None, started=None,
+                 quantiles=None):
+    """
+    Load, preprocess, forecast and score an upload. With levels (hierarchy
+    columns, see hierarchy.parse_levels) the forecasts are per hierarchy node
+    instead of per product, reconciled with reconciliation. With a dataset
+    (datasets.Dataset) its stored panel is used and train_file is ignored.
+    test_file is indexed once per process by actuals.load and scored from
+    there until it changes.
+
+    Stage and fit timings always feed profiling.REGISTRY (/metrics); with
+    timings they are also returned in meta['timings']. profile cProfiles the
+    run (the cache is skipped so there is work to see) and adds the dump
+    path and top functions as meta['profile'].
+
+    fitted adds in-sample predictions over the history as fitted_products
+    (same layout as forecasted_products); they are not scored.
+
+    deadline is a time budget in seconds, counted from started (a
+    time.monotonic() value, e.g. when the request came in; default now).
+    Per-product fits that would not finish in time are replaced by
+    DEADLINE_FALLBACK forecasts (see forecast_panel); meta['deadline'] lists
+    those products under 'degraded', and a degraded result is not cached.
+
+    quantiles (e.g. (0.5, 0.9)) adds prediction intervals for every product
+    as intervals: {'p50': [...], 'p90': [...]}, each laid out like
+    forecasted_products (see forecast_intervals).
+    """
+    stats = profiling.RunStats()
+    deadline = _deadline_at(deadline, started)
+    with profiling.cprofile(profile) as profile_info:
+        result, cache_state = _run_forecast(
+            stats, train_file, start_month, end_month, test_file, n_jobs, chunk_size, progress,
+            regressors, None if profile else cache, model_store, method, pool, levels,
+            reconciliation, dataset, fitted, deadline, quantiles)
+    profiling.REGISTRY.observe(stats, result["meta"]["method"], cache_state)
+    _report_errors(stats, result["meta"]["method"])
+    if timings or profile:
+        result = {**result, "meta": {**result["meta"]}}
+        if timings:
+            result["meta"]["timings"] = stats.summary()
+        if profile:
+            result["meta"]["profile"] = profile_info
+    return result
+
+def cached_forecast(cache, train_file, start_month, end_month, test_file=None,
+                    regressors=['mrp','discount','rating'], method=None, levels=None,
+                    reconciliation='bottom_up', dataset=None, timings=False, fitted=False, quantiles=None):
+    """
+    run_forecast's answer when cache already holds it, else None, without
+    loading or forecasting anything; so a repeat request need not wait for
+    a job worker.
+    """
+    stats = profiling.RunStats()
+    method = resolve_method(method)
+    hierarchy_params = {}
+    if levels:
+        hierarchy_params = {'levels': hierarchy.parse_levels(levels),
+                            'reconciliation': hierarchy.check_reconciliation(reconciliation)}
+    forecast_months = pd.date_range(pd.to_datetime(start_month), pd.to_datetime(end_month), freq='MS')
+    with stats.stage('cache'):
+        key = _result_key(train_file, forecast_months, method, regressors, test_file,
+                          hierarchy_params, dataset, fitted, tuple(quantiles or ()))
+        hit = cache.get(key)
+    if hit is None:
+        return None
+    profiling.REGISTRY.observe(stats, method, "hit")
+    meta = {**hit["meta"], "cache": "hit"}
+    if timings:
+        meta["timings"] = stats.summary()
+    return {**hit, "meta": meta}
+
+def _result_key(train_file, forecast_months, method, regressors, test_file, hierarchy_params,
+                dataset=None, fitted=False, quantiles=()):
+    # a dataset's meta.json changes with every append, so it keys the version
+    data_path = dataset.meta_path if dataset is not None else train_file
+    return cache_key(data_path, forecast_months, method, regressors, test_file, **hierarchy_params,
+                     **({'fitted': True} if fitted else {}),
+                     **({'quantiles': list(quantiles)} if quantiles else {}))
+
+def _load_inputs(stats, train_file, test_file, columns, dataset=None):
+    # (preprocessed panel, test actuals or None, last history month per product)
+    with stats.stage('load'):
+        if dataset is not None:
+            processed = dataset.panel()
+            last_dates_per_product = dataset.meta()['last_dates']
+        else:
+            raw, _ = load_data(train_file, columns=columns)
+        # parsed once per test file version; missing sales count as 0
+        test_actuals = actuals.load(test_file) if test_file and os.path.exists(test_file) else None
+
+    if dataset is None:
+        with stats.stage('preprocess'):
+            processed = preprocess_panel(raw)
+        last_dates_per_product = raw.groupby('product_code', observed=True)['date'].max().apply(lambda x: x.strftime('%Y-%m-%d')).to_dict()
+    return processed, test_actuals, last_dates_per_product
+
+def _run_forecast(stats, train_file, start_month, end_month, test_file, n_jobs, chunk_size, progress,
+                  regressors, cache, model_store, method, pool, levels, reconciliation, dataset,
+                  fitted=False, deadline=None, quantiles=None):
     # Forecast months
     FORECAST_START = pd.to_datetime(start_month)
     FORECAST_END = pd.to_datetime(end_month)
     forecast_months = pd.date_range(FORECAST_START, FORECAST_END, freq='MS')
-    
-    forecasts = forecast_panel(processed, forecast_months)
-    
+    method = resolve_method(method)
+    if levels:
+        levels = hierarchy.parse_levels(levels)
+        reconciliation = hierarchy.check_reconciliation(reconciliation)
+        hierarchy_params = {'levels': levels, 'reconciliation': reconciliation}
+    else:
+        hierarchy_params = {}
+    if fitted and levels:
+        raise ValueError("fitted values are not available for hierarchy forecasts")
+    if quantiles and levels:
+        raise ValueError("prediction intervals are not available for hierarchy forecasts")
+    quantiles = tuple(quantiles or ())
+
+    # Result cache (see cache.ResultCache): same upload + window + method -> same answer.
+    # Request handlers look first (cached_forecast); this catches hits that
+    # landed while the job was queued
+    key = None
+    if cache is not None:
+        with stats.stage('cache'):
+            key = _result_key(train_file, forecast_months, method, regressors, test_file,
+                              hierarchy_params, dataset, fitted, quantiles)
+            hit = cache.get(key)
+        if hit is not None:
+            return {**hit, "meta": {**hit["meta"], "cache": "hit"}}, "hit"
+
+    # Load
+    columns = SALES_COLUMNS + list(regressors) + [l for l in levels or [] if l not in SALES_COLUMNS]
+    processed, test_actuals, last_dates_per_product = _load_inputs(stats, train_file, test_file, columns, dataset)
+
+    degraded = []
+    with stats.stage('forecast'):
+        if levels:
+            forecasts, h = forecast_hierarchy(processed, forecast_months, levels, reconciliation,
+                                              n_jobs=n_jobs, chunk_size=chunk_size, progress=progress,
+                                              model_store=model_store, method=method, pool=pool,
+                                              stats=stats, deadline=deadline, degraded=degraded)
+        else:
+            forecasts = forecast_panel(processed, forecast_months, regressors=regressors,
+                                       n_jobs=n_jobs, chunk_size=chunk_size, progress=progress,
+                                       model_store=model_store, method=method, pool=pool, stats=stats,
+                                       fitted=fitted, deadline=deadline, degraded=degraded)
+            if fitted:
+                in_sample = forecasts.pop('in_sample').to_numpy()
+                fitted_df, forecasts = forecasts[in_sample], forecasts[~in_sample].reset_index(drop=True)
+
+    if quantiles:
+        with stats.stage('intervals'):
+            bands = forecast_intervals(processed, forecasts, forecast_months, quantiles)
+
     # Format forecast JSON
-    forecasted_products = []
-    for d in forecast_months:
-        d_str = d.strftime("%Y-%m-%d")
-        row = forecasts[forecasts['date']==d]
-        forecasted_products.append({d_str: {r['product_code']: round(r['forecast'],2) for _,r in row.iterrows()}})
-    
+    with stats.stage('format'):
+        forecasted_products = format_forecasts(forecasts, forecast_months)
+        if fitted:
+            history_months = pd.DatetimeIndex(fitted_df['date'].unique()).sort_values()
+            fitted_products = format_forecasts(fitted_df, history_months)
+        if quantiles:
+            interval_products = {
+                name: format_forecasts(bands[['date', 'product_code', name]].rename(columns={name: 'forecast'}),
+                                       forecast_months)
+                for name in intervals.names(quantiles)
+            }
+
     # Metrics
     metrics = {}
-    if test_actuals is not None and not test_actuals.empty:
-        test_actuals['date'] = pd.to_datetime(test_actuals['date']).dt.to_period('M').dt.to_timestamp()
-        test_window = test_actuals[test_actuals['date'].isin(forecast_months)]
-        merged = forecasts.merge(test_window[['date','product_code','sales']], on=['date','product_code'], how='left')
-        for prod, g in merged.groupby('product_code'):
-            a = g['sales'].values
-            f = g['forecast'].values
-
+    with stats.stage('metrics'):
+        if test_actuals is not None and test_actuals.rows:
+            if levels:
+                test_window = hierarchy.aggregate(test_actuals.frame(forecast_months), h)
+                merged = forecasts.merge(test_window, on=['date','product_code'], how='left')
+                a = merged['sales'].to_numpy(dtype=float)
+            else:
+                # index lookup, row for row with forecasts
+                merged = forecasts
+                a = test_actuals.lookup(forecasts['product_code'], forecasts['date'])
             a = np.nan_to_num(a) # Converts any NaN in actuals to 0
-            f = np.nan_to_num(f) # Converts any NaN in forecasts to 0
+            f = np.nan_to_num(merged['forecast'].to_numpy(dtype=float)) # Converts any NaN in forecasts to 0
+            metrics = compute_metrics_grouped(merged['product_code'].to_numpy(dtype=object), a, f)
 
-            metrics[prod] = compute_metrics_series(a,f)
-    
-    # Aggregated metrics (optional)
-    agg_metrics = {}
-    if metrics:
-        mape_vals = [v['mape'] for v in metrics.values() if v['mape'] is not None]
-        smape_vals = [v['smape'] for v in metrics.values() if v['smape'] is not None]
-        rmse_vals = [v['rmse'] for v in metrics.values() if v['rmse'] is not None]
-        acc_vals = [v['accuracy'] for v in metrics.values() if v['accuracy'] is not None]
-        agg_metrics = {
-            "mape_mean": float(np.mean(mape_vals)) if mape_vals else None,
-            "smape_mean": float(np.mean(smape_vals)) if smape_vals else None,
-            "rmse_mean": float(np.mean(rmse_vals)) if rmse_vals else None,
-            "accuracy_mean": float(np.mean(acc_vals)) if acc_vals else None,
-        }
-    
-        last_dates_per_product = raw.groupby('product_code')['date'].max().apply(lambda x: x.strftime('%Y-%m-%d')).to_dict()
+        # Aggregated metrics (optional)
+        agg_metrics = aggregate_metrics(metrics)
 
     final_result = {
         "forecasted_products": forecasted_products,
         "metrics": metrics,
         "aggregated_metrics": agg_metrics,
         "meta": {
-            "method": "Prophet" if use_prophet else "ExponentialSmoothing",
+            "method": method,
             "generated_on": datetime.now().isoformat(),
             "last_dates_per_product": last_dates_per_product
         }
     }
-    
-    # ✅ WRAP THE FINAL DICTIONARY IN THE HELPER FUNCTION
-    return convert_nan_to_none(final_result)
+    if fitted:
+        final_result["fitted_products"] = fitted_products
+    if quantiles:
+        final_result["intervals"] = interval_products
+        final_result["meta"]["intervals"] = {"quantiles": list(quantiles), "samples": intervals.SAMPLES,
+                                             "error_model": intervals.ERROR_MODEL}
+    if 'method' in forecasts.columns:
+        # Router: which method each product was sent to
+        methods = forecasts.drop_duplicates('product_code').set_index('product_code')['method']
+        final_result["meta"]["methods"] = methods.to_dict()
+        final_result["meta"]["method_counts"] = methods.value_counts().to_dict()
+    if levels:
+        final_result["meta"]["hierarchy"] = {**hierarchy_params, "fits": h['fits'], "nodes": h['nodes']}
+    if deadline is not None:
+        final_result["meta"]["deadline"] = {
+            "seconds_left": round(deadline - time.monotonic(), 3),
+            "fallback": DEADLINE_FALLBACK,
+            "degraded": degraded,
+        }
+
+    # NaN forecasts are already None and the metrics never hold NaN, so no
+    # convert_nan_to_none walk over the whole result is needed
+    if cache is not None and not degraded:
+        cache.put(key, final_result)
+        final_result["meta"] = {**final_result["meta"], "cache": "miss"}
+        return final_result, "miss"
+    return final_result, "off"
+
+# -------------------------------
+# Streaming pipeline
+# -------------------------------
+def stream_forecast(train_file, start_month, end_month, test_file=None, n_jobs=None, chunk_size=None,
+                    regressors=['mrp','discount','rating'], model_store=None, method=None, pool=None,
+                    dataset=None, deadline=None, started=None):
+    """
+    run_forecast for a streaming response: yields JSON-ready records instead
+    of building the whole result. First {'type': 'start', ...} with the
+    method, months and product count, then {'type': 'forecast',
+    'product_code', 'forecast': {date: value}, 'metrics'} for each product as
+    iter_forecast_panel finishes it (metrics None without a test file), and
+    last {'type': 'summary', 'aggregated_metrics', 'meta'}. Only the
+    per-product metrics are kept until the end, not the forecasts. The
+    result cache is not used; closing the generator stops pending fits.
+    deadline and started are as in run_forecast; products not fitted in
+    time come last, with DEADLINE_FALLBACK forecasts.
+    """
+    stats = profiling.RunStats()
+    deadline = _deadline_at(deadline, started)
+    forecast_months = pd.date_range(pd.to_datetime(start_month), pd.to_datetime(end_month), freq='MS')
+    method = resolve_method(method)
+    processed, test_actuals, last_dates_per_product = _load_inputs(
+        stats, train_file, test_file, SALES_COLUMNS + list(regressors), dataset)
+    yield {
+        "type": "start",
+        "method": method,
+        "months": [d.strftime("%Y-%m-%d") for d in forecast_months],
+        "products": int(processed['product_code'].nunique()),
+    }
+
+    metrics, method_counts, degraded = {}, {}, []
+    with stats.stage('forecast'):
+        for batch in iter_forecast_panel(processed, forecast_months, regressors, n_jobs, chunk_size,
+                                         model_store=model_store, method=method, pool=pool, stats=stats,
+                                         deadline=deadline, degraded=degraded):
+            # per product, months in order: the same rows compute_metrics_grouped sees in run_forecast
+            batch = batch.sort_values(['product_code','date'], kind='stable')
+            codes = batch['product_code'].to_numpy(dtype=object)
+            values = batch['forecast'].to_numpy(dtype=float)
+            batch_metrics = {}
+            if test_actuals is not None and test_actuals.rows:
+                a = np.nan_to_num(test_actuals.lookup(codes, batch['date']))
+                batch_metrics = compute_metrics_grouped(codes, a, np.nan_to_num(values))
+                metrics.update(batch_metrics)
+            rounded = [None if v != v else v for v in np.round(values, 2).tolist()]
+            dates = batch['date'].dt.strftime("%Y-%m-%d").tolist()
+            routed = batch['method'].tolist() if 'method' in batch.columns else None
+            bounds = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1], True])
+            for s, e in zip(bounds[:-1], bounds[1:]):
+                record = {
+                    "type": "forecast",
+                    "product_code": codes[s],
+                    "forecast": dict(zip(dates[s:e], rounded[s:e])),
+                    "metrics": batch_metrics.get(codes[s]),
+                }
+                if routed is not None:
+                    record["method"] = routed[s]
+                    method_counts[routed[s]] = method_counts.get(routed[s], 0) + 1
+                yield record
+
+    meta = {
+        "method": method,
+        "generated_on": datetime.now().isoformat(),
+        "last_dates_per_product": last_dates_per_product,
+    }
+    if method_counts:
+        meta["method_counts"] = method_counts
+    if deadline is not None:
+        meta["deadline"] = {
+            "seconds_left": round(deadline - time.monotonic(), 3),
+            "fallback": DEADLINE_FALLBACK,
+            "degraded": degraded,
+        }
+    profiling.REGISTRY.observe(stats, method, "stream")
+    _report_errors(stats, method)
+    yield {"type": "summary", "aggregated_metrics": aggregate_metrics(metrics), "meta": meta}
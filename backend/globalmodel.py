@@ -0,0 +1,114 @@
+import numpy as np
+
+
+# -------------------------------
+# Global gradient-boosted model
+# -------------------------------
+# One scikit-learn HistGradientBoostingRegressor trained on every product's
+# history at once instead of one model per product. Each training row is a
+# (product, month) cell: the target is that month's sales and the features
+# are lags and trailing means of the product's sales before it, the calendar
+# month, the regressors in that month and the product's static codes
+# (category, brand, region). Sales are divided by each product's mean so one
+# model serves all volumes; log1p of the mean is a feature too.
+#
+# Forecasts are recursive: step h predicts every product in one batch from
+# the history plus steps 1..h-1, so a horizon of H costs H predict calls
+# whatever the number of products. sklearn is imported on first fit.
+
+LAGS = (1, 2, 3, 6, 12)
+WINDOWS = (3, 6, 12)
+# Cells sampled for training when the panel has more (seeded, uniform)
+MAX_TRAIN_ROWS = 1_000_000
+# Categorical features need codes below the model's max_bins
+MAX_CATEGORIES = 255
+PARAMS = {
+    'max_iter': 200,
+    'learning_rate': 0.1,
+    'max_leaf_nodes': 31,
+    'min_samples_leaf': 40,
+    'l2_regularization': 1.0,
+    'early_stopping': True,
+    'validation_fraction': 0.1,
+    'n_iter_no_change': 10,
+    'random_state': 0,
+}
+
+
+def _features(Y, csum, p, t, months, regressors, static, level):
+    """
+    Feature rows for cells (p[i], t[i]); only Y[:, :t] is read for a cell.
+    csum is Y's cumulative sum along months with a leading zero column.
+    """
+    cols = []
+    for lag in LAGS:
+        src = t - lag
+        cols.append(np.where(src >= 0, Y[p, np.maximum(src, 0)], np.nan))
+    for w in WINDOWS:
+        lo = np.maximum(t - w, 0)
+        cols.append(np.where(t > 0, (csum[p, t] - csum[p, lo]) / np.maximum(t - lo, 1), np.nan))
+    cols.append(months[t])
+    cols.extend(R[p, t] for R in regressors)
+    cols.extend(static[p, k] for k in range(static.shape[1]))
+    cols.append(level[p])
+    return np.column_stack(cols).astype(np.float32)
+
+
+def forecast(Y, steps, month0, regressors=(), static=None, params=None, seed=0):
+    """
+    Y: (products x months) sales with no gaps. steps as in
+    holtwinters.forecast (>= 1 forecasts, <= 0 the one-step-ahead prediction
+    for that month of the history). month0 is the calendar month (0-11) of
+    Y's first column. regressors: (products x months) arrays, carried at
+    their last value over the horizon. static: (products x k) integer codes,
+    NaN when missing. Returns (products, len(steps)), clipped at 0.
+    """
+    from sklearn.ensemble import HistGradientBoostingRegressor
+
+    Y = np.asarray(Y, dtype=float)
+    P, T = Y.shape
+    steps = np.asarray(steps, dtype=int)
+    H = max(int(steps.max()), 0) if len(steps) else 0
+    N = T + H
+
+    scale = np.abs(Y).mean(axis=1)
+    scale[~(scale > 0)] = 1.0
+    level = np.log1p(scale)
+    Yn = np.full((P, N), np.nan)
+    Yn[:, :T] = Y / scale[:, None]
+    months = ((month0 + np.arange(N)) % 12).astype(float)
+    regs = [np.concatenate([R, np.repeat(R[:, -1:], H, axis=1)], axis=1).astype(float)
+            for R in (np.asarray(R, dtype=float) for R in regressors)]
+    static = np.empty((P, 0)) if static is None else np.asarray(static, dtype=float).reshape(P, -1)
+    categorical = ([False] * (len(LAGS) + len(WINDOWS)) + [True] + [False] * len(regs)
+                   + [bool(np.nanmax(c, initial=0) < MAX_CATEGORIES) for c in static.T] + [False])
+
+    # training cells: every product and month with at least one month before it
+    cells = P * (T - 1)
+    if cells <= 0:
+        return np.repeat(Y[:, -1:], len(steps), axis=1)
+    idx = np.arange(cells)
+    if cells > MAX_TRAIN_ROWS:
+        idx = np.sort(np.random.default_rng(seed).choice(cells, MAX_TRAIN_ROWS, replace=False))
+    p, t = idx // (T - 1), idx % (T - 1) + 1
+    csum = np.concatenate([np.zeros((P, 1)), np.cumsum(Yn[:, :T], axis=1)], axis=1)
+    X = _features(Yn, csum, p, t, months, regs, static, level)
+    model = HistGradientBoostingRegressor(categorical_features=np.array(categorical),
+                                          **{**PARAMS, **(params or {})})
+    model.fit(X, Yn[p, t])
+
+    everyone = np.arange(P)
+    for t in range(T, N):
+        csum = np.concatenate([np.zeros((P, 1)), np.cumsum(Yn[:, :t], axis=1)], axis=1)
+        Yn[:, t] = model.predict(_features(Yn, csum, everyone, np.full(P, t), months, regs, static, level))
+
+    out = np.empty((P, len(steps)))
+    csum = np.concatenate([np.zeros((P, 1)), np.cumsum(Yn[:, :T], axis=1)], axis=1)
+    for j, h in enumerate(steps):
+        if h >= 1:
+            out[:, j] = Yn[:, T - 1 + h]
+        else:
+            # in-sample: predicted from the months before it, like the training rows
+            t = min(max(T - 1 + h, 0), T - 1)
+            out[:, j] = model.predict(_features(Yn, csum, everyone, np.full(P, t), months, regs, static, level))
+    return np.maximum(out * scale[:, None], 0)
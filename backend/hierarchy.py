@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+
+
+# -------------------------------
+# Hierarchical aggregation
+# -------------------------------
+# A hierarchy is a list of columns from the top down, e.g. ['region', 'category'];
+# its nodes are the grand total, every region, and every (region, category)
+# pair. Each product belongs to one bottom node (its attributes in the last
+# month it appears), and every node's sales are the sum of its products'.
+# Node ids join the path values with '/', e.g. 'North/Electronics'.
+
+LEVELS = ('category', 'sub_category', 'brand', 'region', 'product_code')
+RECONCILIATIONS = ('bottom_up', 'top_down', 'ols')
+ROOT = 'Total'
+MISSING = '(none)'
+# Bottom nodes above this make the dense least-squares solve too large
+OLS_MAX_BOTTOM = 5000
+
+
+def parse_levels(spec):
+    """'region,category' (or a list) -> ['region', 'category']; raises ValueError."""
+    levels = [l.strip() for l in spec.split(',')] if isinstance(spec, str) else list(spec)
+    levels = [l for l in levels if l]
+    unknown = [l for l in levels if l not in LEVELS]
+    if not levels or unknown:
+        raise ValueError(f"hierarchy must list columns from {', '.join(LEVELS)}, got {spec!r}")
+    if len(set(levels)) != len(levels):
+        raise ValueError(f"hierarchy repeats a column: {spec!r}")
+    if 'product_code' in levels and levels[-1] != 'product_code':
+        raise ValueError("product_code can only be the last hierarchy level")
+    return levels
+
+
+def check_reconciliation(name):
+    if name not in RECONCILIATIONS:
+        raise ValueError(f"reconciliation must be one of {', '.join(RECONCILIATIONS)}, got {name!r}")
+    return name
+
+
+def _labels(values):
+    values = pd.Series(values, dtype=object)
+    return values.where(values.notna(), MISSING).astype(str).to_numpy()
+
+
+def build(panel, levels):
+    """
+    Hierarchy over a preprocessed panel (date, product_code, sales, level
+    columns). Returns a dict with the node list (id, level, parent; top down,
+    bottom nodes last), each bottom node's ancestor at every depth
+    (ancestors, depths x bottom nodes), node sales history Y (nodes x months),
+    the months, and the product -> bottom node map.
+    """
+    missing = [l for l in levels if l not in panel.columns]
+    if missing:
+        raise ValueError(f"hierarchy columns not in the data: {', '.join(missing)}")
+    last = panel.drop_duplicates('product_code', keep='last')
+    paths = pd.DataFrame({l: _labels(last[l]) for l in levels}, index=_labels(last['product_code']))
+
+    nodes, index = [{'id': ROOT, 'level': ROOT, 'parent': None}], {(): 0}
+    for depth, level in enumerate(levels, 1):
+        for key in sorted(set(map(tuple, paths.iloc[:, :depth].to_numpy()))):
+            index[key] = len(nodes)
+            nodes.append({'id': '/'.join(key), 'level': level,
+                          'parent': nodes[index[key[:-1]]]['id']})
+    bottom_keys = [k for k in index if len(k) == len(levels)]
+    bottom_of = {k: i for i, k in enumerate(bottom_keys)}
+    ancestors = np.array([[index[k[:depth]] for k in bottom_keys] for depth in range(len(levels) + 1)])
+
+    product_bottom = pd.Series([bottom_of[tuple(p)] for p in paths.to_numpy()], index=paths.index)
+    wide = panel.pivot(index='date', columns='product_code', values='sales').sort_index()
+    Y_bottom = np.zeros((len(bottom_keys), len(wide.index)))
+    np.add.at(Y_bottom, product_bottom.reindex(_labels(wide.columns)).to_numpy(),
+              np.nan_to_num(wide.to_numpy(dtype=float).T))
+    h = {'levels': levels, 'nodes': nodes, 'ancestors': ancestors,
+         'months': wide.index, 'product_bottom': product_bottom}
+    h['Y'] = sum_up(h, Y_bottom)
+    return h
+
+
+def sum_up(h, bottom):
+    """S @ bottom without forming S: add each bottom row into all its ancestors."""
+    out = np.zeros((len(h['nodes']),) + bottom.shape[1:])
+    for row in h['ancestors']:
+        np.add.at(out, row, bottom)
+    return out
+
+
+def summing_matrix(h):
+    """Dense S (nodes x bottom nodes), S[i, j] = 1 when bottom node j is under node i."""
+    ancestors = h['ancestors']
+    S = np.zeros((len(h['nodes']), ancestors.shape[1]))
+    S[ancestors, np.arange(ancestors.shape[1])] = 1.0
+    return S
+
+
+def nodes_to_fit(h, reconciliation):
+    """Indices of the nodes that need a model under each reconciliation."""
+    n_nodes, n_bottom = len(h['nodes']), h['ancestors'].shape[1]
+    if reconciliation == 'bottom_up':
+        return np.arange(n_nodes - n_bottom, n_nodes)
+    if reconciliation == 'top_down':
+        return np.array([0])
+    if n_bottom > OLS_MAX_BOTTOM:
+        raise ValueError(f"ols reconciliation supports at most {OLS_MAX_BOTTOM} bottom nodes, "
+                         f"this hierarchy has {n_bottom}; use bottom_up or top_down")
+    return np.arange(n_nodes)
+
+
+def reconcile(h, yhat, reconciliation):
+    """
+    Coherent forecasts for every node from base forecasts yhat (nodes x
+    months, only the rows nodes_to_fit() returned are used):
+
+    - bottom_up sums the bottom forecasts,
+    - top_down splits the total by each bottom node's share of historical sales,
+    - ols projects all base forecasts onto the coherent subspace,
+      S (S'S)^-1 S' yhat.
+    """
+    n_nodes, n_bottom = len(h['nodes']), h['ancestors'].shape[1]
+    if reconciliation == 'bottom_up':
+        bottom = yhat[n_nodes - n_bottom:]
+    elif reconciliation == 'top_down':
+        history = h['Y'][n_nodes - n_bottom:].sum(axis=1)
+        total = history.sum()
+        shares = history / total if total else np.full(n_bottom, 1.0 / n_bottom)
+        bottom = np.outer(shares, yhat[0])
+    else:
+        bottom = np.linalg.lstsq(summing_matrix(h), np.nan_to_num(yhat), rcond=None)[0]
+    return sum_up(h, bottom)
+
+
+def aggregate(frame, h, value='sales'):
+    """
+    Sum a long (date, product_code, value) frame up to every node. Products
+    outside the hierarchy are dropped. Returns (date, product_code, value)
+    rows with product_code holding node ids.
+    """
+    bottom = pd.Series(_labels(frame['product_code'])).map(h['product_bottom'])
+    known = bottom.notna().to_numpy()
+    dates = pd.DatetimeIndex(frame['date'].to_numpy()[known])
+    months = dates.unique().sort_values()
+    n_nodes, n_bottom = len(h['nodes']), h['ancestors'].shape[1]
+    X = np.zeros((n_bottom, len(months)))
+    np.add.at(X, (bottom.to_numpy()[known].astype(int), months.get_indexer(dates)),
+              np.nan_to_num(frame[value].to_numpy(dtype=float)[known]))
+    values = sum_up(h, X)
+    return pd.DataFrame({
+        'date': np.repeat(months.values, n_nodes),
+        'product_code': np.tile(np.array([n['id'] for n in h['nodes']], dtype=object), len(months)),
+        value: values.T.ravel(),
+    })
@@ -0,0 +1,129 @@
+import numpy as np
+
+
+# -------------------------------
+# Batched additive Holt-Winters
+# -------------------------------
+# Same model as ExponentialSmoothing(seasonal='add', seasonal_periods=12):
+# additive seasonality, no trend. Every series in the batch is run through the
+# recursion together, so a (products x months) matrix costs one NumPy pass per
+# month instead of one statsmodels fit per product.
+
+SEASON = 12
+# Candidate offsets per refinement round; the grid shrinks around each
+# series' best (alpha, gamma) after every round.
+_GRID = np.linspace(-1.0, 1.0, 5)
+_ROUNDS = 5
+# Series fitted together per block
+_BLOCK = 10000
+
+
+def _init_states(Y, m):
+    """
+    Seasonal indices from the series detrended by a centred 2 x m moving
+    average (plain first-season deviations when there are under two seasons),
+    level from the deseasonalised first season.
+    """
+    n, T = Y.shape
+    if T < 2 * m:
+        level = Y[:, :m].mean(axis=1)
+        return level, Y[:, :m] - level[:, None]
+    csum = np.cumsum(np.pad(Y, ((0, 0), (1, 0))), axis=1)
+    ma = (csum[:, m:] - csum[:, :-m]) / m
+    centred = (ma[:, :-1] + ma[:, 1:]) / 2
+    detrended = np.full(Y.shape, np.nan)
+    detrended[:, m // 2:m // 2 + centred.shape[1]] = Y[:, m // 2:m // 2 + centred.shape[1]] - centred
+    season = np.stack([np.nanmean(detrended[:, k::m], axis=1) for k in range(m)], axis=1)
+    season -= season.mean(axis=1, keepdims=True)
+    level = (Y[:, :m] - season).mean(axis=1)
+    return level, season
+
+
+def _sse(Y, alpha, gamma, m):
+    """SSE of one-step-ahead errors for every (candidate, series); alpha/gamma are (K, P)."""
+    n, T = Y.shape
+    level0, season0 = _init_states(Y, m)
+    level = np.broadcast_to(level0, alpha.shape).copy()
+    season = np.broadcast_to(season0, alpha.shape + (m,)).copy()
+    sse = np.zeros(alpha.shape)
+    for t in range(m, T):
+        y = Y[:, t]
+        s = season[..., t % m]
+        err = y - (level + s)
+        sse += err * err
+        new_level = alpha * (y - s) + (1 - alpha) * level
+        season[..., t % m] = gamma * (y - level) + (1 - gamma) * s
+        level = new_level
+    return sse
+
+
+def _run(Y, alpha, gamma, m):
+    """Final states and in-sample one-step fitted values for fitted parameters."""
+    n, T = Y.shape
+    level, season = _init_states(Y, m)
+    season = season.copy()
+    fitted = np.empty_like(Y)
+    fitted[:, :m] = level[:, None] + season
+    for t in range(m, T):
+        y = Y[:, t]
+        s = season[:, t % m]
+        fitted[:, t] = level + s
+        new_level = alpha * (y - s) + (1 - alpha) * level
+        season[:, t % m] = gamma * (y - level) + (1 - gamma) * s
+        level = new_level
+    return level, season, fitted
+
+
+def fit(Y, m=SEASON, rounds=_ROUNDS):
+    """
+    Fit smoothing parameters for every row of Y (products x months) at once.
+
+    A coarse grid over alpha, gamma in [0, 1] (gamma <= 1 - alpha, as in
+    statsmodels) is evaluated for all series together and then refined around
+    each series' own best point, rounds times. Returns a dict with alpha,
+    gamma, final level/season states and one-step fitted values.
+    """
+    Y = np.asarray(Y, dtype=float)
+    if Y.shape[0] > _BLOCK:
+        # bound the (candidates x series x season) working set
+        parts = [fit(Y[i:i + _BLOCK], m, rounds) for i in range(0, Y.shape[0], _BLOCK)]
+        return {
+            **{k: np.concatenate([p[k] for p in parts]) for k in ("alpha", "gamma", "level", "season", "fitted")},
+            "n_obs": Y.shape[1], "m": m,
+        }
+    n = Y.shape[0]
+    alpha = np.full(n, 0.5)
+    gamma = np.full(n, 0.25)
+    step = 0.5
+    for _ in range(rounds):
+        a = np.clip(alpha[None, :] + step * _GRID[:, None], 0.0, 1.0)
+        g = np.clip(gamma[None, :] + step * _GRID[:, None], 0.0, 1.0)
+        # all (a, g) pairs for this round: (K*K, n)
+        a = np.repeat(a, len(_GRID), axis=0)
+        g = np.tile(g, (len(_GRID), 1))
+        g = np.minimum(g, 1.0 - a)
+        sse = _sse(Y, a, g, m)
+        best = np.nanargmin(np.where(np.isfinite(sse), sse, np.inf), axis=0)
+        cols = np.arange(n)
+        alpha, gamma = a[best, cols], g[best, cols]
+        step /= 2
+    level, season, fitted = _run(Y, alpha, gamma, m)
+    return {"alpha": alpha, "gamma": gamma, "level": level, "season": season,
+            "fitted": fitted, "n_obs": Y.shape[1], "m": m}
+
+
+def forecast(model, steps):
+    """
+    Values at offsets `steps` from the last observation for every series:
+    steps >= 1 are forecasts, steps <= 0 index into the fitted values.
+    Returns an array of shape (products, len(steps)).
+    """
+    steps = np.asarray(steps, dtype=int)
+    T, m = model["n_obs"], model["m"]
+    out = np.empty((model["level"].shape[0], len(steps)))
+    for j, h in enumerate(steps):
+        if h >= 1:
+            out[:, j] = model["level"] + model["season"][:, (T + h - 1) % m]
+        else:
+            out[:, j] = model["fitted"][:, min(max(T - 1 + h, 0), T - 1)]
+    return out
@@ -0,0 +1,130 @@
+import numpy as np
+
+import holtwinters
+
+
+# -------------------------------
+# Simulated prediction intervals
+# -------------------------------
+# Quantiles of the forecast error for every product and horizon from one
+# residual bootstrap over the whole panel. The spread always comes from
+# Holt-Winters residuals, whatever model made the point forecasts: each
+# product's one-step-ahead in-sample errors come from batched Holt-Winters
+# (the previous month for series under a season), centred on zero. SAMPLES
+# error paths per product are drawn from them with replacement, with an
+# index of its own, and carried through the level recursion of that fit,
+#
+#     e_h = eps_h + alpha * (eps_1 + ... + eps_h-1)
+#
+# so the spread widens with the horizon as much as the series' own alpha
+# says it should. The errors are centred on their mean, so p50 sits off the
+# point forecast by as much as the residuals are skewed, and by the same
+# amount under every method. All draws for a block of products are one
+# NumPy array.
+
+QUANTILES = (0.5, 0.9)
+# What the spread comes from, whichever method made the point forecasts
+ERROR_MODEL = "holt_winters_residuals"
+SAMPLES = 500
+SEASON = holtwinters.SEASON
+# Months of history the errors come from (the most recent), and grid rounds
+# for the Holt-Winters fit behind them: the spread needs alpha roughly, not
+# the point forecast's precision
+HISTORY_MONTHS = 36
+FIT_ROUNDS = 3
+# Draws (products x samples x horizon) held at once
+_MAX_DRAWS = 4_000_000
+
+
+def residuals(Y, m=SEASON):
+    """
+    One-step-ahead in-sample errors over the last HISTORY_MONTHS (products x
+    months, NaN where there is no prediction) and the level smoothing weight
+    alpha per product.
+    """
+    Y = np.asarray(Y, dtype=float)[:, -HISTORY_MONTHS:]
+    T = Y.shape[1]
+    if T >= m:
+        model = holtwinters.fit(Y, m, FIT_ROUNDS)
+        # in-sample errors understate out-of-sample ones by about the
+        # states fitted (level, m seasons, alpha, gamma); the first season
+        # is the initial state, not a prediction
+        R = (Y - model['fitted']) * np.sqrt(T / max(T - m - 2, m))
+        R[:, :m] = np.nan
+        return R, model['alpha']
+    R = np.full(Y.shape, np.nan)
+    R[:, 1:] = np.diff(Y, axis=1)
+    return R, np.ones(Y.shape[0])
+
+
+def error_quantiles(R, alpha, horizon, quantiles=QUANTILES, samples=SAMPLES, seed=0):
+    """
+    Quantiles of the simulated h-step error for h = 1..horizon: an array of
+    shape (products, horizon, len(quantiles)). Each product resamples its
+    own residuals with its own draws (from one generator seeded by seed).
+    Products with no residuals get zeros.
+    """
+    R = np.asarray(R, dtype=float)
+    P = R.shape[0]
+    out = np.zeros((P, horizon, len(quantiles)))
+    if P == 0 or horizon < 1:
+        return out
+    n = (~np.isnan(R)).sum(axis=1)
+    # centred, NaNs last: each row's residuals are its first n[p] entries
+    # (a row with none is all zeros)
+    R = R - np.nanmean(np.where(n[:, None] > 0, R, 0.0), axis=1, keepdims=True)
+    R = np.nan_to_num(np.sort(R, axis=1)).astype(np.float32)
+    alpha = np.asarray(alpha, dtype=np.float32)
+    pos = np.asarray(quantiles, dtype=float) * (samples - 1)
+    below = np.floor(pos).astype(int)
+    above = np.minimum(below + 1, samples - 1)
+    frac = pos - below
+    # every product draws its own resampling index, so bands of products
+    # with the same number of residuals are not rank-for-rank alike
+    rng = np.random.default_rng(seed)
+    block = max(1, _MAX_DRAWS // (samples * horizon))
+    for lo in range(0, P, block):
+        sel = slice(lo, lo + block)
+        count = n[sel, None]
+        idx = (rng.random((len(count), horizon * samples), dtype=np.float32) * count.astype(np.float32)).astype(np.intp)
+        np.minimum(idx, np.maximum(count - 1, 0), out=idx)
+        eps = np.take_along_axis(R[sel], idx, axis=1).reshape(len(count), horizon, samples)
+        paths = np.empty_like(eps)
+        carried = np.zeros_like(eps[:, 0])
+        for h in range(horizon):
+            paths[:, h] = eps[:, h] + alpha[sel, None] * carried
+            carried += eps[:, h]
+        # a full sort is quicker than np.quantile's partition for these short
+        # rows; then np.quantile's linear interpolation between order statistics
+        paths.sort(axis=2)
+        out[sel] = paths[..., below] * (1 - frac) + paths[..., above] * frac
+    return out
+
+
+def simulate(Y, point, steps, quantiles=QUANTILES, samples=SAMPLES, seed=0):
+    """
+    Prediction quantiles around point, a (products x len(steps)) forecast of
+    the rows of Y (products x months, no gaps) at offsets steps as in
+    holtwinters.forecast; steps <= 0 get the one-step spread. Returns an
+    array of shape (products, len(steps), len(quantiles)), clipped at 0.
+    """
+    steps = np.maximum(np.asarray(steps, dtype=int), 1)
+    R, alpha = residuals(Y)
+    err = error_quantiles(R, alpha, int(steps.max()) if len(steps) else 0, quantiles, samples, seed)
+    return np.maximum(np.asarray(point, dtype=float)[:, :, None] + err[:, steps - 1], 0)
+
+
+def names(quantiles):
+    """Result keys for quantiles: 0.5 -> 'p50', 0.975 -> 'p97.5'."""
+    return [f"p{q * 100:g}" for q in quantiles]
+
+
+def parse_quantiles(text):
+    """'0.5,0.9' -> (0.5, 0.9); ValueError unless every value is strictly between 0 and 1."""
+    try:
+        quantiles = tuple(sorted({float(q) for q in str(text).split(",") if q.strip()}))
+    except ValueError:
+        raise ValueError(f"quantiles must be comma-separated numbers, got {text!r}")
+    if not quantiles or not all(0 < q < 1 for q in quantiles):
+        raise ValueError("quantiles must be between 0 and 1, e.g. 0.5,0.9")
+    return quantiles
@@ -0,0 +1,168 @@
+import threading, time, uuid, traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class JobCancelled(Exception):
+    pass
+
+
+# -------------------------------
+# Background job manager
+# -------------------------------
+class JobManager:
+    """
+    Runs forecast jobs on a bounded thread pool so the event loop stays free.
+
+    At most max_workers jobs run at once and at most max_queue wait behind
+    them; submit() raises QueueFullError beyond that. Finished jobs are kept
+    for polling until max_finished newer ones have completed; finished()
+    records one whose result is already known (a cache hit) the same way.
+
+    cancel() stops a job: a queued one never starts, a running one raises
+    JobCancelled from its next progress callback (after the product or chunk
+    in hand). With abandon_sec, a job nobody has polled with get() for that
+    long is cancelled the same way, so a client that went away does not keep
+    a worker busy.
+    """
+
+    def __init__(self, max_workers=2, max_queue=8, max_finished=100, abandon_sec=0):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.max_finished = max_finished
+        self.abandon_sec = abandon_sec
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="forecast-job")
+        self._jobs = {}
+        self._polled = {}
+        self._cancelled = set()
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, on_done=None, params=None, **kwargs):
+        with self._lock:
+            active = sum(1 for j in self._jobs.values() if j["status"] in ("queued", "running"))
+            if active >= self.max_workers + self.max_queue:
+                raise QueueFullError(f"{active} forecast jobs pending, try again later")
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "status": "queued",
+                "progress": {"done": 0, "total": None},
+                "params": params or {},
+                "created_on": datetime.now().isoformat(),
+                "started_on": None,
+                "finished_on": None,
+                "result": None,
+                "error": None,
+            }
+            self._polled[job_id] = time.monotonic()
+        self._pool.submit(self._run, job_id, fn, args, kwargs, on_done)
+        return job_id
+
+    def finished(self, result, params=None):
+        """Record a job whose result is already known (e.g. a cache hit) without using the pool."""
+        now = datetime.now().isoformat()
+        with self._lock:
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "status": "done",
+                "progress": {"done": 0, "total": 0},
+                "params": params or {},
+                "created_on": now,
+                "started_on": now,
+                "finished_on": now,
+                "result": result,
+                "error": None,
+                "elapsed_sec": 0.0,
+            }
+            self._polled[job_id] = time.monotonic()
+            self._evict_finished()
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            self._polled[job_id] = time.monotonic()
+            return {**job, "progress": dict(job["progress"])}
+
+    def cancel(self, job_id):
+        """Ask a queued or running job to stop; False when it is unknown or already over."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] not in ("queued", "running"):
+                return False
+            self._cancelled.add(job_id)
+            if job["status"] == "queued":
+                job["status"] = "cancelled"
+            return True
+
+    def queue_depth(self):
+        with self._lock:
+            return sum(1 for j in self._jobs.values() if j["status"] == "queued")
+
+    def shutdown(self, wait=False):
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+    def _run(self, job_id, fn, args, kwargs, on_done):
+        job = self._jobs[job_id]
+        started = time.perf_counter()
+        with self._lock:
+            if job_id in self._cancelled:
+                # cancelled while queued
+                job["finished_on"] = datetime.now().isoformat()
+                self._cancelled.discard(job_id)
+                self._evict_finished()
+                if on_done is not None:
+                    on_done()
+                return
+            job["status"] = "running"
+            job["started_on"] = datetime.now().isoformat()
+
+        def progress(done, total):
+            with self._lock:
+                job["progress"] = {"done": done, "total": total}
+                if job_id in self._cancelled:
+                    raise JobCancelled(f"job {job_id} was cancelled")
+                idle = time.monotonic() - self._polled.get(job_id, 0)
+                if self.abandon_sec and idle > self.abandon_sec:
+                    raise JobCancelled(f"job {job_id} was not polled for {idle:.0f}s")
+
+        try:
+            result = fn(*args, progress=progress, **kwargs)
+            with self._lock:
+                job["result"] = result
+                job["status"] = "done"
+        except JobCancelled as e:
+            print(f"[job {job_id}] {e}")
+            with self._lock:
+                job["error"] = str(e)
+                job["status"] = "cancelled"
+        except Exception as e:
+            print(f"[job {job_id}] failed:\n{traceback.format_exc()}")
+            with self._lock:
+                job["error"] = str(e)
+                job["status"] = "failed"
+        finally:
+            with self._lock:
+                job["finished_on"] = datetime.now().isoformat()
+                job["elapsed_sec"] = round(time.perf_counter() - started, 3)
+                self._cancelled.discard(job_id)
+                self._evict_finished()
+            if on_done is not None:
+                on_done()
+
+    def _evict_finished(self):
+        finished = [j for j in self._jobs.values()
+                    if j["status"] in ("done", "failed", "cancelled") and j["finished_on"]]
+        if len(finished) <= self.max_finished:
+            return
+        finished.sort(key=lambda j: j["finished_on"])
+        for j in finished[:len(finished) - self.max_finished]:
+            del self._jobs[j["job_id"]]
+            self._polled.pop(j["job_id"], None)
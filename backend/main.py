@@ -427,14 +427,53 @@
 
 # 
 
-from fastapi import FastAPI, UploadFile, File, Form
-from forecasting import run_forecast
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi.responses import Response, JSONResponse, PlainTextResponse, FileResponse, StreamingResponse
+from forecasting import run_forecast, cached_forecast, stream_forecast, resolve_method, forecasts_to_bytes, OUTPUT_FORMATS
+from backtest import run_backtest
+from jobs import JobManager, QueueFullError
+from cache import ResultCache
+from model_store import ModelStore
+import hierarchy as hierarchy_levels
+from workers import WorkerPool
+from datasets import DatasetStore
+from uploads import UploadStore, QuotaExceededError
+from actuals import ActualsRegistry
+import profiling
+import intervals
+from starlette.concurrency import run_in_threadpool
 import pandas as pd
-import os
+import os, json, tempfile, threading, time
 from fastapi.middleware.cors import CORSMiddleware
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-app = FastAPI()
+
+class FastJSONResponse(JSONResponse):
+    """orjson encoding: NaN/inf become null and numpy values serialise natively."""
+
+    def render(self, content):
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+
+def encode_record(record, fmt):
+    # one streamed record: a JSON line, or a server-sent event named after its type
+    body = orjson.dumps(record) if orjson is not None else json.dumps(record).encode()
+    if fmt == "sse":
+        return b"event: " + record["type"].encode() + b"\ndata: " + body + b"\n\n"
+    return body + b"\n"
+
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+
+# Large forecast payloads are returned as response objects directly, which
+# skips FastAPI's jsonable_encoder walk; orjson is used when installed
+ResultResponse = FastJSONResponse if orjson is not None else JSONResponse
+
+app = FastAPI(default_response_class=ResultResponse)
 
 
 origins = ["http://localhost:5173"]
@@ -446,27 +485,124 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.post("/forecast")
+# Uploads up to UPLOAD_MEMORY_MB are parsed straight from memory; larger
+# ones are copied (in UPLOAD_CHUNK_BYTES pieces) to unique temp files under
+# UPLOAD_DIR/<pid> that are removed when their job ends, UPLOAD_DISK_MB in
+# total across the servers sharing UPLOAD_DIR
+upload_store = UploadStore(
+    os.environ.get("UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "forecast_uploads")),
+    memory_bytes=int(os.environ.get("UPLOAD_MEMORY_MB", 8)) * 1024 * 1024,
+    max_disk_bytes=int(os.environ.get("UPLOAD_DISK_MB", 4096)) * 1024 * 1024,
+    chunk_bytes=int(os.environ.get("UPLOAD_CHUNK_BYTES", 1024 * 1024)),
+)
+
+# Forecasts run in the background; bound both running and waiting jobs.
+# A job not polled for FORECAST_JOB_ABANDON_SEC is cancelled (0 = never)
+jobs = JobManager(
+    max_workers=int(os.environ.get("FORECAST_JOB_WORKERS", 2)),
+    max_queue=int(os.environ.get("FORECAST_JOB_QUEUE", 8)),
+    abandon_sec=float(os.environ.get("FORECAST_JOB_ABANDON_SEC", 0)),
+)
+
+# Time budget of a forecast in seconds, from when the request came in; a
+# request's deadline can only shorten it. Products not fitted in time get
+# the cheap fallback forecast (0 = no budget)
+DEADLINE_SEC = float(os.environ.get("FORECAST_DEADLINE_SEC", 0))
+
+# Repeat uploads with the same window are served from cache; set
+# FORECAST_CACHE_DIR to also keep results on disk across restarts
+result_cache = ResultCache(
+    max_items=int(os.environ.get("FORECAST_CACHE_ITEMS", 32)),
+    disk_dir=os.environ.get("FORECAST_CACHE_DIR"),
+    max_disk_bytes=int(os.environ.get("FORECAST_CACHE_DISK_MB", 512)) * 1024 * 1024,
+)
+
+# Streaming forecasts run on the request's own thread rather than the job
+# queue, so they get their own limit
+stream_slots = threading.BoundedSemaphore(int(os.environ.get("FORECAST_STREAMS", 2)))
+
+# Named test sets for scoring, indexed in memory once per file version;
+# "default" is test.csv in the working directory when it exists
+actuals_registry = ActualsRegistry(os.environ.get("ACTUALS_DIR", "actuals"))
+if os.path.exists("test.csv") and "default" not in actuals_registry.names():
+    actuals_registry.register_path("default", "test.csv")
+
+# Fitted per-product models; only products whose history changed are refit
+model_store = None
+if os.environ.get("MODEL_STORE_DIR"):
+    model_store = ModelStore(
+        os.environ["MODEL_STORE_DIR"],
+        max_bytes=int(os.environ.get("MODEL_STORE_MB", 2048)) * 1024 * 1024,
+    )
+
+# Long-lived model workers, warmed once at startup (0 = fit inside each job,
+# with a fresh process pool per request when n_jobs > 1)
+POOL_WORKERS = int(os.environ.get("FORECAST_POOL_WORKERS", 2))
+worker_pool = None
+if POOL_WORKERS > 0:
+    worker_pool = WorkerPool(
+        max_workers=POOL_WORKERS,
+        method=resolve_method(os.environ.get("FORECAST_POOL_METHOD")),
+    )
+
+@app.on_event("startup")
+def start_workers():
+    if worker_pool is not None:
+        worker_pool.start()
+
+@app.on_event("shutdown")
+def shutdown_jobs():
+    jobs.shutdown()
+    if worker_pool is not None:
+        worker_pool.shutdown()
+
+@app.get("/health")
+def health():
+    return {"status": "ok", "queued_jobs": jobs.queue_depth()}
+
+@app.get("/ready")
+def ready():
+    # 503 until the model workers are warm, so a load balancer holds traffic back
+    if worker_pool is not None and not worker_pool.ready():
+        return JSONResponse({"status": "warming"}, status_code=503)
+    return {"status": "ready", "warmup_sec": worker_pool.warmup_sec if worker_pool else None}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    # Prometheus scrape: stage times, fit outcomes and durations over all runs
+    return PlainTextResponse(profiling.REGISTRY.render({
+        "forecast_jobs_queued": jobs.queue_depth(),
+        "forecast_pool_ready": int(worker_pool.ready()) if worker_pool else 1,
+    }), media_type="text/plain; version=0.0.4")
+
+async def receive_upload(upload):
+    # an uploads.Upload owned by this request; close() it (or hand it to a job) when done
+    try:
+        received = await upload_store.receive(upload)
+    except QuotaExceededError as e:
+        raise HTTPException(status_code=507, detail=str(e))
+    print(f"File size: {received.size} bytes ({'in memory' if received.in_memory else 'spooled'})")
+    return received
+
+@app.post("/forecast", status_code=202)
 async def forecast_endpoint(
     train_file: UploadFile = File(...),
     start_month: str = Form(...),
-    end_month: str = Form(...)
+    end_month: str = Form(...),
+    n_jobs: int = Form(None),
+    chunk_size: int = Form(None),
+    method: str = Form(None),
+    output_format: str = Form("json"),
+    hierarchy: str = Form(None),
+    reconciliation: str = Form("bottom_up"),
+    timings: bool = Form(False),
+    profile: bool = Form(False),
+    fitted: bool = Form(False),
+    actuals: str = Form(None),
+    deadline: float = Form(None),
+    quantiles: str = Form(None)
 ):
-    # # Save uploaded train CSV to a temporary file
-    # train_path = f"tmp_train_{train_file.filename}"
-    # with open(train_path, "wb") as f:
-    #     f.write(await train_file.read())
-    
-    # # Use the existing test.csv in the same folder
-    # test_path = "test.csv" if os.path.exists("test.csv") else None
-    
-    # # Run forecast
-    # result = run_forecast(train_path, start_month, end_month, test_path)
-    
-    # # Clean up temporary train file
-    # # os.remove(train_path)
-    
-    # return result
+    requested_at = time.monotonic()
      # Print form inputs
     print(f"Start Month: {start_month}")
     print(f"End Month: {end_month}")
@@ -475,22 +611,331 @@ async def forecast_endpoint(
     print(f"Filename: {train_file.filename}")
     print(f"Content type: {train_file.content_type}")
     
-    # Read file content
-    file_bytes = await train_file.read()
-    print(f"File size: {len(file_bytes)} bytes")
-    
-    # Save uploaded train CSV to a temporary file
-    train_path = f"tmp_train_{train_file.filename}"
-    with open(train_path, "wb") as f:
-        f.write(file_bytes)
+    method, levels = forecast_options(method, output_format, hierarchy, reconciliation, fitted)
+    quantiles = quantiles_option(quantiles, levels)
+    test_path = actuals_path(actuals)
+    upload = await receive_upload(train_file)
     
-    # Use the existing test.csv in the same folder
-    test_path = "test.csv" if os.path.exists("test.csv") else None
+    # Queue the forecast; the upload is released once the job finishes
+    return await queue_forecast(upload, start_month, end_month, n_jobs, chunk_size, method,
+                                output_format, levels, reconciliation, test_path=test_path,
+                                timings=timings, profile=profile, fitted=fitted,
+                                deadline=deadline_option(deadline), requested_at=requested_at,
+                                quantiles=quantiles)
+
+def forecast_options(method, output_format, hierarchy, reconciliation, fitted=False):
+    """Validate the forecast form fields (400 on error); returns (method, levels)."""
+    try:
+        method = resolve_method(method)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if output_format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"output_format must be one of {', '.join(OUTPUT_FORMATS)}")
+    # hierarchy="region,category" forecasts per node of that hierarchy instead of per product
+    levels = None
+    if hierarchy:
+        try:
+            levels = hierarchy_levels.parse_levels(hierarchy)
+            hierarchy_levels.check_reconciliation(reconciliation)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    # fitted=true adds in-sample predictions; ExponentialSmoothing only keeps its forecast
+    if fitted and (levels or (resolve_method(None) if method == "Router" else method) == "ExponentialSmoothing"):
+        raise HTTPException(status_code=400, detail="fitted values need Prophet or a vectorized method "
+                                                    "and no hierarchy")
+    return method, levels
+
+def quantiles_option(quantiles, levels=None):
+    # quantiles="0.5,0.9" adds P50/P90 prediction intervals for every product
+    if not quantiles:
+        return None
+    if levels:
+        raise HTTPException(status_code=400, detail="prediction intervals are not available with a hierarchy")
+    try:
+        return intervals.parse_quantiles(quantiles)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def deadline_option(deadline):
+    # the request's time budget in seconds, at most the server default when
+    # there is one; None for no budget
+    if deadline is None:
+        return DEADLINE_SEC or None
+    if not deadline > 0:
+        raise HTTPException(status_code=400, detail="deadline must be positive (seconds)")
+    return min(deadline, DEADLINE_SEC) if DEADLINE_SEC else deadline
+
+def actuals_path(name):
+    # the test set to score against: a named one, else "default" when there is one
+    try:
+        return actuals_registry.path(name or "default")
+    except KeyError:
+        if name:
+            raise HTTPException(status_code=400, detail=f"Unknown actuals {name!r}")
+        return None
+
+async def queue_forecast(upload, start_month, end_month, n_jobs, chunk_size, method, output_format,
+                         levels, reconciliation, dataset=None, test_path=None, timings=False, profile=False,
+                         fitted=False, deadline=None, requested_at=None, quantiles=None):
+    cleanup = upload.close if upload else None
+    source = upload.source if upload else None
+    params = {"output_format": output_format, "hierarchy": levels,
+              "reconciliation": reconciliation if levels else None,
+              "dataset_id": dataset.dataset_id if dataset else None,
+              "deadline": deadline, "quantiles": quantiles}
+    # a cached answer is returned as a finished job, not queued behind running ones
+    # (profile runs skip the cache so there is work to see)
+    if not profile:
+        try:
+            hit = await run_in_threadpool(cached_forecast, result_cache, source, start_month, end_month,
+                                          test_path, method=method, levels=levels,
+                                          reconciliation=reconciliation, dataset=dataset,
+                                          timings=timings, fitted=fitted, quantiles=quantiles)
+        except Exception:
+            # e.g. a bad month: the job reports it as it always has
+            hit = None
+        if hit is not None:
+            if cleanup:
+                cleanup()
+            return {"job_id": jobs.finished(hit, params=params), "status": "done"}
+        source = upload.source if upload else None
+    try:
+        job_id = jobs.submit(run_forecast, source, start_month, end_month, test_path,
+                             n_jobs=n_jobs, chunk_size=chunk_size, method=method, cache=result_cache,
+                             model_store=model_store, pool=worker_pool,
+                             levels=levels, reconciliation=reconciliation, dataset=dataset,
+                             timings=timings, profile=profile, fitted=fitted,
+                             deadline=deadline, started=requested_at, quantiles=quantiles, on_done=cleanup,
+                             params=params)
+    except QueueFullError as e:
+        if cleanup:
+            cleanup()
+        raise HTTPException(status_code=429, detail=str(e))
     
-    # Run forecast
-    result = run_forecast(train_path, start_month, end_month, test_path)
-    
-    # Clean up temporary train file if needed
-    # os.remove(train_path)
-    
-    return result
\ No newline at end of file
+    return {"job_id": job_id, "status": "queued"}
+
+@app.post("/forecast/stream")
+async def forecast_stream(
+    train_file: UploadFile = File(...),
+    start_month: str = Form(...),
+    end_month: str = Form(...),
+    n_jobs: int = Form(None),
+    chunk_size: int = Form(None),
+    method: str = Form(None),
+    format: str = Form("ndjson"),
+    actuals: str = Form(None),
+    deadline: float = Form(None)
+):
+    requested_at = time.monotonic()
+    # Results as products finish, as NDJSON lines or server-sent events: a
+    # start record, one forecast record per product, then a summary record
+    # with the aggregated metrics and meta (see forecasting.stream_forecast)
+    if format not in STREAM_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(STREAM_MEDIA_TYPES)}")
+    method, _ = forecast_options(method, "json", None, None)
+    deadline = deadline_option(deadline)
+    test_path = actuals_path(actuals)
+    if not stream_slots.acquire(blocking=False):
+        raise HTTPException(status_code=429, detail="Too many streaming forecasts, try again later")
+    try:
+        upload = await receive_upload(train_file)
+    except BaseException:
+        stream_slots.release()
+        raise
+    records = stream_forecast(upload.source, start_month, end_month, test_path, n_jobs=n_jobs,
+                              chunk_size=chunk_size, method=method, model_store=model_store, pool=worker_pool,
+                              deadline=deadline, started=requested_at)
+
+    def body():
+        try:
+            for record in records:
+                yield encode_record(record, format)
+        except Exception as e:
+            # the 200 has gone out already, so a failure is reported in-band
+            yield encode_record({"type": "error", "detail": str(e)}, format)
+        finally:
+            records.close()
+            upload.close()
+            stream_slots.release()
+
+    return StreamingResponse(body(), media_type=STREAM_MEDIA_TYPES[format],
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/backtest", status_code=202)
+async def backtest_endpoint(
+    train_file: UploadFile = File(...),
+    horizon: int = Form(6),
+    step: int = Form(3),
+    folds: int = Form(3),
+    methods: str = Form(None),
+    n_jobs: int = Form(None),
+    chunk_size: int = Form(None)
+):
+    # methods="Prophet,BatchedHoltWinters" backtests each and reports the best
+    try:
+        methods = [resolve_method(m) for m in methods.split(",") if m.strip()] if methods else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if horizon < 1 or step < 1 or folds < 1:
+        raise HTTPException(status_code=400, detail="horizon, step and folds must be positive")
+
+    upload = await receive_upload(train_file)
+    try:
+        job_id = jobs.submit(run_backtest, upload.source, horizon, step, folds, methods,
+                             n_jobs=n_jobs, chunk_size=chunk_size, pool=worker_pool,
+                             on_done=upload.close,
+                             params={"kind": "backtest", "horizon": horizon, "step": step,
+                                     "folds": folds, "methods": methods})
+    except QueueFullError as e:
+        upload.close()
+        raise HTTPException(status_code=429, detail=str(e))
+
+    return {"job_id": job_id, "status": "queued"}
+
+# Registered datasets: upload the history once, then POST only new months
+dataset_store = DatasetStore(os.environ.get("DATASET_DIR", "datasets"))
+
+def get_dataset(dataset_id):
+    try:
+        return dataset_store.get(dataset_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown dataset {dataset_id}")
+
+@app.post("/datasets", status_code=201)
+async def register_dataset(train_file: UploadFile = File(...), name: str = Form(None)):
+    with await receive_upload(train_file) as upload:
+        try:
+            return await run_in_threadpool(dataset_store.register, upload.source, name or train_file.filename)
+        except (ValueError, KeyError) as e:
+            raise HTTPException(status_code=400, detail=f"Cannot read {train_file.filename}: {e}")
+
+@app.get("/datasets")
+def list_datasets():
+    return dataset_store.list()
+
+@app.get("/datasets/{dataset_id}")
+def dataset_meta(dataset_id: str):
+    return get_dataset(dataset_id).meta()
+
+@app.post("/datasets/{dataset_id}/append")
+async def append_dataset(dataset_id: str, train_file: UploadFile = File(...)):
+    get_dataset(dataset_id)
+    with await receive_upload(train_file) as upload:
+        try:
+            return await run_in_threadpool(dataset_store.append, dataset_id, upload.source)
+        except (ValueError, KeyError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/datasets/{dataset_id}/rebuild")
+async def rebuild_dataset(dataset_id: str):
+    # full preprocess of the stored raw rows, e.g. after preprocess_panel itself changed
+    get_dataset(dataset_id)
+    return await run_in_threadpool(dataset_store.rebuild, dataset_id)
+
+@app.delete("/datasets/{dataset_id}")
+def delete_dataset(dataset_id: str):
+    get_dataset(dataset_id)
+    dataset_store.delete(dataset_id)
+    return {"dataset_id": dataset_id, "deleted": True}
+
+@app.post("/datasets/{dataset_id}/forecast", status_code=202)
+async def forecast_dataset(
+    dataset_id: str,
+    start_month: str = Form(...),
+    end_month: str = Form(...),
+    n_jobs: int = Form(None),
+    chunk_size: int = Form(None),
+    method: str = Form(None),
+    output_format: str = Form("json"),
+    hierarchy: str = Form(None),
+    reconciliation: str = Form("bottom_up"),
+    timings: bool = Form(False),
+    profile: bool = Form(False),
+    fitted: bool = Form(False),
+    actuals: str = Form(None),
+    deadline: float = Form(None),
+    quantiles: str = Form(None)
+):
+    requested_at = time.monotonic()
+    dataset = get_dataset(dataset_id)
+    method, levels = forecast_options(method, output_format, hierarchy, reconciliation, fitted)
+    quantiles = quantiles_option(quantiles, levels)
+    return await queue_forecast(None, start_month, end_month, n_jobs, chunk_size, method,
+                                output_format, levels, reconciliation, dataset=dataset,
+                                test_path=actuals_path(actuals), timings=timings, profile=profile,
+                                fitted=fitted, deadline=deadline_option(deadline), requested_at=requested_at,
+                                quantiles=quantiles)
+
+# Named actuals: upload a test set once, then score forecasts with actuals=<name>
+@app.post("/actuals", status_code=201)
+async def save_actuals(name: str = Form(...), test_file: UploadFile = File(...)):
+    with await receive_upload(test_file) as upload:
+        try:
+            return await run_in_threadpool(actuals_registry.save, name, upload.source, upload.filename)
+        except (ValueError, KeyError) as e:
+            raise HTTPException(status_code=400, detail=f"Cannot read {test_file.filename}: {e}")
+
+@app.get("/actuals")
+def list_actuals():
+    return [actuals_registry.describe(name) for name in actuals_registry.names()]
+
+@app.delete("/actuals/{name}")
+def delete_actuals(name: str):
+    try:
+        actuals_registry.delete(name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown actuals {name!r}")
+    return {"name": name, "deleted": True}
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return ResultResponse(job)
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    # a queued job is dropped; a running one stops after the product or chunk in hand
+    if jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    if not jobs.cancel(job_id):
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is {jobs.get(job_id)['status']}")
+    return {"job_id": job_id, "status": "cancelling"}
+
+@app.get("/jobs/{job_id}/profile")
+def job_profile(job_id: str):
+    # the cProfile dump of a job run with profile=true, for pstats/snakeviz
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    path = ((job["result"] or {}).get("meta") or {}).get("profile", {}).get("path")
+    if not path or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail=f"Job {job_id} has no profile")
+    return FileResponse(path, media_type="application/octet-stream", filename=os.path.basename(path))
+
+# Parquet/Arrow IPC media types for columnar results
+MEDIA_TYPES = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.file",
+}
+
+@app.get("/jobs/{job_id}/result")
+def job_result(job_id: str, format: str = None):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is {job['status']}")
+    fmt = format or job["params"].get("output_format", "json")
+    if fmt not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(OUTPUT_FORMATS)}")
+    if fmt == "json":
+        return ResultResponse(job["result"])
+    if "forecasted_products" not in job["result"]:
+        raise HTTPException(status_code=400, detail=f"Job {job_id} has no forecasts to export as {fmt}")
+    return Response(
+        content=forecasts_to_bytes(job["result"], fmt),
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="forecast_{job_id}.{fmt}"'},
+    )
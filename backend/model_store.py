@@ -0,0 +1,86 @@
+import os, pickle, hashlib
+import pandas as pd
+
+
+# -------------------------------
+# Series fingerprints
+# -------------------------------
+def series_fingerprint(prod, train, columns, method):
+    """
+    Hash a product's preprocessed training rows together with how it is
+    modelled. Gap filling is per product, so edits to other products leave
+    the hash alone; a new month on the panel's grid changes every product's
+    rows (and so its hash), since the model has to see that month.
+    """
+    h = hashlib.sha256()
+    h.update(f"{method}|{prod}|{','.join(columns)}".encode())
+    h.update(pd.util.hash_pandas_object(train[columns], index=False).values.tobytes())
+    return h.hexdigest()
+
+
+# -------------------------------
+# Persistent fitted-model store
+# -------------------------------
+class ModelStore:
+    """
+    Fitted per-product models on disk, keyed by series_fingerprint.
+
+    A model is reused when its product's history is exactly what it was
+    fitted on: re-runs of the same panel, or a panel where only some
+    products' rows were corrected (only those are refit). Appending a month
+    refits every product; the store does not save that work.
+
+    Only a directory path is held, so the store pickles cheaply into pool
+    workers and every process reads and writes the same files. prune()
+    drops the least recently used models once the store exceeds max_bytes.
+    """
+
+    def __init__(self, root, max_bytes=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.pkl")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                model = pickle.load(f)
+            os.utime(path)
+            return model
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def put(self, key, model):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    def prune(self):
+        if not self.max_bytes:
+            return
+        entries = []
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                if not name.endswith(".pkl"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        total = sum(e[1] for e in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,214 @@
+import cProfile, io, os, pstats, resource, sys, threading, time, uuid
+from contextlib import contextmanager
+import numpy as np
+
+
+# -------------------------------
+# Per-run instrumentation
+# -------------------------------
+# Upper bounds (seconds) of the per-product fit duration histogram
+FIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Fit outcomes reported by _forecast_product: a model was fitted, a stored
+# model was reused, the history was too short for the model (last value), the
+# fit raised and the last value was used instead; panel counts products
+# forecast by a vectorized panel method (no per-product timing)
+OUTCOMES = ('fit', 'cached', 'fallback', 'error', 'panel')
+SLOWEST_N = 10
+# Distinct exceptions listed under meta['timings']['errors']
+ERRORS_N = 5
+PROFILE_DIR = os.environ.get("FORECAST_PROFILE_DIR", "profiles")
+
+
+def _rss_bytes(who=resource.RUSAGE_SELF):
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _current_rss_bytes():
+    # resident memory now (Linux); None where /proc is not there
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _mb(n):
+    return None if n is None else round(n / 2**20, 1)
+
+
+class RunStats:
+    """
+    Timings of one run_forecast call: wall and CPU time of each stage, and
+    the duration and outcome of every product fit. CPU time is this
+    process's only; fits on a process pool show up in their durations, not
+    in the forecast stage's CPU time.
+
+    rss_mb is the process's resident memory when the run started and when
+    summary() was taken (other jobs running alongside count too); the
+    process_peak_* figures are ru_maxrss, the peak over the process's whole
+    life, not this run's.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.fits = []
+        self.panel = 0
+        self.rss_start = _current_rss_bytes()
+
+    @contextmanager
+    def stage(self, name):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            s = self.stages.setdefault(name, {'wall_sec': 0.0, 'cpu_sec': 0.0})
+            s['wall_sec'] += time.perf_counter() - wall
+            s['cpu_sec'] += time.process_time() - cpu
+
+    def add_fits(self, fits):
+        """fits: (product_code, seconds, outcome, error) tuples."""
+        self.fits.extend(fits)
+
+    def add_panel(self, n):
+        self.panel += n
+
+    def outcome_counts(self):
+        counts = dict.fromkeys(OUTCOMES, 0)
+        counts['panel'] = self.panel
+        for f in self.fits:
+            counts[f[2]] = counts.get(f[2], 0) + 1
+        return counts
+
+    def errors(self, top=ERRORS_N):
+        """The most frequent exceptions behind 'error' outcomes, with a product that raised each."""
+        seen = {}
+        for prod, _, outcome, error in self.fits:
+            if outcome == 'error':
+                entry = seen.setdefault(error, {'error': error, 'count': 0, 'example': str(prod)})
+                entry['count'] += 1
+        return sorted(seen.values(), key=lambda e: -e['count'])[:top]
+
+    def summary(self, slowest=SLOWEST_N):
+        """What meta['timings'] holds."""
+        sec = np.array([f[1] for f in self.fits], dtype=float)
+        out = {
+            'stages': {k: {n: round(v, 4) for n, v in s.items()} for k, s in self.stages.items()},
+            'fits': {'count': len(self.fits) + self.panel, **self.outcome_counts()},
+            'errors': self.errors(),
+            'fit_sec': None,
+            'slowest': [{'product_code': str(f[0]), 'sec': round(f[1], 4), 'outcome': f[2]}
+                        for f in sorted(self.fits, key=lambda f: -f[1])[:slowest]],
+            'rss_mb': {'start': _mb(self.rss_start), 'end': _mb(_current_rss_bytes())},
+            'process_peak_rss_mb': _mb(_rss_bytes()),
+            'process_peak_rss_children_mb': _mb(_rss_bytes(resource.RUSAGE_CHILDREN)),
+        }
+        if len(sec):
+            # bucket i: fits over the previous bound and up to FIT_BUCKETS[i] seconds
+            counts = np.bincount(np.searchsorted(FIT_BUCKETS, sec), minlength=len(FIT_BUCKETS) + 1)
+            out['fit_sec'] = {
+                'total': round(float(sec.sum()), 4),
+                'mean': round(float(sec.mean()), 4),
+                'p50': round(float(np.percentile(sec, 50)), 4),
+                'p95': round(float(np.percentile(sec, 95)), 4),
+                'max': round(float(sec.max()), 4),
+                'histogram': {f'le_{b}': int(n) for b, n in zip(FIT_BUCKETS + ('inf',), counts)},
+            }
+        return out
+
+
+@contextmanager
+def cprofile(enabled=True, top=25):
+    """
+    cProfile the calling thread. Yields a dict that gets the .prof dump path
+    (under PROFILE_DIR; open it with pstats or snakeviz) and the top functions
+    by cumulative time. Work in pool processes is not profiled.
+    """
+    info = {}
+    if not enabled:
+        yield info
+        return
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        yield info
+    finally:
+        prof.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"forecast_{time.strftime('%Y%m%d-%H%M%S')}_{uuid.uuid4().hex[:6]}.prof")
+        prof.dump_stats(path)
+        text = io.StringIO()
+        pstats.Stats(prof, stream=text).sort_stats('cumulative').print_stats(top)
+        info['path'] = path
+        info['top'] = [l for l in text.getvalue().splitlines() if l.strip()][-top - 1:]
+
+
+# -------------------------------
+# Process-wide metrics (/metrics)
+# -------------------------------
+class Metrics:
+    """Counters and a fit-duration histogram summed over every run, in Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.runs = {}
+        self.stage_sec = {}
+        self.stage_cpu_sec = {}
+        self.fits = dict.fromkeys(OUTCOMES, 0)
+        self.fit_buckets = [0] * (len(FIT_BUCKETS) + 1)
+        self.fit_sum = 0.0
+
+    def observe(self, stats, method, cache='off'):
+        sec = np.array([f[1] for f in stats.fits], dtype=float)
+        with self._lock:
+            self.runs[(method, cache)] = self.runs.get((method, cache), 0) + 1
+            for name, s in stats.stages.items():
+                self.stage_sec[name] = self.stage_sec.get(name, 0.0) + s['wall_sec']
+                self.stage_cpu_sec[name] = self.stage_cpu_sec.get(name, 0.0) + s['cpu_sec']
+            for outcome, n in stats.outcome_counts().items():
+                self.fits[outcome] = self.fits.get(outcome, 0) + n
+            if len(sec):
+                # per bucket here; render() makes them cumulative
+                counts = np.bincount(np.searchsorted(FIT_BUCKETS, sec), minlength=len(FIT_BUCKETS) + 1)
+                self.fit_buckets = [a + int(b) for a, b in zip(self.fit_buckets, counts)]
+                self.fit_sum += float(sec.sum())
+
+    def render(self, gauges=None):
+        """Prometheus exposition text; gauges adds {name: value} lines."""
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label}}} {value}" if label else f"{name} {value}")
+
+        with self._lock:
+            metric('forecast_runs_total', 'counter', 'run_forecast calls.',
+                   [({'method': m, 'cache': c}, n) for (m, c), n in sorted(self.runs.items())])
+            metric('forecast_stage_seconds_total', 'counter', 'Wall time spent in each pipeline stage.',
+                   [({'stage': k}, round(v, 6)) for k, v in sorted(self.stage_sec.items())])
+            metric('forecast_stage_cpu_seconds_total', 'counter', 'API process CPU time in each stage.',
+                   [({'stage': k}, round(v, 6)) for k, v in sorted(self.stage_cpu_sec.items())])
+            metric('forecast_product_fits_total', 'counter', 'Per-product forecasts by outcome.',
+                   [({'outcome': k}, n) for k, n in self.fits.items()])
+            total, samples = 0, []
+            for bound, n in zip(FIT_BUCKETS + ('+Inf',), self.fit_buckets):
+                total += n
+                samples.append(({'le': bound}, total))
+            metric('forecast_product_fit_seconds', 'histogram', 'Duration of per-product model fits.', [])
+            lines.extend(f'forecast_product_fit_seconds_bucket{{le="{l["le"]}"}} {n}' for l, n in samples)
+            lines.append(f"forecast_product_fit_seconds_sum {round(self.fit_sum, 6)}")
+            lines.append(f"forecast_product_fit_seconds_count {total}")
+        metric('process_peak_rss_bytes', 'gauge', 'Peak resident memory of the API process.',
+               [({}, _rss_bytes())])
+        metric('process_children_peak_rss_bytes', 'gauge', 'Peak resident memory of exited child processes.',
+               [({}, _rss_bytes(resource.RUSAGE_CHILDREN))])
+        for name, value in (gauges or {}).items():
+            metric(name, 'gauge', name.replace('_', ' ') + '.', [({}, value)])
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Metrics()
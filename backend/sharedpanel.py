@@ -0,0 +1,117 @@
+import os, tempfile, uuid
+import numpy as np
+import pandas as pd
+
+
+# -------------------------------
+# Panel shared with pool workers
+# -------------------------------
+# Where the panel files go: tmpfs when there is one, so they never touch disk
+SHARED_DIR = os.environ.get("FORECAST_SHARED_DIR") or (
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir())
+# Byte alignment of every array in the file
+_ALIGN = 64
+
+
+class SharedPanel:
+    """
+    preprocess_panel output laid out column by column in one memory-mapped
+    file for process pool workers: rows sorted by product then month, an
+    int32 month offset per row, the value columns in the panel's own dtypes
+    (regressors are float32 from load_data; sales stay float64 so fits match
+    the in-process path exactly) and an int64 (products + 1) row offset index.
+
+    chunks() splits the products into PanelChunks, which pickle as the file
+    path, the layout and their product codes. A worker maps the file
+    read-only and slices each product's rows by offset, so the workers share
+    one copy of the panel through the page cache instead of each getting its
+    own pickled product frames. Use it as a context manager: the file is
+    removed on exit (a worker still mapping it keeps it until it is done).
+    """
+
+    def __init__(self, processed_df, columns, root=None):
+        codes, products = pd.factorize(processed_df['product_code'], sort=True)
+        months = processed_df['date'].to_numpy(dtype='datetime64[M]')
+        self.base = months.min() if len(months) else np.datetime64('1970-01', 'M')
+        offset = (months - self.base).astype(np.int32)
+        order = np.lexsort((offset, codes))
+        counts = np.bincount(codes, minlength=len(products))
+
+        self.products = np.asarray(products, dtype=object)
+        self.columns = list(columns)
+        arrays = {
+            '__offsets': np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+            '__month': offset[order],
+            **{c: processed_df[c].to_numpy()[order] for c in self.columns},
+        }
+        self.layout = []
+        self.path = os.path.join(root or SHARED_DIR, f"panel_{uuid.uuid4().hex}.bin")
+        pos = 0
+        with open(self.path, 'wb') as f:
+            for name, a in arrays.items():
+                a = np.ascontiguousarray(a)
+                pos = -(-pos // _ALIGN) * _ALIGN
+                f.seek(pos)
+                f.write(a.data)
+                self.layout.append((name, a.dtype.str, pos, len(a)))
+                pos += a.nbytes
+        self.nbytes = pos
+
+    def __len__(self):
+        return len(self.products)
+
+    def chunks(self, chunk_size, order=None):
+        """PanelChunks of chunk_size products, in product order or in the order of the codes given."""
+        index = np.arange(len(self.products)) if order is None else pd.Index(self.products).get_indexer(order)
+        return [PanelChunk(self.path, self.layout, self.base, self.columns, index[i:i + chunk_size],
+                           self.products[index[i:i + chunk_size]])
+                for i in range(0, len(index), chunk_size)]
+
+    def close(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _attach(path, layout):
+    buf = np.memmap(path, dtype=np.uint8, mode='r')
+    return {name: buf[pos:pos + n * np.dtype(dtype).itemsize].view(dtype)
+            for name, dtype, pos, n in layout}
+
+
+class PanelChunk:
+    """
+    Some products of a SharedPanel (index: their positions in it). Iterating
+    it maps the file and yields (product_code, frame) pairs like a
+    product_code groupby, with the date, product_code and exported value
+    columns.
+    """
+
+    def __init__(self, path, layout, base, columns, index, products):
+        self.path = path
+        self.layout = layout
+        self.base = base
+        self.columns = columns
+        self.index = index
+        self.products = products
+
+    def __len__(self):
+        return len(self.products)
+
+    def __iter__(self):
+        views = _attach(self.path, self.layout)
+        offsets, months = views['__offsets'], views['__month']
+        for i, prod in zip(self.index, self.products):
+            lo, hi = offsets[i], offsets[i + 1]
+            yield prod, pd.DataFrame({
+                'date': (self.base + months[lo:hi]).astype('datetime64[ns]'),
+                'product_code': prod,
+                **{c: np.array(views[c][lo:hi]) for c in self.columns},
+            })
@@ -0,0 +1,215 @@
+import io, os, tempfile, threading, time
+
+
+class QuotaExceededError(Exception):
+    pass
+
+
+# -------------------------------
+# Received uploads
+# -------------------------------
+class Upload:
+    """
+    One uploaded file, owned by a single request or job: the bytes in memory
+    (source is a BytesIO named after the upload, which read_sales_file and
+    cache_key take like a path) or a spooled temp file. close() drops it.
+    """
+
+    def __init__(self, filename, data=None, path=None, store=None):
+        self.filename = filename
+        self.path = path
+        self.store = store
+        self.size = len(data) if data is not None else os.path.getsize(path)
+        self._data = data
+
+    @property
+    def in_memory(self):
+        return self._data is not None
+
+    @property
+    def source(self):
+        """A path, or a fresh buffer over the bytes; pass it where a file path goes."""
+        if self._data is None:
+            return self.path
+        buf = io.BytesIO(self._data)
+        buf.name = self.filename
+        return buf
+
+    def close(self):
+        self._data = None
+        if self.path is not None:
+            if self.store is not None:
+                self.store.release(self)
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class UploadStore:
+    """
+    Receives multipart uploads. Files up to memory_bytes stay in memory and
+    are parsed straight from the buffer. Bigger ones are copied in
+    chunk_bytes pieces to a unique temp file under root that lives until its
+    Upload is closed (when the request or job using it ends).
+
+    Each process spools into its own folder, root/<pid>, so servers sharing
+    root never delete each other's files. Spooled files under root count
+    against max_disk_bytes. Before spooling, leftovers no live upload owns
+    (this process's, and those of processes that are gone, e.g. a crashed or
+    restarted server) are evicted oldest first while root is over the quota;
+    an upload that would take the files of running servers past it fails
+    with QuotaExceededError. sweep() removes leftovers older than
+    max_age_sec and runs at construction.
+    """
+
+    def __init__(self, root, memory_bytes=8 * 1024 * 1024, max_disk_bytes=4 * 1024**3,
+                 chunk_bytes=1024 * 1024, max_age_sec=3600):
+        self.root = root
+        self.memory_bytes = memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.chunk_bytes = chunk_bytes
+        self.max_age_sec = max_age_sec
+        self._live = {}
+        self._orphan_bytes = 0
+        self._held_bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self.sweep()
+
+    async def receive(self, upload):
+        """Read a starlette UploadFile into an Upload; raises QuotaExceededError."""
+        filename = os.path.basename(upload.filename or "upload.csv")
+        head = await upload.read(self.memory_bytes + 1)
+        if len(head) <= self.memory_bytes:
+            return Upload(filename, data=head)
+
+        # keep the extension: read_sales_file picks the parser by it
+        self._make_room(len(head))
+        # the pid is read here, not in __init__, in case the store was made before a fork
+        folder = os.path.join(self.root, str(os.getpid()))
+        os.makedirs(folder, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix="upload_", suffix=os.path.splitext(filename)[1], dir=folder)
+        try:
+            size = 0
+            with os.fdopen(fd, "wb") as f:
+                chunk = head
+                while chunk:
+                    size += len(chunk)
+                    self._reserve(path, size)
+                    f.write(chunk)
+                    chunk = await upload.read(self.chunk_bytes)
+        except BaseException:
+            with self._lock:
+                self._live.pop(path, None)
+            os.remove(path)
+            raise
+        return Upload(filename, path=path, store=self)
+
+    def release(self, upload):
+        with self._lock:
+            self._live.pop(upload.path, None)
+
+    def disk_bytes(self):
+        with self._lock:
+            return sum(self._live.values())
+
+    def sweep(self, max_age_sec=None):
+        """Remove files no live upload owns that are older than max_age_sec; returns the count."""
+        cutoff = time.time() - (self.max_age_sec if max_age_sec is None else max_age_sec)
+        old = [path for mtime, _, path in self._scan()[0] if mtime < cutoff]
+        removed = sum(self._remove(path) for path in old)
+        for name in os.listdir(self.root):
+            # folders of processes that are gone, once emptied
+            if name.isdigit() and int(name) != os.getpid() and not _running(int(name)):
+                try:
+                    os.rmdir(os.path.join(self.root, name))
+                except OSError:
+                    pass
+        return removed
+
+    def _make_room(self, incoming):
+        orphans, held = self._scan()
+        left = sum(size for _, size, _ in orphans)
+        used = self.disk_bytes() + held + left + incoming
+        for _, size, path in orphans:
+            if used <= self.max_disk_bytes:
+                break
+            if self._remove(path):
+                used -= size
+                left -= size
+        self._orphan_bytes = left
+        self._held_bytes = held
+
+    def _reserve(self, path, size):
+        with self._lock:
+            self._live[path] = size
+            total = sum(self._live.values())
+        if total + self._held_bytes + self._orphan_bytes > self.max_disk_bytes:
+            # the file grew past what the last scan left room for
+            self._make_room(0)
+        if total + self._held_bytes > self.max_disk_bytes:
+            raise QuotaExceededError(f"upload storage is full (limit {self.max_disk_bytes // 2**20} MB, "
+                                     "held by queued jobs), try again later")
+
+    def _scan(self):
+        # files under root no live upload owns, oldest first (this process's
+        # folder, folders of processes that are gone, files left in root
+        # itself), and the bytes other running processes hold
+        with self._lock:
+            live = set(self._live)
+        orphans, held = [], 0
+        for name in os.listdir(self.root):
+            entry = os.path.join(self.root, name)
+            if not os.path.isdir(entry):
+                paths, mine = [entry], True
+            elif name.isdigit():
+                paths = [os.path.join(entry, n) for n in _listdir(entry)]
+                mine = int(name) == os.getpid() or not _running(int(name))
+            else:
+                continue
+            for path in paths:
+                if path in live:
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if mine:
+                    orphans.append((st.st_mtime, st.st_size, path))
+                else:
+                    held += st.st_size
+        return sorted(orphans), held
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+
+def _listdir(path):
+    try:
+        return os.listdir(path)
+    except OSError:
+        return []
+
+
+def _running(pid):
+    # signal 0 checks the process exists without touching it
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
@@ -0,0 +1,109 @@
+import threading, time, traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import forecasting
+
+
+def _init_worker(method):
+    # runs once in every worker process as it starts
+    try:
+        forecasting.warm_up(method)
+    except Exception:
+        print(f"[worker] warm-up failed:\n{traceback.format_exc()}")
+
+def _ping():
+    return True
+
+
+# -------------------------------
+# Warm model-worker pool
+# -------------------------------
+class WorkerPool:
+    """
+    Long-lived process pool for per-product fits.
+
+    Each worker imports the model backend and fits a small synthetic series
+    when it starts (forecasting.warm_up), and the workers are kept between
+    requests, so only the pool start pays for Prophet/Stan loading. start()
+    warms up in a background thread; ready() turns true once every worker has
+    finished. A pool broken by a crashed worker is replaced on the next map().
+    """
+
+    def __init__(self, max_workers=2, method=None):
+        self.max_workers = max_workers
+        self.method = method
+        self.warmup_sec = None
+        self._executor = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self, wait=False):
+        thread = threading.Thread(target=self._warm, name="worker-pool-warmup", daemon=True)
+        thread.start()
+        if wait:
+            thread.join()
+        return self
+
+    def ready(self):
+        return self._ready.is_set()
+
+    def map(self, fn, *iterables, timeout=None, max_in_flight=None):
+        """
+        Executor.map over the warm workers; results are yielded in order.
+        max_in_flight caps the tasks submitted at once (e.g. to use fewer
+        workers than the pool has); the rest are submitted as results are
+        taken. Closing the generator cancels the tasks not yet started.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._new_executor()
+            executor = self._executor
+        try:
+            if not max_in_flight or max_in_flight >= self.max_workers:
+                yield from executor.map(fn, *iterables, timeout=timeout)
+                return
+            end = time.monotonic() + timeout if timeout is not None else None
+            args = iter(zip(*iterables))
+            pending = deque()
+            try:
+                for task in args:
+                    pending.append(executor.submit(fn, *task))
+                    if len(pending) >= max_in_flight:
+                        yield pending.popleft().result(None if end is None else max(end - time.monotonic(), 0))
+                while pending:
+                    yield pending.popleft().result(None if end is None else max(end - time.monotonic(), 0))
+            finally:
+                for f in pending:
+                    f.cancel()
+        except BrokenProcessPool:
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+                    self._ready.clear()
+            self.start()
+            raise
+
+    def shutdown(self, wait=False):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self.max_workers,
+                                   initializer=_init_worker, initargs=(self.method,))
+
+    def _warm(self):
+        started = time.perf_counter()
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._new_executor()
+            executor = self._executor
+        # one task per worker makes the executor spawn (and so warm) all of them
+        for f in [executor.submit(_ping) for _ in range(self.max_workers)]:
+            f.result()
+        self.warmup_sec = round(time.perf_counter() - started, 3)
+        self._ready.set()
+        print(f"[workers] {self.max_workers} warm in {self.warmup_sec}s")
@@ -50,13 +50,11 @@ const handleGenerateForecast = async () => {
    formData.append("start_month", formatMonth(startMonth));
 formData.append("end_month", formatMonth(endMonth));
 
-    const response = await fetch('http://127.0.0.1:8000/forecast', {
-      method: 'POST',
-      body: formData, // do NOT set Content-Type manually
+    // products show up as they are forecast instead of after the whole run
+    const data = await ApiService.streamForecast(formData, (partial) => {
+      setForecastData(partial);
+      setShowForecast(true);
     });
-
-    console.log(response);
-    const data = await response.json();
     setForecastData(data);
     setShowForecast(true);
   } catch (error) {
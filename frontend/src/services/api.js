@@ -1,3 +1,5 @@
+const API_URL = 'http://127.0.0.1:8000';
+
 export class ApiService {
   static async generateForecast(file, startMonth, endMonth) {
     const formData = new FormData();
@@ -5,7 +7,7 @@ export class ApiService {
     formData.append('start_month', startMonth);
     formData.append('end_month', endMonth);
 
-    const response = await fetch('http://127.0.0.1:8000/forecast', {
+    const response = await fetch(`${API_URL}/forecast`, {
       method: 'POST',
       body: formData, // <-- do NOT set Content-Type manually
     });
@@ -13,6 +15,75 @@ export class ApiService {
     if (!response.ok) {
       throw new Error(`API request failed: ${response.status}`);
     }
-    return response.json();
+    const { job_id } = await response.json();
+    return ApiService.waitForJob(job_id);
+  }
+
+  // /forecast/stream sends NDJSON records as products finish; onUpdate gets
+  // the result built so far (same shape as a job result) after every read
+  static async streamForecast(formData, onUpdate) {
+    const response = await fetch(`${API_URL}/forecast/stream`, {
+      method: 'POST',
+      body: formData,
+    });
+    if (!response.ok) {
+      throw new Error(`API request failed: ${response.status}`);
+    }
+
+    let result = null;
+    const apply = (record) => {
+      if (record.type === 'start') {
+        result = {
+          forecasted_products: record.months.map((month) => ({ [month]: {} })),
+          metrics: {},
+          aggregated_metrics: {},
+          meta: { method: record.method, generated_on: new Date().toISOString(), last_dates_per_product: {} },
+        };
+      } else if (record.type === 'forecast') {
+        result.forecasted_products.forEach((entry) => {
+          const month = Object.keys(entry)[0];
+          entry[month][record.product_code] = record.forecast[month] ?? null;
+        });
+        if (record.metrics) result.metrics[record.product_code] = record.metrics;
+        result.meta.last_dates_per_product[record.product_code] = null;
+      } else if (record.type === 'summary') {
+        result.aggregated_metrics = record.aggregated_metrics;
+        result.meta = record.meta;
+      } else if (record.type === 'error') {
+        throw new Error(record.detail || 'Forecast failed');
+      }
+    };
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = '';
+    for (;;) {
+      const { done, value } = await reader.read();
+      buffered += decoder.decode(value || new Uint8Array(), { stream: !done });
+      const lines = buffered.split('\n');
+      buffered = lines.pop();
+      lines.filter((line) => line.trim()).forEach((line) => apply(JSON.parse(line)));
+      if (result && onUpdate) onUpdate({ ...result, forecasted_products: [...result.forecasted_products] });
+      if (done) break;
+    }
+    if (buffered.trim()) apply(JSON.parse(buffered));
+    return result;
+  }
+
+  // /forecast only queues the work; poll the job until it finishes
+  static async waitForJob(jobId, intervalMs = 1000) {
+    for (;;) {
+      const response = await fetch(`${API_URL}/jobs/${jobId}`);
+      if (!response.ok) {
+        throw new Error(`API request failed: ${response.status}`);
+      }
+      const job = await response.json();
+      if (job.status === 'done') return job.result;
+      if (job.status === 'failed') throw new Error(job.error || 'Forecast job failed');
+      if (job.status === 'cancelled') {
+        throw new Error(`Forecast job was cancelled${job.error ? `: ${job.error}` : ''}`);
+      }
+      await new Promise((resolve) => setTimeout(resolve, intervalMs));
+    }
   }
 }